@@ -2,4 +2,4 @@ from active_record.setup import *
 from active_record.helpers import *
 from active_record.base import Base
 
-__all__ = ['setup', 'helpers', 'schema', 'base']
+__all__ = ['setup', 'helpers', 'schema', 'base', 'loader', 'instrumentation', 'profiler', 'buffered_writer', 'change_feed', 'testing', 'locking']
@@ -14,6 +14,8 @@ class Table():
     self.value_set   = []
     self.sets        = OrderedDict()
     self.aggregates  = []
+    self.windows     = []
+    self.ctes        = OrderedDict()
     self.froms       = [self.table_name]
     self.wheres      = OrderedDict()
     self.orders      = []
@@ -24,6 +26,11 @@ class Table():
     self.offsets     = None
     self.locks       = False
     self.unions      = []
+    self.conflicts   = None
+    self.returnings  = []
+    self.connection  = None
+    self.defers      = []
+    self.searches    = None
 
     return self
 
@@ -35,6 +42,8 @@ class Table():
     table.value_set   = self.value_set[:]
     table.sets        = self.sets.copy()
     table.aggregates  = self.aggregates[:]
+    table.windows     = self.windows[:]
+    table.ctes        = self.ctes.copy()
     table.froms       = self.froms[:]
     table.wheres      = self.wheres.copy()
     table.orders      = self.orders[:]
@@ -45,6 +54,11 @@ class Table():
     table.offsets     = self.offsets
     table.locks       = self.locks
     table.unions      = self.unions[:]
+    table.conflicts   = self.conflicts
+    table.returnings  = self.returnings[:]
+    table.connection  = self.connection
+    table.defers      = self.defers[:]
+    table.searches    = self.searches
 
     return table
 
@@ -68,8 +82,10 @@ class Table():
     if '*' in cols:
       copy.projections[table_name] = ['*']
     else:
-      for col in cols:
-        copy.projections[table_name].append(col)
+      # Selected columns take the place of the default `*`. The list is
+      # rebuilt, as copies share it with the table they were copied from.
+      fields = [field for field in copy.projections[table_name] if field != '*']
+      copy.projections[table_name] = fields + list(cols)
     return copy
 
   # Specify that the database adapter should include the listed tables in the
@@ -85,10 +101,13 @@ class Table():
     return copy
 
   # A slightly more restrictive form of .select(). Only accounts for explicit
-  # column names to be used. Useful for inserts where .columns() is more
-  # semantically correct than .select()
+  # column names to be used, replacing the default projection of `*`. Useful
+  # for inserts where .columns() is more semantically correct than .select()
   def columns(self, *cols):
-    return self.select(*cols, table_name=self.table_name)
+    copy = self.copy()
+
+    copy.projections[copy.table_name] = list(cols)
+    return copy
 
   # Specify that the database adapter should, on an insert or update query,
   # include the values specified here. `values` is a tuple inline with each
@@ -104,6 +123,28 @@ class Table():
 
     return copy
 
+  # Specify that the database adapter should, on an insert query, resolve rows
+  # which clash with an existing record on the given (uniquely indexed) columns
+  # by updating the existing record instead. `update` lists the columns which
+  # should take on the inserted values; if it is empty, clashing rows are
+  # skipped entirely.
+  #
+  #     .columns('email', 'name').values(...).on_conflict('email', update=['name'])
+  def on_conflict(self, *columns, **kwargs):
+    copy = self.copy()
+
+    copy.conflicts = { 'columns': list(columns), 'update': list(kwargs.get('update', [])) }
+    return copy
+
+  # Specify that the database adapter should return these columns of every row
+  # written by an insert query, if the database supports it.
+  def returning(self, *cols):
+    copy = self.copy()
+
+    for col in cols:
+      copy.returnings.append(col)
+    return copy
+
   # Specify that the database adapter should, on an update query, assign the
   # provided attributes with new values as given here.
   def set(self, **assignments):
@@ -125,6 +166,64 @@ class Table():
 
     return copy
 
+  # Specify that the database adapter should include a window function in the
+  # select statement of the query, as the column `name`: a function computed
+  # for each row over the rows around it, without grouping them together. The
+  # rows are split into groups by the `partition` columns (a single column or a
+  # list), and ordered within each group by `order` (in the same form).
+  # `frame` limits which rows are included, in SQL.
+  #
+  #     .window('position', 'ROW_NUMBER()', partition='league_id', order='score DESC')
+  #     .window('running_total', 'SUM(amount)', order=['created_at', 'id'])
+  #
+  # Window functions need SQLite 3.25 or later.
+  def window(self, name, function, partition=None, order=None, frame=None):
+    copy = self.copy()
+
+    copy.windows.append({
+      'name':      name,
+      'function':  function,
+      'partition': _listed(partition),
+      'order':     _listed(order),
+      'frame':     frame
+    })
+    return copy
+
+  # Specify that the database adapter should define a common table expression,
+  # which the query can then refer to by `name` as if it were a table. The
+  # query is a relation or arel table, or SQL (needed for `recursive` ones,
+  # which refer to themselves).
+  #
+  #     totals = Order.relation.select('person_id').aggregate('SUM(total) AS spent').group('person_id')
+  #     Person.arel_table.with_cte('totals', totals).join('totals', on={ 'this': 'id', 'that': 'person_id' })
+  def with_cte(self, name, query, recursive=False):
+    copy = self.copy()
+
+    copy.ctes[name] = { 'query': _subquery(query) or query, 'recursive': recursive }
+    return copy
+
+  # Specify that the database adapter should select from the rows of the given
+  # query (a relation or arel table) instead of from the table itself. The rows
+  # take on this table's name, so the rest of the query, and the models built
+  # from its records, treat them as rows of this table.
+  def from_query(self, query):
+    copy = self.copy()
+
+    copy.froms = [_subquery(query)]
+    return copy
+
+  # Keep only the first `n` rows of each group of rows with the same values
+  # for the `partition` columns, in the given `order` within the group. Each
+  # row's place in its group is available as the column `name`.
+  #
+  #     # The top 3 players of each league.
+  #     .top_per_group(3, partition='league_id', order='score DESC')
+  def top_per_group(self, n, partition, order, name='position'):
+    ranked = self.window(name, 'ROW_NUMBER()', partition, order)
+    table = Table.new(self.table_name).from_query(ranked).where(**{ name: (None, n) })
+    table.connection = self.connection
+    return table
+
   # Specify that the database adapter should only retrieve records which pass
   # these conditions. The conditions are stored in a dictionary with a syntax
   # that allows for more supported conditions, but is not necessarily semantic.
@@ -136,6 +235,11 @@ class Table():
   #   - >=            .where(age=(10,None))     # None must be provided
   #   - BETWEEN       .where(age=(10,20))
   #   - IN            .where(age=[10, 15, 20])
+  #   - IN (SELECT)   .where(author_id=Person.relation.where(admin=True).select('id'))
+  #
+  # A query given as a condition (a relation or an arel table) is compiled into
+  # the statement as a subquery, so the database does the filtering rather than
+  # a list of ids fetched beforehand. It must select a single column.
   #
   # Everything else is done with direct sql queries:
   #   .where('name LIKE "J%"')
@@ -146,17 +250,36 @@ class Table():
   def where(self, *statements, **conditions):
     copy = self.copy()
 
-    for statement in statements:
-      if 'sql' not in copy.wheres:
-        copy.wheres['sql'] = []
-      copy.wheres['sql'].append(statement)
+    # Statement lists are rebuilt, as copies share them with the table they
+    # were copied from.
+    if statements:
+      copy.wheres['sql'] = copy.wheres.get('sql', []) + list(statements)
 
     for column, condition in conditions.iteritems():
       if column not in copy.wheres:
         copy.wheres[column] = []
-      copy.wheres[column] = condition
+      copy.wheres[column] = _subquery(condition) or condition
     return copy
 
+  # Specify that the database adapter should only retrieve records for which
+  # the given query (a relation or an arel table) finds at least one row.
+  #
+  # The query is correlated with this table the same way .join() matches
+  # tables, unless `on` says otherwise: by default, rows of the query's table
+  # whose `<this table's singular name>_id` is this table's id.
+  #
+  #     Person.relation.where_exists(Post.relation.where(published=True))
+  #     Post.relation.where_exists(Person.relation, on={ 'this': 'person_id', 'that': 'id' })
+  #
+  # Setting `on` to None leaves the query uncorrelated.
+  def where_exists(self, query, on={}):
+    return self._exists('exists', query, on)
+
+  # The opposite of .where_exists(): only retrieve records for which the given
+  # query finds no rows.
+  def where_not_exists(self, query, on={}):
+    return self._exists('not_exists', query, on)
+
   # Specify that the database adapter should arrange the records by these
   # columns, with priority going from first to last specified.
   #
@@ -189,10 +312,8 @@ class Table():
   def having(self, *statements, **conditions):
     copy = self.copy()
 
-    for statement in statements:
-      if 'sql' not in copy.havings:
-        copy.havings['sql'] = []
-      copy.havings['sql'].append(statement)
+    if statements:
+      copy.havings['sql'] = copy.havings.get('sql', []) + list(statements)
 
     for column, condition in conditions.iteritems():
       if column not in copy.havings:
@@ -248,14 +369,57 @@ class Table():
     copy.locks = value
     return copy
 
+  # Specify which of the configured connections the database adapter should
+  # run this query on. Adapters which only hold a single connection ignore
+  # this. See connection_adapters/replicated_adapter.py for the names that are
+  # understood when replicas are configured.
+  def using(self, name):
+    copy = self.copy()
+
+    copy.connection = name
+    return copy
+
+  # Specify that the database adapter should only find rows matching the given
+  # full-text query, best matches first unless another order is given. The
+  # table must have a full-text index (see Table.full_text() in the schema).
+  # Naming a `snippet` column includes an excerpt of it around the matches, as
+  # the `snippet` attribute, with the matches marked by `highlight`.
+  #
+  #     .search('sqlite NOT mysql', snippet='body')
+  def search(self, query, snippet=None, highlight=('[', ']')):
+    copy = self.copy()
+
+    copy.searches = { 'query': query, 'snippet': snippet, 'highlight': highlight }
+    return copy
+
+  # Specify that the database adapter should leave these columns out when
+  # selecting `*` from this table, fetching every other column instead.
+  # Explicitly selected columns are always fetched.
+  def defer(self, *cols):
+    copy = self.copy()
+
+    for col in cols:
+      if col not in copy.defers:
+        copy.defers.append(col)
+    return copy
+
+  # Undo .defer() for the given columns, or for every column if none are given.
+  def undefer(self, *cols):
+    copy = self.copy()
+
+    copy.defers = [col for col in copy.defers if cols and col not in cols]
+    return copy
+
   # Specify that the database adapter should perform a UNION query combining
-  # this and other's queries into a single statement. Unless otherwise specified
-  # by a database adapter, a UNION ALL will be performed.
+  # this and other's queries (relations or arel tables) into a single
+  # statement. Unless otherwise specified by a database adapter, a UNION ALL
+  # will be performed. Every query must select the same number of columns, and
+  # only this query's order and limit apply, to the combined rows.
   def union(self, *unions):
     copy = self.copy()
 
     for union in unions:
-      copy.unions.append(union)
+      copy.unions.append(_subquery(union) or union)
     return copy
 
 
@@ -274,3 +438,43 @@ class Table():
         copy.orders.append(order.replace('DESC', 'ASC'))
 
     return copy
+
+
+  # HELPERS
+  def _exists(self, kind, query, on):
+    copy = self.copy()
+
+    query = _subquery(query)
+    if query is None:
+      raise TypeError('.where_%s() takes a relation or an arel table' % kind)
+
+    if on is not None:
+      on = dict(on)
+      if 'this' not in on:
+        on['this'] = 'id'
+      if 'that' not in on:
+        on['that'] = AR.INFLECTOR.singular_noun(self.table_name)+'_id'
+      query = query.where('%s.%s = %s.%s' % (query.table_name, on['that'], self.table_name, on['this']))
+
+    copy.wheres[kind] = copy.wheres.get(kind, []) + [query]
+    return copy
+
+
+# A single value (like a column name) as a list of one.
+def _listed(value):
+  if value is None:
+    return []
+  if isinstance(value, basestring):
+    return [value]
+  return list(value)
+
+# The arel table of a query given in place of a value, or None if the value
+# isn't a query.
+def _subquery(value):
+  from active_record.relation import Relation
+
+  if isinstance(value, Table):
+    return value
+  if isinstance(value, Relation):
+    return value.arel_table
+  return None
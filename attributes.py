@@ -0,0 +1,89 @@
+from active_record.setup import *
+
+# Attributes
+#
+# Models read and write their columns through descriptors defined on the model
+# class, one for each column of its table, so an attribute access is a single
+# dictionary lookup on the instance's record rather than a trip through
+# Base.__getattr__() and Base.__setattr__().
+#
+# Descriptors for associations are defined along with the model class. Column
+# descriptors are defined from the table's metadata the first time an instance
+# is created, as the table may not exist when the model is defined, and again
+# the first time after the adapter's schema changes (say, after the schema is
+# loaded). Instances created in between don't look at the metadata at all.
+#
+# Until then, or for names which aren't columns of the table, Base.__getattr__()
+# and Base.__setattr__() handle attributes as they always have. Models with a
+# column named after one of their methods keep Base.__setattr__() for good.
+
+# Reads and writes one column of the instance's record.
+class ColumnAttribute(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __get__(self, inst, owner):
+    if inst is None:
+      return self
+    try:
+      return inst.record.values[self.name]
+    except KeyError:
+      # Not loaded (say, it was deferred or left out of a .select()).
+      return inst.__getattr__(self.name)
+
+  def __set__(self, inst, value):
+    inst.record.values[self.name] = value
+
+# Reads and writes one of the model's associations.
+class AssociationAttribute(object):
+  def __init__(self, association):
+    self.association = association
+
+  def __get__(self, inst, owner):
+    if inst is None:
+      return self
+    return self.association.get_association(inst)
+
+  def __set__(self, inst, value):
+    self.association.set_association(inst, value)
+
+
+# Define a descriptor for each of the model's associations.
+def define_associations(cls):
+  for name, association in cls.__dict__.get('associations', {}).iteritems():
+    setattr(cls, name, AssociationAttribute(association))
+
+# Whether the column descriptors of the model are up to date with the
+# adapter's schema. Checked for every new instance.
+def columns_defined(cls):
+  return cls.__dict__.get('_attribute_generation') == DB_ADAPTER.schema_generation
+
+# Define a descriptor for each column of the model's table, if the adapter's
+# metadata for it has changed since they were last defined.
+def define_columns(cls):
+  generation = DB_ADAPTER.schema_generation
+  types = DB_ADAPTER.column_types(cls.table_name)
+  cls._attribute_generation = generation
+  if not types or cls.__dict__.get('_attribute_types') is types:
+    return
+
+  hidden = False
+  for name in types:
+    # Never hide internals, methods or anything else the model defines.
+    if name in cls.reserved_attributes:
+      continue
+    if hasattr(cls, name) and not isinstance(getattr(cls, name), ColumnAttribute):
+      hidden = True
+      continue
+    setattr(cls, name, ColumnAttribute(name))
+
+  cls._attribute_types = types
+  # Once every column has a descriptor, writes can skip Base.__setattr__(), and
+  # any other names are set as plain instance attributes. Columns named after
+  # a method (`first`, `count`, ...) get no descriptor, so they are only
+  # stored in the record while Base.__setattr__() handles every write.
+  if hidden:
+    from active_record.base import Base
+    cls.__setattr__ = Base.__dict__['__setattr__']
+  else:
+    cls.__setattr__ = object.__setattr__
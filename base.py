@@ -1,6 +1,9 @@
 import active_record.helpers as helpers
 import active_record.arel    as arel
+import active_record.attributes as attributes
+from active_record.setup     import DB_ADAPTER
 from active_record.relation  import Relation
+from active_record.connection_adapters import sharded_adapter
 
 # Methods that are called from a class, but do not actually belong to it.
 # This includes validates(), belongs_to(), has_one(), has_many(), etc.
@@ -13,9 +16,17 @@ class Base(Relation):
   # not available to be used as column (attribute) names.
   reserved_attributes = [
     'record', 'exists', 'table_name', 'arel_table', 'model', 'relation',
-    'associations'
+    'associations', 'siblings', 'association_cache', 'locking_column',
+    'stored_shard_value'
   ]
 
+  # Records are locked optimistically when the table has this column (see
+  # locking.py). None turns locking off.
+  locking_column = 'lock_version'
+
+  # The most records whose deferred columns are fetched by a single query.
+  deferred_batch_size = 500
+
   # Create a new instance of this model which will represent the record that is
   # passed in.
   #
@@ -26,9 +37,20 @@ class Base(Relation):
   # any of the finder methods. They handle creating the record object which gets
   # passed in, as well as any other set up that needs to take place.
   def __init__(self, record=None, exists=False):
+    if not attributes.columns_defined(self.__class__):
+      attributes.define_columns(self.__class__)
+
     self.record = record
     self.exists = exists
     self.model  = self.__class__
+    # The instances loaded by the same query as this one (including this one).
+    # See result.py.
+    self.siblings = None
+    # The shard key value of the record as it is stored, which routes its
+    # updates to the right shard (see relation_methods.save()).
+    self.stored_shard_value = None
+    if exists and getattr(self.model, 'shard_key', None):
+      self.stored_shard_value = record.values.get(self.model.shard_key.column)
 
 
   # Return a string representation of all of the attributes of this model.
@@ -47,11 +69,13 @@ class Base(Relation):
 
   # Dynamic attribute accessors.
   #
-  # The following two methods provide dynamic access to the columns of the table
-  # that this object represents through a natural syntax. The goal is to require
-  # minimal effort from the user, as well as from the model designer. Any
-  # attribute that is loaded from the database will be accessible by simply
-  # using the .<attribute> syntax.
+  # Columns and associations are normally read and written through descriptors
+  # on the model class (see attributes.py). The following two methods are the
+  # fallback for anything those don't cover, and provide the same dynamic
+  # access to the columns of the table that this object represents through a
+  # natural syntax. The goal is to require minimal effort from the user, as well
+  # as from the model designer. Any attribute that is loaded from the database
+  # will be accessible by simply using the .<attribute> syntax.
   #
   # For an example, let's say we have a `Person` model which represents the
   # `people` table in our database. This table has the columns `name`, `age`,
@@ -86,6 +110,10 @@ class Base(Relation):
     # First handle mirrored attributes.
     if name in self.record.values:
       return self.record.values[name]
+    # Deferred columns are fetched the first time they are needed.
+    elif self.exists and name in getattr(self.model, 'deferred_columns', ()):
+      self._load_deferred()
+      return self.record.values.get(name)
     # Then handle association accesses.
     elif hasattr(self, 'associations') and name in self.associations:
       return self.associations[name].get_association(self)
@@ -107,6 +135,34 @@ class Base(Relation):
 
 
 
+  # Fetch the deferred columns of this instance, and of every sibling that is
+  # still missing them, with as few queries as possible.
+  def _load_deferred(self):
+    columns = self.deferred_columns
+    missing = [inst for inst in (self.siblings or [self])
+               if inst.exists and columns[0] not in inst.record.values]
+    if self not in missing:
+      missing.append(self)
+
+    by_id = {}
+    for inst in missing:
+      by_id.setdefault(inst.record.values['id'], []).append(inst)
+
+    ids = by_id.keys()
+    size = self.deferred_batch_size
+    for start in xrange(0, len(ids), size):
+      arel_table = self.arel_table.columns('id', *columns).where(id=ids[start:start + size])
+      for record in DB_ADAPTER.find(arel_table):
+        for inst in by_id[record.values['id']]:
+          inst.record.values.update(record.values)
+
+    # Rows deleted in the meantime have nothing to fetch. Mark them as loaded
+    # all the same, so they aren't queried again.
+    for inst in missing:
+      for column in columns:
+        inst.record.values.setdefault(column, None)
+
+
   # A simple meta class for active record, used to dynamicaly define class
   # level attributes, such as the table name for the model. These can all be
   # overriden by simply redefining the attribute in the model definition.
@@ -115,6 +171,15 @@ class Base(Relation):
       cls = type.__new__(meta, name, bases, dict)
       cls.table_name = helpers.make_table_name(name)
       cls.arel_table = arel.Table.new(cls.table_name)
+      attributes.define_associations(cls)
+
+      # Leave deferred columns out of the default projection.
+      if getattr(cls, 'deferred_columns', None):
+        cls.arel_table = cls.arel_table.defer(*cls.deferred_columns)
+
+      # Let the adapter know how to route the records of sharded models.
+      if getattr(cls, 'shard_key', None):
+        sharded_adapter.shard_keys[cls.table_name] = cls.shard_key
 
       return cls
 
@@ -0,0 +1,237 @@
+import atexit
+import threading
+import time
+import Queue
+
+from active_record.setup import *
+
+# Buffered Writer
+#
+# Takes new records off the caller's hands for models which buffer their
+# writes (see macros/buffers_writes.py). Model.enqueue() puts the record's
+# attributes on a bounded queue and returns straight away; a background thread
+# takes them off the queue and inserts them in batches, each batch a single
+# prepared INSERT in a transaction of its own. Many small inserts are written
+# for the cost of a few large ones, and the callers never wait on the disk:
+#
+#     Event.enqueue(kind='login', user_id=user.id)
+#
+# A batch is written once it is full, or once its oldest record has waited for
+# the model's `interval`. When the queue is full, .enqueue() waits for the
+# thread to make room, so a burst of records slows its callers down rather than
+# growing without bounds.
+#
+# Queued records are written before the process exits normally, and flush()
+# waits until everything queued so far is in the database. Records still in
+# the queue are lost if the process is killed, so only buffer writes which can
+# afford that.
+#
+# If the thread stops (it couldn't open its connection, say), the records left
+# in the queue are given up on, and .enqueue() and flush() raise WriterStopped
+# from then on, rather than waiting for a thread that isn't there.
+#
+# The thread writes through a connection of its own, so an in-memory database
+# can't be used. Buffered records are not validated by the writer (.enqueue()
+# runs the model's validations up front), and counter caches are not adjusted
+# for them.
+
+# Raised by .enqueue() when the queue stays full for longer than its timeout.
+class BufferFull(Queue.Full):
+  pass
+
+# Raised when records are queued for, or flushed by, a writer whose thread has
+# stopped (say, because it couldn't connect to the database). The error which
+# stopped it is the writer's `last_error`.
+class WriterStopped(Exception):
+  pass
+
+# Put on the queue to stop the thread, once everything before it is written.
+_stop = object()
+
+_writers = {}
+_lock    = threading.Lock()
+
+
+class BufferedWriter(object):
+  def __init__(self, model, max_size=10000, batch_size=500, interval=1.0, timeout=None,
+               retries=2, on_error=None):
+    self.model      = model
+    self.queue      = Queue.Queue(max_size)
+    self.batch_size = batch_size
+    self.interval   = interval
+    self.timeout    = timeout
+    self.retries    = retries
+    self.on_error   = on_error
+    self.adapter    = None
+    self.last_error = None
+    self.lock       = threading.Lock()
+    self.counts     = { 'enqueued': 0, 'written': 0, 'failed': 0, 'batches': 0 }
+    self.latency    = { 'last': 0.0, 'max': 0.0, 'total': 0.0 }
+
+    self.thread = threading.Thread(target=self._run, name='%s writer' % model.table_name)
+    self.thread.daemon = True
+    self.thread.start()
+
+  # Queue a record's attributes to be written.
+  def put(self, attrs):
+    self._check_running()
+    try:
+      self.queue.put(attrs, self.timeout != 0, self.timeout or None)
+    except Queue.Full:
+      raise BufferFull('The write buffer of "%s" is full' % self.model.table_name)
+    with self.lock:
+      self.counts['enqueued'] += 1
+
+  # Wait until every record queued so far has been written (or given up on).
+  # Raises WriterStopped if the thread has stopped, or stops while waiting.
+  def flush(self):
+    with self.queue.all_tasks_done:
+      self._check_running()
+      while self.queue.unfinished_tasks:
+        self.queue.all_tasks_done.wait(0.1)
+        self._check_running()
+
+  # Write out the queue and stop the thread.
+  def close(self):
+    if self.thread.is_alive():
+      self.queue.put(_stop)
+      self.thread.join()
+
+  # The state of the queue and of the writes so far. Latencies are the time
+  # taken to write a batch, in seconds.
+  def stats(self):
+    stats = dict(self.counts)
+    stats['depth'] = self.queue.qsize()
+    stats['running'] = self.thread.is_alive()
+    stats['last_flush_seconds'] = self.latency['last']
+    stats['max_flush_seconds']  = self.latency['max']
+    stats['mean_flush_seconds'] = self.latency['total'] / (self.counts['batches'] or 1)
+    return stats
+
+
+
+  # HELPERS
+  # Anything which stops the thread (failing to connect, say) is kept as the
+  # last error, and the records still queued are given up on.
+  def _run(self):
+    try:
+      # SQLite connections belong to the thread which opened them.
+      self.adapter = DB_ADAPTER.reopen()
+      self._loop()
+    except Exception as e:
+      self.last_error = e
+      self._discard()
+
+  def _loop(self):
+    stopping = False
+    while not stopping:
+      batch = self._next_batch()
+      stopping = _stop in batch
+      rows = [attrs for attrs in batch if attrs is not _stop]
+      try:
+        if rows:
+          self._write(rows)
+      finally:
+        for _ in batch:
+          self.queue.task_done()
+
+  def _discard(self):
+    rows = []
+    while True:
+      try:
+        attrs = self.queue.get_nowait()
+      except Queue.Empty:
+        break
+      if attrs is not _stop:
+        rows.append(attrs)
+      self.queue.task_done()
+
+    self._failed(rows)
+
+  def _check_running(self):
+    if not self.thread.is_alive():
+      raise WriterStopped('The writer of "%s" has stopped: %s' % (self.model.table_name, self.last_error))
+
+  # Wait for a record, then take any more that arrive within the interval, up
+  # to a full batch.
+  def _next_batch(self):
+    try:
+      batch = [self.queue.get(True, self.interval)]
+    except Queue.Empty:
+      return []
+
+    deadline = time.time() + self.interval
+    while len(batch) < self.batch_size and batch[-1] is not _stop:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(self.queue.get(True, remaining))
+      except Queue.Empty:
+        break
+    return batch
+
+  def _write(self, rows):
+    # Records with the same attributes are inserted by the same statement.
+    groups = {}
+    for attrs in rows:
+      groups.setdefault(tuple(sorted(attrs)), []).append(attrs)
+
+    for attempt in xrange(self.retries + 1):
+      started = time.time()
+      try:
+        with self.adapter.transaction():
+          for columns, group in groups.iteritems():
+            values = [tuple(attrs[col] for col in columns) for attrs in group]
+            self.adapter.insert_many(self.model.table_name, list(columns), values, commit=False)
+      except Exception as e:
+        self.last_error = e
+        continue
+
+      elapsed = time.time() - started
+      self.latency['last']  = elapsed
+      self.latency['max']   = max(self.latency['max'], elapsed)
+      self.latency['total'] += elapsed
+      self.counts['written'] += len(rows)
+      self.counts['batches'] += 1
+      return
+
+    self._failed(rows)
+
+  def _failed(self, rows):
+    if not rows:
+      return
+    self.counts['failed'] += len(rows)
+    if self.on_error:
+      # The thread has to carry on whatever the handler does.
+      try:
+        self.on_error(rows, self.last_error)
+      except Exception as e:
+        self.last_error = e
+
+
+# The writer of the given model, started the first time it is asked for.
+def writer(model):
+  options = getattr(model, 'write_buffer', None)
+  if options is None:
+    raise TypeError('"%s" does not buffer its writes (see buffers_writes())' % model.__name__)
+
+  with _lock:
+    if model not in _writers:
+      _writers[model] = BufferedWriter(model, **options)
+    return _writers[model]
+
+# Wait until everything queued for every model has been written.
+def flush_all():
+  for writer in _writers.values():
+    writer.flush()
+
+# Write out and stop every writer. Done automatically when the process exits.
+def close_all():
+  with _lock:
+    writers = _writers.values()
+    _writers.clear()
+  for writer in writers:
+    writer.close()
+
+atexit.register(close_all)
@@ -0,0 +1,116 @@
+import time
+from collections import namedtuple
+
+from active_record.setup import *
+import active_record.arel as arel
+
+# Change Feed
+#
+# Follows the changes made to tracked tables by every process using the
+# database, so that anything cached in this process can be dropped as soon as
+# (and only when) the records behind it change.
+#
+# Tables are tracked by loading the schema with `track_changes` (or with
+# DB_ADAPTER.track_changes()). Triggers on each tracked table then log every
+# insert, update and delete, in order, to a changelog table, in the same
+# transaction as the change:
+#
+#     schema.load(track_changes=True)
+#
+# A ChangeFeed reads the changelog from where it last left off, and hands each
+# change to its subscribers:
+#
+#     feed = ChangeFeed(tables=['people'])
+#     feed.subscribe(lambda change: cache.pop(change.row_id, None))
+#
+#     feed.poll()        # at the start of each request, say
+#
+# Reading the log is a single indexed query, which costs next to nothing when
+# there are no changes, so feeds can be polled often. A new feed starts from
+# the latest change; give `since` to replay older ones (say, after a restart,
+# from a position saved earlier).
+#
+# The changelog grows until it is pruned (see prune()). Feeds which fall
+# further behind than what was pruned miss the changes in between, so prune
+# well behind the slowest feed.
+#
+# With shards configured, each database keeps its own changelog. Give a feed
+# the adapter of a single shard (DB_ADAPTER.shards[<name>]) to follow it.
+
+# A single logged change. `op` is 'insert', 'update' or 'delete'.
+Change = namedtuple('Change', ['seq', 'table_name', 'row_id', 'op'])
+
+
+class ChangeFeed(object):
+  def __init__(self, tables=None, since=None, adapter=None):
+    self.adapter     = adapter or DB_ADAPTER
+    self.tables      = list(tables) if tables else None
+    self.subscribers = []
+    self.position    = self.latest() if since is None else since
+
+  # Call fn with every change read from now on.
+  def subscribe(self, fn):
+    self.subscribers.append(fn)
+
+  def unsubscribe(self, fn):
+    if fn in self.subscribers:
+      self.subscribers.remove(fn)
+
+  # The sequence number of the latest change logged so far.
+  def latest(self):
+    table = self._changelog().columns().aggregate('MAX(seq) AS seq')
+    return self.adapter.find(table)[0].values['seq'] or 0
+
+  # Read every change since the last poll, in order, handing each of them to
+  # the subscribers. Returns the list of changes.
+  def poll(self, batch_size=1000):
+    changes = []
+    while True:
+      batch = self._read(batch_size)
+      for change in batch:
+        for fn in self.subscribers[:]:
+          fn(change)
+        self.position = change.seq
+      changes.extend(batch)
+      if len(batch) < batch_size:
+        return changes
+
+  # Read every change since the last poll, returning the ids of the records
+  # that changed, by table.
+  def changed(self):
+    changed = {}
+    for change in self.poll():
+      changed.setdefault(change.table_name, set()).add(change.row_id)
+    return changed
+
+  # Poll every `interval` seconds, forever, yielding each non-empty list of
+  # changes. Meant to be run in a thread of its own.
+  def tail(self, interval=1.0):
+    while True:
+      changes = self.poll()
+      if changes:
+        yield changes
+      else:
+        time.sleep(interval)
+
+
+
+  # HELPERS
+  def _read(self, limit):
+    table = self._changelog().columns('seq', 'table_name', 'row_id', 'op')
+    table = table.where(seq=(self.position + 1, None)).order('seq').limit(limit)
+    if self.tables:
+      table = table.where('table_name IN (%s)' % ', '.join(map(self.adapter._quoted, self.tables)))
+    return [Change(**record.values) for record in self.adapter.find(table)]
+
+  # The changelog is read from the primary database when read replicas are
+  # configured, as they may be behind.
+  def _changelog(self):
+    return arel.Table.new(self.adapter.changelog_table).using('primary')
+
+
+# Delete the changes logged more than `seconds` ago.
+def prune(seconds, adapter=None):
+  adapter = adapter or DB_ADAPTER
+  table = arel.Table.new(adapter.changelog_table)
+  adapter.delete(table.where("changed_at < datetime('now', '-%d seconds')" % seconds))
@@ -1,4 +1,6 @@
-__all__ = ['sqlite3_adapter']
+__all__ = ['sqlite3_adapter', 'replicated_adapter', 'sharded_adapter']
+
+from contextlib import contextmanager
 
 from active_record.result import Result
 
@@ -31,14 +33,24 @@ class AbstractAdapter(object):
     ('primary_key', 'boolean')
   )
 
+  # Whether an explicit transaction is currently open on this adapter.
+  in_transaction = False
+
+  # Whether the database can resolve conflicting inserts itself (upserts), and
+  # whether it can return the rows written by an insert.
+  supports_upsert    = False
+  supports_returning = False
+
   def __init__(self):
     # As an abstract adapter, we can't connect to anything.
     self.conn = None
     self.cursor = None
 
   # This method should query the database with the given sql, returning the
-  # results casted into Result objects.
-  def query(self, sql):
+  # results casted into Result objects. If table_name is given, values should
+  # be converted according to the types of that table's columns. params are the
+  # values of any parameters in the SQL.
+  def query(self, sql, table_name=None, params=()):
     raise Exception("ABSTRACT PERFORMING QUERY")
 
   def begin_transaction(self):
@@ -47,6 +59,30 @@ class AbstractAdapter(object):
   def end_transaction(self):
     raise Exception("ABSTRACT ENDING TRANSACTION")
 
+  def rollback_transaction(self):
+    raise Exception("ABSTRACT ROLLING BACK TRANSACTION")
+
+  # Run the body of a `with` block inside of a transaction, committing it when
+  # the block finishes and rolling it back if the block raises. Nested blocks
+  # simply join the transaction that is already open.
+  #
+  #     with DB_ADAPTER.transaction():
+  #       jon.save()
+  #       jane.save()
+  @contextmanager
+  def transaction(self):
+    if self.in_transaction:
+      yield self
+      return
+
+    self.begin_transaction()
+    try:
+      yield self
+    except:
+      self.rollback_transaction()
+      raise
+    self.end_transaction()
+
   # TABLE METHODS
   def create_table(self, table_def, force=False):
     raise Exception("ABSTRACT CREATING TABLE")
@@ -54,20 +90,82 @@ class AbstractAdapter(object):
   def drop_table(self, table_name):
     raise Exception("ABSTRACT DROPPING TABLE")
 
+  # Alter an existing table to match its definition without losing its data,
+  # creating it if it doesn't exist. Should return a description of the changes
+  # that were made.
+  def migrate_table(self, table_def, batch_size=1000, pause=0, progress=None):
+    raise Exception("ABSTRACT MIGRATING TABLE")
+
+  # Create a full-text index over the given columns of the table, kept up to
+  # date with the table as it changes. See Table.full_text() in the schema.
+  def create_search_index(self, table_name, columns, tokenize=None):
+    raise Exception("ABSTRACT CREATING SEARCH INDEX")
+
+  # Re-index every row of the table in its full-text index.
+  def rebuild_search_index(self, table_name):
+    raise Exception("ABSTRACT REBUILDING SEARCH INDEX")
+
+  # Log every insert, update and delete on the table to the changelog table,
+  # creating it if need be. See change_feed.py.
+  def track_changes(self, table_name):
+    raise Exception("ABSTRACT TRACKING CHANGES")
+
   # The result of this function should be list of 6-tuples that follow the
   # format of _table_structure_tuple.
   def table_structure(self, table_name):
     raise Exception("ABSTRACT GETTING TABLE STRUCTURE")
 
+  # Return an OrderedDict of the table's column names, in table order, mapped to
+  # their types (as the names used in _type_map).
+  def column_types(self, table_name):
+    raise Exception("ABSTRACT GETTING COLUMN TYPES")
+
+  # Return a list of the column sets (as tuples) which are covered by a unique
+  # index or the primary key of the table.
+  def unique_indexes(self, table_name):
+    raise Exception("ABSTRACT GETTING UNIQUE INDEXES")
+
+  # Return a new adapter with its own connection to the same database and the
+  # same settings. Used to give threads and worker processes a connection of
+  # their own.
+  def reopen(self, read_only=False):
+    raise Exception("ABSTRACT REOPENING CONNECTION")
+
+  # Return a dictionary of the names of the table's explicitly created indexes,
+  # mapped to whether they are unique.
+  def indexes(self, table_name):
+    raise Exception("ABSTRACT GETTING INDEXES")
+
+  # Drop the named indexes, returning whatever .restore_indexes() needs to
+  # create them again.
+  def drop_indexes(self, names):
+    raise Exception("ABSTRACT DROPPING INDEXES")
+
+  def restore_indexes(self, definitions):
+    raise Exception("ABSTRACT RESTORING INDEXES")
+
   # Return the ID of the last row that was inserted.
   def last_inserted(self):
     raise Exception("ABSTRACT GETTING LAST INSERTED")
 
+  # Return the number of rows changed by the last update or delete.
+  def rows_affected(self):
+    raise Exception("ABSTRACT GETTING ROWS AFFECTED")
+
+  # Return a copy of the whole database, which .restore() can put back later.
+  # Meant for test fixtures (see testing.py).
+  def snapshot(self):
+    raise Exception("ABSTRACT TAKING SNAPSHOT")
+
+  # Replace the whole database with a snapshot taken earlier.
+  def restore(self, snapshot):
+    raise Exception("ABSTRACT RESTORING SNAPSHOT")
+
 
 
   # DATA METHODS
   # This method should create a list of Result objects from the data provided.
-  def results(self, records):
+  def results(self, records, table_name=None):
     return Result.parse_all(records)
 
   # For the remaining methods:
@@ -77,6 +175,14 @@ class AbstractAdapter(object):
   def find(self, ast):
     raise Exception("ABSTRACT SELECTING STUFF")
 
+  # Like .find(), but rather than building Result objects for every record at
+  # once, yield (columns, rows) pairs for batches of at most batch_size raw row
+  # tuples, straight from the database. Used for work that should run in flat
+  # memory, like exports. A query which matches nothing yields a single empty
+  # batch, so callers still learn its columns.
+  def stream(self, ast, batch_size=1000):
+    raise Exception("ABSTRACT STREAMING STUFF")
+
   def insert(self, ast, insert_clause="INSERT", defaults=False, commit=True):
     raise Exception("ABSTRACT INSERTING STUFF")
 
@@ -86,6 +192,24 @@ class AbstractAdapter(object):
   def delete(self, ast, commit=True):
     raise Exception("ABSTRACT DELETING STUFF")
 
+  # Insert many rows at once. rows is an iterable of tuples of values, aligned
+  # with the given columns. The values are passed to the database as-is, so
+  # they must already be of the right types. Unless commit is False, the rows
+  # are written in a single transaction (or join the one already open);
+  # otherwise the caller is expected to have opened one.
+  def insert_many(self, table_name, columns, rows, commit=True):
+    raise Exception("ABSTRACT INSERTING LOTS OF STUFF")
+
+  # Add `by` to each of the given counter columns of a single row, in place.
+  # counters is a dictionary of { <column>: <by> }.
+  def update_counters(self, table_name, row_id, counters, commit=True):
+    raise Exception("ABSTRACT UPDATING COUNTERS")
+
+  # Recalculate a counter column for every row of a parent table from the
+  # number of child rows which reference it.
+  def reset_counters(self, table_name, counter_column, child_table, foreign_key, commit=True):
+    raise Exception("ABSTRACT RESETTING COUNTERS")
+
 
 
   # HELPERS
@@ -0,0 +1,229 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+from active_record.connection_adapters import AbstractAdapter
+
+# An adapter which spreads reads across any number of replica connections,
+# while every write goes to a single primary connection. Each connection is a
+# normal adapter (SQLite3Adapter, etc.), so this class only decides *where* a
+# query should run.
+#
+# It is configured from database.yaml by adding a `replicas` mapping to an
+# environment. Each replica inherits any settings it doesn't define from the
+# environment itself, so for SQLite this is usually just the file name:
+#
+#     production:
+#       adapter: sqlite3
+#       name: db/production.db
+#       balance: least_busy     # or round_robin (the default)
+#       replicas:
+#         reader_1:
+#           name: db/production_1.db
+#         reader_2:
+#           name: db/production_2.db
+#
+# Routing rules:
+#   - .find() runs on a replica, chosen by the `balance` strategy.
+#   - Everything else (inserts, updates, deletes, schema changes, raw queries)
+#     runs on the primary.
+#   - While a transaction is open, reads are pinned to the primary as well, so
+#     that a transaction always sees its own writes.
+#   - A relation can pick its connection explicitly with .using(<name>), where
+#     <name> is 'primary', 'replica' (any replica, balanced), or the name of one
+#     of the configured replicas:
+#         Person.relation.using('primary').where(name='Jon').first()
+class ReplicatedAdapter(AbstractAdapter):
+  # The strategies available for choosing a replica to read from.
+  balance_strategies = ['round_robin', 'least_busy']
+
+  def __init__(self, primary, replicas, balance='round_robin'):
+    if balance not in self.balance_strategies:
+      raise ValueError('Unknown balance strategy "%s"' % balance)
+
+    self.primary  = primary
+    self.replicas = OrderedDict(replicas)
+    self.balance  = balance
+
+    # Bookkeeping for the balancing strategies. `_busy` counts the number of
+    # reads currently running on each replica.
+    self._lock  = threading.Lock()
+    self._cycle = itertools.cycle(self.replicas.keys())
+    self._busy  = dict((name, 0) for name in self.replicas)
+
+  # Anything that isn't about routing (connection objects, SQL builders, type
+  # maps, etc.) is answered by the primary.
+  def __getattr__(self, name):
+    if name.startswith('__') or name == 'primary':
+      raise AttributeError(name)
+    return getattr(self.primary, name)
+
+  @property
+  def in_transaction(self):
+    return self.primary.in_transaction
+
+  @property
+  def supports_upsert(self):
+    return self.primary.supports_upsert
+
+  @property
+  def supports_returning(self):
+    return self.primary.supports_returning
+
+  # Return the adapter registered under the given name.
+  def connection(self, name):
+    if name == 'primary':
+      return self.primary
+    if name == 'replica':
+      return self._balanced()
+    if name not in self.replicas:
+      raise KeyError('No connection named "%s" has been configured' % name)
+    return self.replicas[name]
+
+  # Raw SQL can't be inspected safely, so it always goes to the primary.
+  def query(self, sql, table_name=None, params=()):
+    return self.primary.query(sql, table_name, params)
+
+  def begin_transaction(self):
+    self.primary.begin_transaction()
+
+  def end_transaction(self):
+    self.primary.end_transaction()
+
+  def rollback_transaction(self):
+    self.primary.rollback_transaction()
+
+  # TABLE METHODS
+  def create_table(self, table_def, force=False):
+    self.primary.create_table(table_def, force)
+
+  def drop_table(self, table_name):
+    self.primary.drop_table(table_name)
+
+  def migrate_table(self, table_def, batch_size=1000, pause=0, progress=None):
+    return self.primary.migrate_table(table_def, batch_size, pause, progress)
+
+  def create_search_index(self, table_name, columns, tokenize=None):
+    self.primary.create_search_index(table_name, columns, tokenize)
+
+  def rebuild_search_index(self, table_name):
+    self.primary.rebuild_search_index(table_name)
+
+  def track_changes(self, table_name):
+    self.primary.track_changes(table_name)
+
+  def table_structure(self, table_name):
+    return self.primary.table_structure(table_name)
+
+  def column_types(self, table_name):
+    return self.primary.column_types(table_name)
+
+  def unique_indexes(self, table_name):
+    return self.primary.unique_indexes(table_name)
+
+  def indexes(self, table_name):
+    return self.primary.indexes(table_name)
+
+  def drop_indexes(self, names):
+    return self.primary.drop_indexes(names)
+
+  def restore_indexes(self, definitions):
+    self.primary.restore_indexes(definitions)
+
+  # Read-only connections are taken from the replicas, so that work such as
+  # parallel scans doesn't land on the primary.
+  def reopen(self, read_only=False):
+    if read_only and self.replicas:
+      return self._balanced().reopen(True)
+    return self.primary.reopen(read_only)
+
+  def last_inserted(self):
+    return self.primary.last_inserted()
+
+  def rows_affected(self):
+    return self.primary.rows_affected()
+
+  # Only the primary is snapshotted and restored. Replicas are left as they
+  # are.
+  def snapshot(self):
+    return self.primary.snapshot()
+
+  def restore(self, snapshot):
+    self.primary.restore(snapshot)
+
+
+
+  # DATA METHODS
+  def find(self, ast):
+    adapter = self._reader(ast)
+    if adapter is self.primary:
+      return adapter.find(ast)
+
+    name = self._name_of(adapter)
+    with self._lock:
+      self._busy[name] += 1
+    try:
+      return adapter.find(ast)
+    finally:
+      with self._lock:
+        self._busy[name] -= 1
+
+  def stream(self, ast, batch_size=1000):
+    return self._reader(ast).stream(ast, batch_size)
+
+  def insert(self, ast, insert_clause="INSERT", defaults=False, commit=True):
+    return self.primary.insert(ast, insert_clause, defaults, commit)
+
+  def update(self, ast, update_clause="UPDATE", commit=True):
+    return self.primary.update(ast, update_clause, commit)
+
+  def delete(self, ast, commit=True):
+    return self.primary.delete(ast, commit)
+
+  def insert_many(self, table_name, columns, rows, commit=True):
+    self.primary.insert_many(table_name, columns, rows, commit)
+
+  def update_counters(self, table_name, row_id, counters, commit=True):
+    self.primary.update_counters(table_name, row_id, counters, commit)
+
+  def reset_counters(self, table_name, counter_column, child_table, foreign_key, commit=True):
+    self.primary.reset_counters(table_name, counter_column, child_table, foreign_key, commit)
+
+
+
+  # HELPERS
+  # Determine which adapter should answer the given read.
+  def _reader(self, ast):
+    if getattr(ast, 'connection', None):
+      return self.connection(ast.connection)
+    if self.in_transaction or not self.replicas:
+      return self.primary
+    return self._balanced()
+
+  # Pick a replica according to the configured balancing strategy.
+  def _balanced(self):
+    with self._lock:
+      name = next(self._cycle)
+      if self.balance == 'least_busy':
+        # Ties are common (most reads finish before the next one starts), so
+        # start looking from the next replica in turn rather than the first.
+        names = self.replicas.keys()
+        start = names.index(name)
+        name  = min(names[start:] + names[:start], key=lambda name: self._busy[name])
+    return self.replicas[name]
+
+  def _name_of(self, adapter):
+    for name, replica in self.replicas.iteritems():
+      if replica is adapter:
+        return name
+
+
+# `connect` is a callable which opens an adapter for a single configuration
+# entry (see setup.py). The primary connection has already been opened, as it
+# is needed whether or not any replicas are configured.
+def new(primary, db_config, connect):
+  replicas = OrderedDict()
+  for name, config in (db_config.get('replicas') or {}).iteritems():
+    replicas[name] = connect(config)
+
+  return ReplicatedAdapter(primary, replicas, db_config.get('balance', 'round_robin'))
@@ -0,0 +1,424 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+from active_record.connection_adapters import AbstractAdapter
+
+# The shard keys of every sharded model, keyed by table name. Models are added
+# here when they are defined (see macros/shards_by.py).
+shard_keys = {}
+
+# The column a model is sharded by, and how its values map to shards.
+#
+# By default, values are hashed (crc32 of their string form, which is stable
+# across processes) onto the list of shards. Alternatively, `ranges` lists
+# (upper_bound, shard_name) pairs in ascending order: a value belongs to the
+# first shard whose upper bound it is below. An upper bound of None catches
+# everything that's left.
+class ShardKey(object):
+  def __init__(self, column, ranges=None):
+    self.column = column
+    self.ranges = ranges
+
+  # Return the name of the shard holding rows with the given value.
+  def shard_for(self, value, names):
+    if self.ranges:
+      for upper, name in self.ranges:
+        if upper is None or value < upper:
+          return name
+      raise ValueError('No shard covers %s = %r' % (self.column, value))
+
+    return names[(zlib.crc32(str(value)) & 0xffffffff) % len(names)]
+
+
+# An adapter which spreads the rows of sharded models over several databases,
+# and keeps everything else in a single default database. Each database is a
+# normal adapter (SQLite3Adapter, ReplicatedAdapter, etc.), so this class only
+# decides *where* a query should run. Application code uses the same models,
+# relations, and arel tables whether or not a table is sharded.
+#
+# It is configured from database.yaml by adding a `shards` mapping to an
+# environment. Each shard inherits any settings it doesn't define from the
+# environment itself, which remains the default database:
+#
+#     production:
+#       adapter: sqlite3
+#       name: db/production.db
+#       shards:
+#         tenants_1:
+#           name: db/tenants_1.db
+#         tenants_2:
+#           name: db/tenants_2.db
+#
+# Models opt in by naming their shard key (see macros/shards_by.py):
+#
+#     class Document(Base):
+#       shards_by('tenant_id')
+#
+# Routing rules for sharded tables:
+#   - Queries which pin the shard key to a value (.where(tenant_id=4)), or a
+#     list of values, run only on the shards holding those values.
+#   - Other reads run on every shard in parallel. The results are merged,
+#     respecting .order(), .limit() and .offset(). Aggregates and groups are
+#     not merged, so they should always be given a shard key.
+#   - Inserts are routed by the shard key value of each row, which must be
+#     provided.
+#   - Updates and deletes without a shard key run on every shard. Updates
+#     which would move rows to another shard, by changing their shard key, are
+#     refused; delete the rows and create them again instead.
+#
+# Every table is created on every database, so all of them share one schema.
+# Each shard would number its rows on its own, so the ids of new rows of
+# sharded tables are handed out by the default database instead (see
+# .allocate_ids()), which keeps them unique across shards. Lookups by id alone
+# (.find(), .reload(), .destroy(), belongs_to, ...) still ask every shard, but
+# only one of them can hold the row.
+#
+# Transactions are opened on every database, but are committed one database
+# after another, so a transaction spanning several shards is not atomic.
+class ShardedAdapter(AbstractAdapter):
+  # The table of the default database which keeps the next id of each sharded
+  # table.
+  id_table = 'active_record_ids'
+
+  def __init__(self, default, shards):
+    self.default = default
+    self.shards  = OrderedDict(shards)
+
+    # The adapter which performed the most recent insert, and the number of
+    # rows changed by the most recent update or delete, across shards.
+    self._last_writer = default
+    self._affected    = 0
+    # The sharded tables whose id counters are known to exist.
+    self._counted     = set()
+
+  # Anything that isn't about routing (connection objects, SQL builders, type
+  # maps, etc.) is answered by the default database.
+  def __getattr__(self, name):
+    if name.startswith('__') or name == 'default':
+      raise AttributeError(name)
+    return getattr(self.default, name)
+
+  @property
+  def in_transaction(self):
+    return self.default.in_transaction
+
+  @property
+  def supports_upsert(self):
+    return self.default.supports_upsert
+
+  @property
+  def supports_returning(self):
+    return self.default.supports_returning
+
+  # Raw SQL can't be inspected safely, so it always goes to the default
+  # database.
+  def query(self, sql, table_name=None, params=()):
+    return self.default.query(sql, table_name, params)
+
+  def begin_transaction(self):
+    for adapter in self._everywhere():
+      adapter.begin_transaction()
+
+  def end_transaction(self):
+    for adapter in self._everywhere():
+      adapter.end_transaction()
+
+  def rollback_transaction(self):
+    for adapter in self._everywhere():
+      adapter.rollback_transaction()
+
+  # TABLE METHODS
+  def create_table(self, table_def, force=False):
+    for adapter in self._everywhere():
+      adapter.create_table(table_def, force)
+
+  def drop_table(self, table_name):
+    for adapter in self._everywhere():
+      adapter.drop_table(table_name)
+
+  # The diff of the default database is returned; the shards share its schema.
+  def migrate_table(self, table_def, batch_size=1000, pause=0, progress=None):
+    diffs = [adapter.migrate_table(table_def, batch_size, pause, progress) for adapter in self._everywhere()]
+    return diffs[0]
+
+  def create_search_index(self, table_name, columns, tokenize=None):
+    for adapter in self._everywhere():
+      adapter.create_search_index(table_name, columns, tokenize)
+
+  def rebuild_search_index(self, table_name):
+    for adapter in self._everywhere():
+      adapter.rebuild_search_index(table_name)
+
+  # Each database keeps a changelog of its own.
+  def track_changes(self, table_name):
+    for adapter in self._everywhere():
+      adapter.track_changes(table_name)
+
+  def table_structure(self, table_name):
+    return self.default.table_structure(table_name)
+
+  def column_types(self, table_name):
+    return self.default.column_types(table_name)
+
+  def unique_indexes(self, table_name):
+    return self.default.unique_indexes(table_name)
+
+  def indexes(self, table_name):
+    return self.default.indexes(table_name)
+
+  # Index definitions are the same on every database, so they are returned as
+  # (database, definitions) pairs to be restored where they were dropped.
+  def drop_indexes(self, names):
+    return [(adapter, adapter.drop_indexes(names)) for adapter in self._everywhere()]
+
+  def restore_indexes(self, definitions):
+    for adapter, dropped in definitions:
+      adapter.restore_indexes(dropped)
+
+  def reopen(self, read_only=False):
+    shards = [(name, shard.reopen(read_only)) for name, shard in self.shards.iteritems()]
+    return ShardedAdapter(self.default.reopen(read_only), shards)
+
+  def last_inserted(self):
+    return self._last_writer.last_inserted()
+
+  def rows_affected(self):
+    return self._affected
+
+  def snapshot(self):
+    return [adapter.snapshot() for adapter in self._everywhere()]
+
+  def restore(self, snapshot):
+    for adapter, data in zip(self._everywhere(), snapshot):
+      adapter.restore(data)
+    self._counted = set()
+
+
+
+  # DATA METHODS
+  def find(self, ast):
+    adapters = self._readers(ast)
+    if len(adapters) == 1:
+      return adapters[0].find(ast)
+
+    # Each shard has to return enough rows to cover the offset, as it isn't
+    # known which shards the skipped rows will come from.
+    shard_ast = ast
+    if ast.limits or ast.offsets:
+      shard_ast = ast.offset(None)
+      shard_ast.limits = ast.limits and ast.limits + (ast.offsets or 0)
+
+    return self._merged(ast, self._in_parallel(adapters, lambda adapter: adapter.find(shard_ast)))
+
+  # Shards are streamed one after another, so rows are not merged into any
+  # .order() across shards.
+  def stream(self, ast, batch_size=1000):
+    empty = None
+    for adapter in self._readers(ast):
+      for columns, rows in adapter.stream(ast, batch_size):
+        if rows:
+          empty = False
+          yield columns, rows
+        elif empty is None:
+          empty = (columns, rows)
+    # Only pass on an empty batch if no shard had any rows.
+    if empty:
+      yield empty
+
+  def insert(self, ast, insert_clause="INSERT", defaults=False, commit=True):
+    key = shard_keys.get(ast.table_name)
+    if not key:
+      return self._write(self.default, 'insert', ast, insert_clause, defaults, commit)
+
+    columns = ast.projections[ast.table_name]
+    if key.column not in columns:
+      raise ValueError('Inserts into "%s" must provide its shard key, "%s"' % (ast.table_name, key.column))
+    if 'id' not in columns:
+      ast = ast.copy()
+      ids = self.allocate_ids(ast.table_name, len(ast.value_set))
+      columns = ast.projections[ast.table_name] = columns + ['id']
+      ast.value_set = [list(values) + [row_id] for values, row_id in zip(ast.value_set, ids)]
+
+    # Rows are grouped by shard, and each group inserted with its own statement.
+    position = columns.index(key.column)
+    groups = OrderedDict()
+    for values in ast.value_set:
+      groups.setdefault(self._shard_for(key, values[position]), []).append(values)
+
+    results = []
+    for adapter, value_set in groups.iteritems():
+      shard_ast = ast.copy()
+      shard_ast.value_set = value_set
+      results.extend(self._write(adapter, 'insert', shard_ast, insert_clause, defaults, commit))
+    return results
+
+  # Updates run where the rows they match are stored, whatever they set.
+  def update(self, ast, update_clause="UPDATE", commit=True):
+    adapters = self._writers(ast)
+    key = shard_keys.get(ast.table_name)
+    if key and key.column in ast.sets:
+      target = self._shard_for(key, ast.sets[key.column])
+      if any(adapter is not target for adapter in adapters):
+        raise ValueError('Updates to "%s" can not move rows to another shard by changing "%s"' % \
+            (ast.table_name, key.column))
+
+    results, self._affected = [], 0
+    for adapter in adapters:
+      results.extend(adapter.update(ast, update_clause, commit))
+      self._affected += adapter.rows_affected()
+    return results
+
+  def delete(self, ast, commit=True):
+    results, self._affected = [], 0
+    for adapter in self._writers(ast):
+      results.extend(adapter.delete(ast, commit))
+      self._affected += adapter.rows_affected()
+    return results
+
+  def insert_many(self, table_name, columns, rows, commit=True):
+    key = shard_keys.get(table_name)
+    if not key:
+      return self.default.insert_many(table_name, columns, rows, commit)
+
+    if 'id' not in columns:
+      ids = self.allocate_ids(table_name, len(rows))
+      columns = list(columns) + ['id']
+      rows = [tuple(row) + (row_id,) for row, row_id in zip(rows, ids)]
+
+    position = columns.index(key.column)
+    groups = OrderedDict()
+    for row in rows:
+      groups.setdefault(self._shard_for(key, row[position]), []).append(row)
+    for adapter, shard_rows in groups.iteritems():
+      adapter.insert_many(table_name, columns, shard_rows, commit)
+
+  # Counters can't be routed by a shard key, but each row lives on a single
+  # shard, so updating every shard touches only that row.
+  def update_counters(self, table_name, row_id, counters, commit=True):
+    for adapter in self._tables(table_name):
+      adapter.update_counters(table_name, row_id, counters, commit)
+
+  def reset_counters(self, table_name, counter_column, child_table, foreign_key, commit=True):
+    for adapter in self._tables(table_name):
+      adapter.reset_counters(table_name, counter_column, child_table, foreign_key, commit)
+
+
+
+  # Reserve `count` new ids for rows of the sharded table, returning them as a
+  # list. The counter is moved on in a transaction of the default database (or
+  # in the one that is open), which other processes have to wait for, so no
+  # two rows are given the same id. It starts after the highest id on any
+  # shard, so existing rows are left as they are.
+  def allocate_ids(self, table_name, count):
+    adapter = self.default
+    if table_name not in self._counted:
+      adapter.query("""CREATE TABLE IF NOT EXISTS %s (table_name VARCHAR(255) PRIMARY KEY, next_id INTEGER NOT NULL)""" % \
+          self.id_table)
+      highest = [shard.query("""SELECT MAX(id) AS id FROM %s""" % table_name)[0].values['id'] or 0
+                 for shard in self.shards.values()]
+      adapter.query("""INSERT OR IGNORE INTO %s (table_name, next_id) VALUES (%s, %d)""" % \
+          (self.id_table, adapter._quoted(table_name), max(highest) + 1))
+      self._counted.add(table_name)
+
+    with adapter.transaction():
+      # Updating first takes the write lock before the counter is read.
+      adapter.query("""UPDATE %s SET next_id = next_id + %d WHERE table_name = %s""" % \
+          (self.id_table, count, adapter._quoted(table_name)))
+      next_id = adapter.query("""SELECT next_id FROM %s WHERE table_name = %s""" % \
+          (self.id_table, adapter._quoted(table_name)))[0].values['next_id']
+    return range(next_id - count, next_id)
+
+
+
+  # HELPERS
+  def _everywhere(self):
+    return [self.default] + self.shards.values()
+
+  # Every database holding rows of the given table.
+  def _tables(self, table_name):
+    if table_name in shard_keys:
+      return self.shards.values()
+    return [self.default]
+
+  def _shard_for(self, key, value):
+    return self.shards[key.shard_for(value, self.shards.keys())]
+
+  # Return the databases which can hold rows matching the conditions of the
+  # query.
+  def _routed(self, ast):
+    key = shard_keys.get(ast.table_name)
+    if not key:
+      return [self.default]
+
+    value = ast.wheres.get(key.column)
+    if value is None or isinstance(value, tuple) or hasattr(value, 'arel_table') or hasattr(value, 'froms'):
+      return self.shards.values()
+    if isinstance(value, list):
+      return list(OrderedDict.fromkeys(self._shard_for(key, v) for v in value))
+    return [self._shard_for(key, value)]
+
+  def _readers(self, ast):
+    return self._routed(ast)
+
+  def _writers(self, ast):
+    return self._routed(ast)
+
+  def _write(self, adapter, method, *args):
+    self._last_writer = adapter
+    return getattr(adapter, method)(*args)
+
+  # Run fn against every adapter at once, one thread each, returning the list
+  # of results in the same order. The shard connections are opened so that
+  # they can be used from these threads (see new()).
+  def _in_parallel(self, adapters, fn):
+    results = [None] * len(adapters)
+    errors  = []
+
+    def run(i, adapter):
+      try:
+        results[i] = fn(adapter)
+      except Exception as e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i, adapter)) for i, adapter in enumerate(adapters)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    if errors:
+      raise errors[0]
+    return results
+
+  # Combine the results from each shard as if they came from a single query.
+  def _merged(self, ast, results):
+    merged = [record for found in results for record in found]
+
+    # Python's sort is stable, so sorting by each order from last to first
+    # leaves the records sorted by all of them.
+    for order in reversed(ast.orders):
+      column, direction = order.rsplit(' ', 1)
+      column = column.split('.')[-1]
+      merged.sort(key=lambda record: record.values.get(column), reverse=(direction == 'DESC'))
+
+    start = ast.offsets or 0
+    if ast.limits:
+      return merged[start:start + ast.limits]
+    return merged[start:]
+
+
+# `connect` is a callable which opens an adapter for a single configuration
+# entry (see setup.py). The default database has already been opened, as it
+# is needed whether or not any shards are configured. Shard connections are
+# shared with the threads that query the shards in parallel.
+#
+# Shards are kept in order of their names, which is the order values are
+# hashed onto them.
+def new(default, db_config, connect):
+  shards = OrderedDict()
+  for name in sorted(db_config.get('shards') or {}):
+    config = dict(db_config['shards'][name], check_same_thread=False)
+    shards[name] = connect(config)
+
+  return ShardedAdapter(default, shards)
@@ -1,11 +1,43 @@
 import time
 import datetime
 import re
+import threading
+from collections import OrderedDict
 
 from active_record import arel
+from active_record import instrumentation
 from active_record.connection_adapters import AbstractAdapter
 from active_record.result import Result
 
+# Value converters, used to turn the raw values stored by the database into
+# Python values. Each is given a non-NULL value, which may already have been
+# converted by the database driver (sqlite3 converts DATE and TIMESTAMP
+# columns itself, for instance).
+def _to_boolean(value):
+  return bool(value)
+
+def _to_float(value):
+  return float(value)
+
+def _to_date(value):
+  if isinstance(value, datetime.date):
+    return value
+  return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+def _to_datetime(value):
+  if isinstance(value, datetime.datetime):
+    return value
+  if '.' in value:
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+  if len(value) == 10:
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+  return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+# The tables named by the FROM and JOIN clauses of a query.
+_read_tables = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)', re.I)
+
+
 # A proxy object which provides some general functions for AST conversion into
 # SQL statements. It cannot be used on its own, as no connection is established.
 # If any subclassing adapter finds that this class creates improper SQL, it
@@ -19,21 +51,85 @@ class SQLAdapter(AbstractAdapter):
   # Individual adapters must set their own type maps and reverse type maps.
   _type_map = { }
 
+  # Set while an explicit transaction is open. Data methods will not commit on
+  # their own until the transaction is ended (or rolled back).
+  in_transaction = False
+
+  # The marker used for bound parameters (the DB API's `paramstyle`).
+  _placeholder = '?'
+
+  # The values bound by the statement being built on this thread, if any (see
+  # ._bound()).
+  _binding = threading.local()
+
+  # Moved on whenever the schema changes and the cached metadata is dropped, so
+  # that anything built from it (like the column attributes of models) can
+  # tell when it needs rebuilding.
+  schema_generation = 0
+
+  # The table which the triggers of tracked tables log changes to (see
+  # change_feed.py).
+  changelog_table = 'active_record_changes'
+
+  # The converters applied to values of each column type when they are read
+  # from the database. Types without a converter (or with None) are returned
+  # as the database driver gives them; strings, for example, are already
+  # handled by the driver itself. Use .register_converter() to change these
+  # for a single adapter.
+  _converters = {
+    'boolean':   _to_boolean,
+    'decimal':   _to_float,
+    'date':      _to_date,
+    'datetime':  _to_datetime,
+    'timestamp': _to_datetime,
+    'string':    None,
+    'text':      None
+  }
+
   # Every database call is done using .query(). It is also publicly available to
   # the client if it needs more direct control in querying.
   #
   # In essence, this method performs the query on the database and casts the
   # returned records into a list of Result objects using the .results() method.
-  def query(self, sql):
-    return self.results(self.cursor.execute(sql))
+  # Values are converted to Python types by the types of the columns they come
+  # from. If the name of the table being queried is given, every column is
+  # looked up in it; for joins, a list naming the table of each column may be
+  # given instead. Otherwise, each column is looked up in the tables named by
+  # the FROM and JOIN clauses of the SQL. params are the values of any
+  # parameters in the SQL.
+  def query(self, sql, table_name=None, params=()):
+    instrumentation.publish(sql)
+    records = self.cursor.execute(sql, params)
+    if table_name is None and records.description:
+      table_name = self._sources_named(sql, [col[0] for col in records.description])
+    return self.results(records, table_name)
+
+  def results(self, records, table_name=None):
+    convert = None
+    if table_name and records.description:
+      convert = self._pipeline(table_name, [col[0] for col in records.description])
+    return Result.parse_all(records, convert)
+
+  # Use `converter` for values of the given column type from now on. A value of
+  # None leaves values of that type unconverted.
+  def register_converter(self, type_name, converter):
+    self._converters = dict(self._converters)
+    self._converters[type_name] = converter
+    self._pipelines = {}
 
   def begin_transaction(self):
     # For some reason, DB API 2 doesn't call for a .begin() method...
     self.cursor.execute('BEGIN')
+    self.in_transaction = True
 
   def end_transaction(self):
     # It does call for a .commit(), but it's on the connection object? Really?
     self.conn.commit()
+    self.in_transaction = False
+
+  def rollback_transaction(self):
+    self.conn.rollback()
+    self.in_transaction = False
 
   # TABLE METHODS
   def create_table(self, table_def, force=False):
@@ -43,12 +139,64 @@ class SQLAdapter(AbstractAdapter):
     sql = """CREATE TABLE %s %s""" % (_force, self._table_sql(table_def))
     self.cursor.execute(sql)
 
+    for name, index in getattr(table_def, 'indexes', {}).iteritems():
+      self.cursor.execute(self._index_sql(table_def.name, name, index))
+    search_index = getattr(table_def, 'search_index', None)
+    if search_index:
+      self.create_search_index(table_def.name, search_index['columns'], search_index['tokenize'])
+    self._clear_caches()
+
   def drop_table(self, table_name, force=False):
     _force = ''
     if not force:
       _force = 'IF EXISTS'
     sql = """DROP TABLE %s %s""" % (_force, table_name)
     self.cursor.execute(sql)
+    self.cursor.execute("""DROP TABLE IF EXISTS %s""" % self._search_table(table_name))
+    self._clear_caches()
+
+  # The index is an FTS5 table which reads its text from the table itself (an
+  # "external content" table), so the text isn't stored twice. Triggers keep
+  # it in step with every insert, update and delete.
+  def create_search_index(self, table_name, columns, tokenize=None):
+    search = self._search_table(table_name)
+    options = ["content='%s'" % table_name, "content_rowid='id'"]
+    if tokenize:
+      options.append("tokenize='%s'" % tokenize)
+    self.cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s)""" % \
+        (search, ', '.join(columns + options)))
+
+    names = ', '.join(columns)
+    new = ', '.join('new.%s' % col for col in columns)
+    old = ', '.join('old.%s' % col for col in columns)
+    insert = """INSERT INTO %s (rowid, %s) VALUES (new.id, %s);""" % (search, names, new)
+    delete = """INSERT INTO %s (%s, rowid, %s) VALUES ('delete', old.id, %s);""" % (search, search, names, old)
+    for event, body in (('insert', insert), ('delete', delete), ('update', delete + ' ' + insert)):
+      self.cursor.execute("""CREATE TRIGGER IF NOT EXISTS %s_%s AFTER %s ON %s BEGIN %s END""" % \
+          (search, event, event.upper(), table_name, body))
+    self._clear_caches()
+
+  def rebuild_search_index(self, table_name):
+    search = self._search_table(table_name)
+    self.cursor.execute("""INSERT INTO %s (%s) VALUES ('rebuild')""" % (search, search))
+    if not self.in_transaction:
+      self.conn.commit()
+
+  # The changelog numbers every change in order (AUTOINCREMENT never reuses a
+  # number, even once older changes are pruned). Each trigger logs the change
+  # in the same transaction as the change itself.
+  def track_changes(self, table_name):
+    self.cursor.execute("""CREATE TABLE IF NOT EXISTS %s (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name VARCHAR(255) NOT NULL,
+        row_id INTEGER, op VARCHAR(6) NOT NULL, changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""" % \
+        self.changelog_table)
+    for sql in self._change_trigger_sql(table_name):
+      self.cursor.execute(sql)
+
+  # See schema/migrator.py.
+  def migrate_table(self, table_def, batch_size=1000, pause=0, progress=None):
+    from active_record.schema.migrator import Migrator
+    return Migrator(self, batch_size, pause, progress).migrate(table_def)
 
   def table_structure(self, table_name):
     sql = """PRAGMA table_info(%s)""" % table_name
@@ -61,36 +209,155 @@ class SQLAdapter(AbstractAdapter):
     column_names = [name for name, _ in self._table_structure_tuple]
     return Result(column_names, structure)
 
+  # Looked up once per table, as every query consults it.
+  def column_types(self, table_name):
+    if table_name not in self._column_types:
+      types = OrderedDict()
+      # This is looked up while query results are still waiting on self.cursor,
+      # possibly in the middle of a transaction. So it gets a cursor of its own,
+      # and uses the SELECT form of the PRAGMA, which the driver won't end the
+      # transaction for.
+      sql = """SELECT * FROM pragma_table_info('%s')""" % table_name
+      # Tables that don't exist (yet) are remembered too, as having no columns,
+      # until the schema changes.
+      for r in self.conn.execute(sql).fetchall():
+        types[r[1]] = self._type_from_db(r[2])
+      self._column_types[table_name] = types
+
+    return self._column_types[table_name]
+
+  # Looked up once per table, as it is consulted on every .find_or_create().
+  def unique_indexes(self, table_name):
+    if table_name not in self._unique_indexes:
+      indexes = [('id',)]
+      # See .column_types() for why the SELECT form of the PRAGMAs is used.
+      for index in self.conn.execute("""SELECT * FROM pragma_index_list('%s')""" % table_name).fetchall():
+        # Partial indexes can't be used as a conflict target.
+        if index[2] and not index[4]:
+          info = self.conn.execute("""SELECT * FROM pragma_index_info('%s')""" % index[1]).fetchall()
+          indexes.append(tuple(col[2] for col in info))
+      self._unique_indexes[table_name] = indexes
+
+    return self._unique_indexes[table_name]
+
+  def indexes(self, table_name):
+    indexes = {}
+    for index in self.conn.execute("""SELECT * FROM pragma_index_list('%s')""" % table_name).fetchall():
+      # Indexes created by constraints (UNIQUE, PRIMARY KEY) can't be dropped.
+      if index[3] == 'c':
+        indexes[index[1]] = bool(index[2])
+
+    return indexes
+
+  def drop_indexes(self, names):
+    definitions = []
+    for name in names:
+      found = self.cursor.execute("""SELECT sql FROM sqlite_master WHERE type = 'index' AND name = %s""" \
+          % self._casted(name)).fetchone()
+      if found:
+        definitions.append(found[0])
+        self.cursor.execute("""DROP INDEX %s""" % name)
+
+    return definitions
+
+  def restore_indexes(self, definitions):
+    for sql in definitions:
+      self.cursor.execute(sql)
+
   def last_inserted(self):
     return self.cursor.lastrowid
 
+  def rows_affected(self):
+    return self.cursor.rowcount
+
 
 
   # DATA METHODS
   def find(self, ast):
-    return self.query(self._build_find_sql(ast))
+    sql, params = self._bound(self._build_find_sql, ast)
+    return self.query(sql, self._sources(ast), params)
+
+  # A separate cursor is used, so that other queries can run while the stream
+  # is being consumed.
+  def stream(self, ast, batch_size=1000):
+    cursor = self.conn.cursor()
+    try:
+      sql, params = self._bound(self._build_find_sql, ast)
+      instrumentation.publish(sql)
+      cursor.execute(sql, params)
+      columns = [col[0] for col in cursor.description]
+      convert = self._pipeline(self._sources(ast), columns)
+
+      rows = cursor.fetchmany(batch_size)
+      if not rows:
+        yield columns, rows
+      while rows:
+        if convert:
+          rows = convert(rows)
+        yield columns, rows
+        rows = cursor.fetchmany(batch_size)
+    finally:
+      cursor.close()
 
   def insert(self, ast, insert_clause="INSERT", defaults=False, commit=True):
-    results = self.query(self._build_insert_sql(ast, insert_clause, defaults))
-    if commit:
+    results = self.query(self._build_insert_sql(ast, insert_clause, defaults), ast.table_name)
+    if commit and not self.in_transaction:
       self.conn.commit()
 
     return results
 
   def update(self, ast, update_clause="UPDATE", commit=True):
-    results = self.query(self._build_update_sql(ast, update_clause))
-    if commit:
+    sql, params = self._bound(self._build_update_sql, ast, update_clause)
+    results = self.query(sql, None, params)
+    if commit and not self.in_transaction:
       self.conn.commit()
 
     return results
 
   def delete(self, ast, commit=True):
-    results = self.query(self._build_delete_sql(ast))
-    if commit:
+    sql, params = self._bound(self._build_delete_sql, ast)
+    results = self.query(sql, None, params)
+    if commit and not self.in_transaction:
       self.conn.commit()
 
     return results
 
+  # The values are bound as parameters, rather than cast into the SQL, so the
+  # statement is only prepared once for the whole set of rows. The rows are
+  # written in a single transaction, rather than committed one by one.
+  def insert_many(self, table_name, columns, rows, commit=True):
+    sql = """INSERT INTO %s%s VALUES (%s)""" % \
+        (table_name, self._build_columns(columns), ', '.join([self._placeholder] * len(columns)))
+    instrumentation.publish(sql)
+    if not commit:
+      self.cursor.executemany(sql, rows)
+      return
+
+    with self.transaction():
+      self.cursor.executemany(sql, rows)
+
+  def update_counters(self, table_name, row_id, counters, commit=True):
+    assignments = []
+    for column, by in counters.iteritems():
+      assignments.append('%s = COALESCE(%s, 0) + %d' % (column, column, by))
+
+    sql = """UPDATE %s SET %s WHERE id = %s""" % \
+        (table_name, ', '.join(assignments), self._casted(row_id))
+    instrumentation.publish(sql)
+    self.cursor.execute(sql)
+    if commit and not self.in_transaction:
+      self.conn.commit()
+
+  # Done as a single correlated UPDATE, so the whole table is repaired in one
+  # statement rather than a COUNT per parent.
+  def reset_counters(self, table_name, counter_column, child_table, foreign_key, commit=True):
+    sql = """UPDATE %s SET %s = (SELECT COUNT(*) FROM %s WHERE %s.%s = %s.id)""" % \
+        (table_name, counter_column, child_table, child_table, foreign_key, table_name)
+    instrumentation.publish(sql)
+    self.cursor.execute(sql)
+    if commit and not self.in_transaction:
+      self.conn.commit()
+
 
 
   # HELPERS
@@ -107,26 +374,138 @@ class SQLAdapter(AbstractAdapter):
       if 'foreign_key' in options:
         foreign_keys.append('%s' % self._foreign_key_sql(name, options['foreign_key']))
 
-      column_def = '%s %s' % (name, self._type_to_db(options['type_def']))
-      if options['primary_key']:
-        column_def += ' PRIMARY KEY'
-      if options['not_null']:
-        column_def += ' NOT NULL'
-      if options['unique']:
-        column_def += ' UNIQUE'
-      if options['default']:
-        column_def += ' DEFAULT %s' % self._type_casted(options['type_def'][0], options['default'])
-      columns.append(column_def)
+      columns.append(self._column_sql(name, options))
 
     return "%s (%s%s)" % (table_def.name, ', '.join(columns), ', '.join(foreign_keys))
 
+  # Return the SQL that defines a single column (without its foreign key).
+  def _column_sql(self, name, options):
+    column_def = '%s %s' % (name, self._type_to_db(options['type_def']))
+    if options['primary_key']:
+      column_def += ' PRIMARY KEY'
+    if options['not_null']:
+      column_def += ' NOT NULL'
+    if options['unique']:
+      column_def += ' UNIQUE'
+    if options['default']:
+      column_def += ' DEFAULT %s' % self._type_casted(options['type_def'][0], options['default'])
+    return column_def
+
+  # The name of the full-text index of a table.
+  def _search_table(self, table_name):
+    return '%s_search' % table_name
+
+  # The name of the trigger which logs the given kind of change to the table.
+  def _change_trigger(self, table_name, event):
+    return '%s_changes_%s' % (table_name, event)
+
+  # Return the SQL that creates the triggers which log changes to the table.
+  # An update which changes a row's id is logged as a delete of the old id as
+  # well.
+  def _change_trigger_sql(self, table_name):
+    log = """INSERT INTO %s (table_name, row_id, op) SELECT %s, %%s, '%%s'""" % \
+        (self.changelog_table, self._quoted(table_name))
+    bodies = {
+      'insert': log % ('new.id', 'insert') + ';',
+      'update': log % ('new.id', 'update') + '; ' + log % ('old.id', 'delete') + ' WHERE old.id IS NOT new.id;',
+      'delete': log % ('old.id', 'delete') + ';'
+    }
+
+    statements = []
+    for event in ('insert', 'update', 'delete'):
+      statements.append("""CREATE TRIGGER IF NOT EXISTS %s AFTER %s ON %s BEGIN %s END""" % \
+          (self._change_trigger(table_name, event), event.upper(), table_name, bodies[event]))
+    return statements
+
+  # Return the SQL that defines an index on the given table.
+  def _index_sql(self, table_name, name, index):
+    unique = ''
+    if index['unique']:
+      unique = 'UNIQUE '
+    return """CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)""" % \
+        (unique, name, table_name, ', '.join(index['columns']))
+
   # Type definitions in SQL are consistent, meaning each defintion is either the
   # type itself, or the type followed by "(<options>)". This means we can split
-  # the type strings on the first parenthesis and compare for equality.
+  # the type strings on the first parenthesis and compare for equality. The
+  # reverse of the type map is built once per adapter class, keyed by the part
+  # before the parenthesis.
   def _type_from_db(self, sql_type):
-    for _type, _def in self._type_map.iteritems():
-      if sql_type.split('(')[0] == _def.split('(')[0]:
-        return _type
+    cls = self.__class__
+    if '_db_types' not in cls.__dict__:
+      cls._db_types = dict((_def.split('(')[0], _type) for _type, _def in cls._type_map.iteritems())
+
+    return cls._db_types.get(sql_type.partition('(')[0])
+
+  # Return a function which converts a batch of rows (a list of tuples) with
+  # the given columns, or None if none of the columns need converting. tables
+  # is the table every column comes from, or a list of the table of each column
+  # (None for columns of no table). Pipelines are built once for each set of
+  # tables and columns.
+  #
+  # Conversion is done a column at a time, over the whole batch, which keeps
+  # the per-value work down to a single call of the converter.
+  def _pipeline(self, tables, columns):
+    if isinstance(tables, basestring):
+      tables = [tables] * len(columns)
+    key = (tuple(tables), tuple(columns))
+    if key not in self._pipelines:
+      steps = []
+      for i, (table, column) in enumerate(zip(tables, columns)):
+        converter = table and self._converters.get(self.column_types(table).get(column))
+        if converter:
+          steps.append((i, converter))
+
+      self._pipelines[key] = steps and self._compile_pipeline(steps)
+
+    return self._pipelines[key]
+
+  def _compile_pipeline(self, steps):
+    def convert(rows):
+      if not rows:
+        return rows
+      values = map(list, zip(*rows))
+      for i, converter in steps:
+        values[i] = [converter(value) if value is not None else None for value in values[i]]
+      return zip(*values)
+
+    return convert
+
+  # The table of each column selected by a query, so that columns of the same
+  # name from joined tables are converted by their own types. Aggregates and
+  # the like are looked up in the query's own table. If the columns of a table
+  # can't be told (say, it's a subquery), every column is looked up in the
+  # query's own table.
+  def _sources(self, ast):
+    sources = []
+    for table, fields in ast.projections.iteritems():
+      if fields == ['*']:
+        fields = [col for col in self.column_types(table) if table != ast.table_name or col not in ast.defers]
+        if not fields:
+          return ast.table_name
+      sources.extend([table] * len(fields))
+
+    extra = len(ast.aggregates) + len(ast.windows) + bool(ast.searches and ast.searches['snippet'])
+    return sources + [ast.table_name] * extra
+
+  # The table of each of the columns returned by raw SQL: the first of the
+  # tables it reads from which has a column of that name. Columns which more
+  # than one of them have, with different types, are left unconverted.
+  def _sources_named(self, sql, columns):
+    tables = _read_tables.findall(sql)
+    sources = []
+    for column in columns:
+      found = [table for table in tables if column in self.column_types(table)]
+      types = set(self.column_types(table)[column] for table in found)
+      sources.append(found[0] if len(types) == 1 else None)
+    return sources
+
+  # Forget the table metadata that has been cached, after the schema changes.
+  def _clear_caches(self):
+    self.schema_generation += 1
+    self._column_types   = {}
+    self._unique_indexes = {}
+    self._pipelines      = {}
 
   # Cast arel types into DB-safe values
   def _type_casted(self, typ, value):
@@ -153,27 +532,34 @@ class SQLAdapter(AbstractAdapter):
 
   # SQL Statement builders
   def _build_find_sql(self, ast):
-    sql = self._build_select(ast)
+    sql = ''
+    if ast.ctes:
+      sql += self._build_with(ast)
+    sql += self._build_select(ast)
     sql += self._build_from(ast)
 
     if ast.joins:
       sql += self._build_join(ast)
-    if ast.wheres:
+    if ast.searches:
+      sql += self._build_search_join(ast)
+    if ast.wheres or ast.searches:
       sql += self._build_where(ast)
     if ast.groups:
       sql += self._build_group(ast)
-    if ast.orders:
-      sql += self._build_order(ast)
     if ast.havings:
       sql += self._build_having(ast)
+    # The order and limit of a compound query apply to all of its rows, so
+    # they follow the unions.
+    if ast.unions:
+      sql += self._build_union(ast)
+    if ast.orders or ast.searches:
+      sql += self._build_order(ast)
     if ast.limits:
       sql += self._build_limit(ast)
     if ast.offsets:
       sql += self._build_offset(ast)
     if ast.locks:
       sql += self._build_lock(ast)
-    if ast.unions:
-      sql += self._build_union(ast)
 
     return sql
 
@@ -183,7 +569,12 @@ class SQLAdapter(AbstractAdapter):
     if defaults:
       sql += """ DEFAULT VALUES"""
     else:
-      sql += """ VALUES (%s)""" % self._build_values(ast)
+      sql += """ VALUES %s""" % self._build_values(ast)
+
+    if ast.conflicts:
+      sql += self._build_on_conflict(ast)
+    if ast.returnings and self.supports_returning:
+      sql += self._build_returning(ast)
 
     return sql
 
@@ -208,12 +599,21 @@ class SQLAdapter(AbstractAdapter):
   def _build_select(self, ast):
     statements = []
     for table, fields in ast.projections.iteritems():
+      # Deferred columns are left out by spelling out every other column.
+      if table == ast.table_name and fields == ['*'] and ast.defers:
+        fields = [col for col in self.column_types(table) if col not in ast.defers]
       for field in fields:
         statements.append(table+'.'+field)
 
     for aggregate in ast.aggregates:
       statements.append(aggregate)
 
+    for window in ast.windows:
+      statements.append(self._build_window(window))
+
+    if ast.searches and ast.searches['snippet']:
+      statements.append(self._build_snippet(ast))
+
     if not statements:
       statements.append('*')
 
@@ -229,9 +629,22 @@ class SQLAdapter(AbstractAdapter):
 
     for values in ast.value_set:
       casted_vals = [self._casted(value) for value in values]
-      statements.append(','.join(casted_vals))
+      statements.append('(%s)' % ','.join(casted_vals))
+
+    return ', '.join(statements)
 
-    return ', '.join(casted_vals)
+  # Existing rows take on the inserted values through the `excluded` pseudo-
+  # table, so a single statement covers any number of rows.
+  def _build_on_conflict(self, ast):
+    sql = """ ON CONFLICT (%s)""" % ', '.join(ast.conflicts['columns'])
+    if not ast.conflicts['update']:
+      return sql + """ DO NOTHING"""
+
+    assignments = ['%s = excluded.%s' % (col, col) for col in ast.conflicts['update']]
+    return sql + """ DO UPDATE SET %s""" % ', '.join(assignments)
+
+  def _build_returning(self, ast):
+    return """ RETURNING %s""" % ', '.join(ast.returnings)
 
   def _build_set(self, ast):
     statements = []
@@ -240,13 +653,50 @@ class SQLAdapter(AbstractAdapter):
 
     return """ SET %s""" % ', '.join(statements)
 
+  # Queries in the FROM clause (see arel/table.py#from_query) take on the name
+  # of the table.
   def _build_from(self, ast):
-    return """ FROM %s""" % ', '.join(ast.froms)
+    sources = []
+    for source in ast.froms:
+      if isinstance(source, arel.Table):
+        source = '(%s) AS %s' % (self._build_find_sql(source), ast.table_name)
+      sources.append(source)
+
+    return """ FROM %s""" % ', '.join(sources)
+
+  def _build_with(self, ast):
+    statements = []
+    for name, cte in ast.ctes.iteritems():
+      query = cte['query']
+      if isinstance(query, arel.Table):
+        query = self._build_find_sql(query)
+      statements.append('%s AS (%s)' % (name, query))
+
+    recursive = any(cte['recursive'] for cte in ast.ctes.values())
+    return """WITH %s%s """ % ('RECURSIVE ' if recursive else '', ', '.join(statements))
+
+  def _build_window(self, window):
+    clauses = []
+    if window['partition']:
+      clauses.append('PARTITION BY %s' % ', '.join(window['partition']))
+    if window['order']:
+      clauses.append('ORDER BY %s' % ', '.join(window['order']))
+    if window['frame']:
+      clauses.append(window['frame'])
+
+    return '%s OVER (%s) AS %s' % (window['function'], ' '.join(clauses), window['name'])
 
   def _build_where(self, ast):
-    return """ WHERE %s""" % ' AND '.join(self._build_conditionals(ast.table_name, ast.wheres))
+    statements = self._build_conditionals(ast.table_name, ast.wheres)
+    if ast.searches:
+      statements.append('%s MATCH %s' % (self._search_table(ast.table_name), self._quoted(ast.searches['query'])))
+    return """ WHERE %s""" % ' AND '.join(statements)
 
   def _build_order(self, ast):
+    # Searches are ordered by relevance (FTS5's bm25 ranking) by default.
+    if not ast.orders and ast.searches:
+      return """ ORDER BY %s.rank""" % self._search_table(ast.table_name)
+
     # Order by the ID of the record, but only if no other ordering is specified.
     if not ast.orders:
       ast.orders.append('id ASC')
@@ -268,6 +718,19 @@ class SQLAdapter(AbstractAdapter):
 
     return ' '.join(statements)
 
+  def _build_search_join(self, ast):
+    search = self._search_table(ast.table_name)
+    return """ INNER JOIN %s ON %s.rowid = %s.id""" % (search, search, ast.table_name)
+
+  # An excerpt of the snippet column around the matched terms, of up to 16
+  # tokens.
+  def _build_snippet(self, ast):
+    search = self._search_table(ast.table_name)
+    column = list(self.column_types(search)).index(ast.searches['snippet'])
+    start, end = ast.searches['highlight']
+    return """snippet(%s, %d, %s, %s, '...', 16) AS snippet""" % \
+        (search, column, self._quoted(start), self._quoted(end))
+
   def _build_limit(self, ast):
     return """ LIMIT %d""" % ast.limits
 
@@ -279,10 +742,16 @@ class SQLAdapter(AbstractAdapter):
   def _build_lock(self, ast):
     return ""
 
+  # The ORDER BY and LIMIT of a query in a compound SELECT would apply to the
+  # whole of it, so queries which have their own (or a WITH clause) are
+  # selected from as subqueries.
   def _build_union(self, ast):
     statements = []
     for union in ast.unions:
-      statements.append(""" UNION ALL (%s)""" % self._build_select_sql(union))
+      sql = self._build_find_sql(union)
+      if union.orders or union.searches or union.limits or union.offsets or union.ctes:
+        sql = """SELECT * FROM (%s)""" % sql
+      statements.append(""" UNION ALL %s""" % sql)
 
     return ''.join(statements)
 
@@ -300,6 +769,13 @@ class SQLAdapter(AbstractAdapter):
           statements.append(stmt)
         continue
 
+      # Build the EXISTS subqueries (see arel/table.py#where_exists)
+      if field in ('exists', 'not_exists'):
+        operator = 'EXISTS' if field == 'exists' else 'NOT EXISTS'
+        for query in conditions:
+          statements.append('%s (%s)' % (operator, self._build_find_sql(query)))
+        continue
+
       # Build as binary-operated inequality statement
       statement = table_name+'.'+field
       if isinstance(conditions, tuple):
@@ -317,9 +793,13 @@ class SQLAdapter(AbstractAdapter):
         elif not conditions[0] and conditions[1]:
           statement += ' <= %s' % self._casted(conditions[1])
 
+      # Build as IN (subquery) condition
+      elif isinstance(conditions, arel.Table):
+        statement += ' IN (%s)' % self._build_find_sql(conditions)
+
       # Build as IN (list) condition
       elif isinstance(conditions, list):
-        statement += ' IN (%s)' % ','.join(map(self._casted, conditions))
+        statement = self._build_in(statement, conditions)
 
       # Build as an equality condition
       else:
@@ -330,6 +810,35 @@ class SQLAdapter(AbstractAdapter):
 
     return statements
 
+  # An IN (...) condition matching column against a list of values. Adapters
+  # whose database can take a whole list as a single (bound) value should do so
+  # for long lists, rather than have the database parse thousands of literals.
+  def _build_in(self, column, values):
+    return '%s IN (%s)' % (column, ','.join(map(self._casted, values)))
+
+  # Run build(*args), one of the ._build_*_sql() methods, returning the SQL it
+  # builds along with the values its builders bound with ._bind().
+  def _bound(self, build, *args):
+    outer = getattr(self._binding, 'params', None)
+    self._binding.params = params = {}
+    try:
+      return build(*args), params
+    finally:
+      self._binding.params = outer
+
+  # Bind value to a named parameter of the statement being built, and return
+  # the parameter's marker. Returns None if the statement is not being built
+  # by ._bound(), in which case the value has to be written into the SQL.
+  # Parameters are named by position, so statements of the same shape share
+  # their SQL (and the database's cached plan for it).
+  def _bind(self, value):
+    params = getattr(self._binding, 'params', None)
+    if params is None:
+      return None
+    name = 'bound_%d' % len(params)
+    params[name] = value
+    return ':' + name
+
   # Different from ._type_casted() in that this casts actual python types into
   # DB-safe values.
   def _casted(self, value):
@@ -347,6 +856,11 @@ class SQLAdapter(AbstractAdapter):
       return 'NULL'
     return '"%s"' % value
 
+  # Quote a string as an SQL string literal. Needed where the value may itself
+  # contain double quotes with a meaning of their own (like full-text queries).
+  def _quoted(self, value):
+    return "'%s'" % value.replace("'", "''")
+
   # Escape strings so that queries are not unexpectedly stopped by string values
   # containing special characters (any kind of quote, backslashes, etc.).
   # We are using `re` because it does the job well enough and making sure you
@@ -1,7 +1,64 @@
+import datetime
+import json
+import os
+import re
 import sqlite3
+from contextlib import contextmanager
 
 from active_record.connection_adapters.sql_adapter import SQLAdapter
 
+# Named sets of performance settings (PRAGMAs) which can be chosen with the
+# `profile` key of database.yaml, or switched to at runtime with
+# .use_profile(). Settings listed under `pragmas` in database.yaml are applied
+# on top of the chosen profile:
+#
+#     production:
+#       adapter: sqlite3
+#       name: db/production.db
+#       profile: read-mostly
+#       pragmas:
+#         busy_timeout: 10000
+#
+# All of the profiles use WAL journaling, so readers are never blocked by a
+# writer, and switching between profiles never changes the journal mode of a
+# database that other processes may have open.
+PROFILES = {
+  # SQLite's own defaults, apart from the journal.
+  'default': {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000
+  },
+
+  # Many concurrent readers and occasional writes. Safe against application
+  # crashes; a power loss may roll back the most recent transactions.
+  'read-mostly': {
+    'journal_mode': 'wal',
+    'synchronous':  'normal',
+    'mmap_size':    268435456,  # 256MB
+    'cache_size':   -65536,     # 64MB (negative values are in KiB)
+    'temp_store':   'memory',
+    'busy_timeout': 5000
+  },
+
+  # Every committed transaction survives a power loss.
+  'durable': {
+    'journal_mode': 'wal',
+    'synchronous':  'full',
+    'busy_timeout': 5000
+  },
+
+  # Large imports and other ingest jobs. Nothing is synced to disk until the
+  # operating system decides to, so only use this around work that can be
+  # redone from scratch.
+  'bulk-load': {
+    'journal_mode': 'wal',
+    'synchronous':  'off',
+    'cache_size':   -262144,    # 256MB
+    'temp_store':   'memory',
+    'busy_timeout': 30000
+  }
+}
+
 class SQLite3Adapter(SQLAdapter):
   _type_map = {
     'boolean':   """BOOL""",
@@ -15,10 +72,222 @@ class SQLite3Adapter(SQLAdapter):
     'timestamp': """TIMESTAMP"""
   }
 
-  def __init__(self, db_name):
-    self.conn = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-    self.conn.text_factory = str # Disregard unicode values, typecast as str()
+  # The PRAGMAs which make up a performance profile, in the order they should
+  # be applied (the journal mode can't change inside a transaction, so it
+  # goes first).
+  _pragmas = [
+    'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store',
+    'busy_timeout', 'foreign_keys'
+  ]
+
+  # Some PRAGMAs report their values as numbers, even though they are set by
+  # name. Used to make .settings() readable.
+  _pragma_names = {
+    'synchronous':  { 0: 'off', 1: 'normal', 2: 'full', 3: 'extra' },
+    'temp_store':   { 0: 'default', 1: 'file', 2: 'memory' },
+    'foreign_keys': { 0: False, 1: True }
+  }
+
+  # ON CONFLICT clauses arrived in SQLite 3.24, RETURNING in 3.35.
+  supports_upsert    = sqlite3.sqlite_version_info >= (3, 24, 0)
+  supports_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+  # Lists of more values than this are matched with IN (...) as a single JSON
+  # array, bound as a parameter and read back with json_each(), which is built
+  # in from SQLite 3.38 on. Parsing one string is much cheaper for SQLite than
+  # parsing thousands of literals, statements stay well clear of its length
+  # limits, and lists of any length share a single cached statement. Older
+  # versions match the list in chunks of this many literals instead.
+  large_in_list = 100
+  supports_json = sqlite3.sqlite_version_info >= (3, 38, 0)
+
+  # pragmas is a dictionary of the settings to apply to every connection this
+  # adapter opens. See PROFILES for examples. A read_only adapter refuses to
+  # make any changes to the database. Unless check_same_thread is False, the
+  # connection may only be used by the thread that opened it.
+  def __init__(self, db_name, pragmas=None, read_only=False, check_same_thread=True):
+    self.db_name   = db_name
+    self.pragmas   = dict(pragmas or {})
+    self.read_only = read_only
+    self.check_same_thread = check_same_thread
+    self.conn = self._connect()
     self.cursor = self.conn.cursor()
+    self._clear_caches()
+
+  # Connections can't be shared between processes, so only the settings are
+  # pickled. The receiving process opens its own connection with them.
+  def __getstate__(self):
+    return { 'db_name': self.db_name, 'pragmas': self.pragmas, 'read_only': self.read_only,
+             'check_same_thread': self.check_same_thread }
+
+  def __setstate__(self, state):
+    self.__init__(state['db_name'], state['pragmas'], state['read_only'], state['check_same_thread'])
+
+  def reopen(self, read_only=False):
+    return SQLite3Adapter(self.db_name, self.pragmas, read_only, self.check_same_thread)
+
+  # Databases in files are copied byte for byte, which is much faster to
+  # restore than replaying their contents. In-memory databases are dumped as
+  # SQL instead, as there's no file to copy.
+  def snapshot(self):
+    self.conn.commit()
+    if self._in_memory():
+      return ('sql', self._dump())
+
+    # Everything in the write-ahead log is moved into the file first.
+    self.conn.execute("""PRAGMA wal_checkpoint(TRUNCATE)""").fetchall()
+    with open(self.db_name, 'rb') as f:
+      return ('file', f.read())
+
+  # The database is replaced underneath the connection, so it is closed and
+  # opened again. Any other connections to the database (including those of
+  # other processes) must be closed first.
+  def restore(self, snapshot):
+    kind, data = snapshot
+    self.conn.close()
+    if kind == 'file':
+      for suffix in ('-wal', '-shm'):
+        if os.path.exists(self.db_name + suffix):
+          os.remove(self.db_name + suffix)
+      with open(self.db_name, 'wb') as f:
+        f.write(data)
+
+    self.conn = self._connect()
+    if kind == 'sql':
+      self.conn.executescript(data)
+      for name in self._fts_tables():
+        self.conn.execute("""INSERT INTO %s (%s) VALUES ('rebuild')""" % (name, name))
+      self.conn.commit()
+    self.cursor = self.conn.cursor()
+    self.in_transaction = False
+    self._clear_caches()
+
+  # Apply the named profile to this adapter's connection, optionally with some
+  # settings overridden. Settings of the current profile which the new one
+  # doesn't mention are left as they are.
+  #
+  # This should not be called while a transaction is open.
+  def use_profile(self, name, **overrides):
+    if name not in PROFILES:
+      raise KeyError('No profile named "%s" exists' % name)
+
+    pragmas = dict(PROFILES[name], **overrides)
+    self._apply_pragmas(self.conn, pragmas)
+    self.pragmas.update(pragmas)
+
+  # Switch to the named profile for the duration of a `with` block, then go
+  # back to the previous settings.
+  #
+  #     with DB_ADAPTER.profile('bulk-load'):
+  #       Event.import_file('events.csv')
+  @contextmanager
+  def profile(self, name, **overrides):
+    previous = self.settings()
+    self.use_profile(name, **overrides)
+    try:
+      yield self
+    finally:
+      self._apply_pragmas(self.conn, previous)
+      self.pragmas = previous
+
+  # Return the settings that are actually in effect on the connection, which
+  # may differ from those requested (an in-memory database can't use WAL, for
+  # instance).
+  def settings(self):
+    settings = {}
+    for pragma in self._pragmas:
+      value = self.conn.execute("""PRAGMA %s""" % pragma).fetchone()[0]
+      settings[pragma] = self._pragma_names.get(pragma, {}).get(value, value)
+
+    return settings
+
+
+
+  # HELPERS
+  # Open a new connection to this adapter's database with its settings applied.
+  #
+  # Values are converted by the adapter's own converter pipelines (see
+  # SQLAdapter._pipeline) rather than by declared type, which sqlite3 would do
+  # one value at a time. Raw queries get pipelines too (see SQLAdapter.query).
+  # Column name converters ("col AS 'name [date]'") are still available to
+  # them, and the pipelines leave values these converted as they are.
+  #
+  # The driver is kept out of transactions altogether (isolation_level=None):
+  # left to itself, it opens one before an INSERT, UPDATE or DELETE, and
+  # commits whatever is open before any other statement it doesn't recognise
+  # as a SELECT, which includes queries starting with WITH. Statements outside
+  # of .transaction() are committed as they run, and transactions are begun
+  # and ended explicitly (see SQLAdapter.begin_transaction()).
+  def _connect(self):
+    conn = sqlite3.connect(self.db_name, detect_types=sqlite3.PARSE_COLNAMES,
+                           check_same_thread=self.check_same_thread, isolation_level=None)
+    conn.text_factory = str # Disregard unicode values, typecast as str()
+    self._apply_pragmas(conn, self.pragmas)
+    if self.read_only:
+      conn.execute("""PRAGMA query_only = 1""")
+
+    return conn
+
+  # The database as SQL statements. Full-text indexes are left out, and rebuilt
+  # from their tables when the SQL is replayed: the tables FTS5 keeps them in
+  # can't be recreated by SQL of their own.
+  def _dump(self):
+    internal = set('%s_%s' % (name, suffix) for name in self._fts_tables()
+                   for suffix in ('config', 'content', 'data', 'docsize', 'idx'))
+
+    statements = []
+    for sql in self.conn.iterdump():
+      table = re.match(r'(?:CREATE TABLE|INSERT INTO) [\'"]?(\w+)', sql)
+      if not (table and table.group(1) in internal):
+        statements.append(sql)
+    return '\n'.join(statements)
+
+  def _fts_tables(self):
+    sql = """SELECT name FROM sqlite_master WHERE sql LIKE 'CREATE VIRTUAL TABLE%fts5%'"""
+    return [name for (name,) in self.conn.execute(sql).fetchall()]
+
+  def _in_memory(self):
+    return self.db_name == ':memory:' or self.db_name.startswith('file::memory:')
+
+  def _apply_pragmas(self, conn, pragmas):
+    for pragma in pragmas:
+      if pragma not in self._pragmas:
+        raise ValueError('"%s" is not a supported setting' % pragma)
+
+    for pragma in self._pragmas:
+      if pragma in pragmas:
+        value = pragmas[pragma]
+        if isinstance(value, bool):
+          value = int(value)
+        conn.execute("""PRAGMA %s = %s""" % (pragma, value)).fetchall()
+
+  def _build_in(self, column, values):
+    size = self.large_in_list
+    if len(values) <= size:
+      return SQLAdapter._build_in(self, column, values)
+
+    marker = self.supports_json and self._bind(json.dumps(values, default=self._json_value))
+    if marker:
+      return """%s IN (SELECT value FROM json_each(%s))""" % (column, marker)
+    chunks = [SQLAdapter._build_in(self, column, values[i:i + size]) for i in xrange(0, len(values), size)]
+    return '(%s)' % ' OR '.join(chunks)
+
+  # Dates and times are compared as the strings they are stored as.
+  def _json_value(self, value):
+    if isinstance(value, datetime.datetime):
+      return self._type_casted('datetime', value)
+    if isinstance(value, datetime.date):
+      return self._type_casted('date', value)
+    return str(value)
+
 
 def new(db_config):
-  return SQLite3Adapter(db_config['name'])
+  pragmas = {}
+  if db_config.get('profile'):
+    if db_config['profile'] not in PROFILES:
+      raise KeyError('No profile named "%s" exists' % db_config['profile'])
+    pragmas.update(PROFILES[db_config['profile']])
+  pragmas.update(db_config.get('pragmas') or {})
+
+  return SQLite3Adapter(db_config['name'], pragmas,
+                        check_same_thread=db_config.get('check_same_thread', True))
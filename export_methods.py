@@ -0,0 +1,134 @@
+import csv
+import gzip
+import json
+import datetime
+
+from active_record.setup import *
+
+# Export Methods
+#
+# These methods write every record matched by a relation to a file, reading
+# from the database in batches rather than loading the whole relation. No
+# model instances (or Result objects) are created along the way, so exports of
+# any size run in flat memory.
+#
+# Both methods accept the same options:
+#   - compress:    Write gzip-compressed output to the file object.
+#   - batch_size:  The number of rows to fetch from the database at a time.
+#   - progress:    A callable which is passed the number of rows written so
+#                  far after each batch.
+#
+# Both return the number of rows that were written. Every column is exported,
+# including any the model defers; use .select() to export only some of them.
+
+# Write the records matched by this relation to fileobj as CSV, with a header
+# row of the column names (even if there are no rows) unless header is False.
+# NULLs are written as empty fields.
+#
+#   with open('people.csv', 'wb') as f:
+#     Person.relation.where(age=(18, None)).export_csv(f)
+def export_csv(self, fileobj, header=True, compress=False, batch_size=1000, progress=None):
+  def write(out, columns, rows):
+    writer = out.csv_writer
+    if not writer:
+      writer = out.csv_writer = csv.writer(out)
+      if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+
+  return _export(self, fileobj, _csv_formats, write, compress, batch_size, progress)
+
+# Write the records matched by this relation to fileobj as JSON Lines: one JSON
+# object per line, keyed by column name.
+def export_jsonl(self, fileobj, compress=False, batch_size=1000, progress=None):
+  dumps = json.JSONEncoder(separators=(',', ':')).encode
+
+  def write(out, columns, rows):
+    out.writelines(dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+  return _export(self, fileobj, _json_formats, write, compress, batch_size, progress)
+
+
+
+# HELPERS
+# Formatting functions for each column type, used when the database hands back
+# a value that the output format can't represent directly. Types which aren't
+# listed are written as they are.
+def _iso(value):
+  if isinstance(value, (datetime.date, datetime.time)):
+    return value.isoformat()
+  return value
+
+def _csv_boolean(value):
+  if value is None:
+    return value
+  return int(bool(value))
+
+def _json_boolean(value):
+  if value is None:
+    return value
+  return bool(value)
+
+def _json_decimal(value):
+  if value is None or isinstance(value, (int, long, float)):
+    return value
+  return float(value)
+
+_csv_formats = {
+  'boolean':   _csv_boolean,
+  'date':      _iso,
+  'time':      _iso,
+  'datetime':  _iso,
+  'timestamp': _iso
+}
+
+_json_formats = dict(_csv_formats, boolean=_json_boolean, decimal=_json_decimal)
+
+# A wrapper around the output file, so the writers can keep state (like the
+# csv writer) between batches.
+class _Output(object):
+  def __init__(self, fileobj):
+    self.fileobj    = fileobj
+    self.csv_writer = None
+
+  def write(self, data):
+    self.fileobj.write(data)
+
+  def writelines(self, lines):
+    self.fileobj.writelines(lines)
+
+def _export(relation, fileobj, formats, write, compress, batch_size, progress):
+  if compress:
+    fileobj = gzip.GzipFile(fileobj=fileobj, mode='wb')
+
+  out = _Output(fileobj)
+  types = DB_ADAPTER.column_types(relation.table_name)
+  formatters = None
+  written = 0
+
+  try:
+    for columns, rows in DB_ADAPTER.stream(relation.arel_table.undefer(), batch_size):
+      # Work out once which columns need formatting, so rows which don't need
+      # any are written untouched.
+      if formatters is None:
+        formatters = [(i, formats[types[col]]) for i, col in enumerate(columns)
+                      if types.get(col) in formats]
+
+      if formatters:
+        rows = [_formatted(row, formatters) for row in rows]
+      write(out, columns, rows)
+
+      written += len(rows)
+      if progress and rows:
+        progress(written)
+  finally:
+    if compress:
+      fileobj.close()
+
+  return written
+
+def _formatted(row, formatters):
+  row = list(row)
+  for i, formatter in formatters:
+    row[i] = formatter(row[i])
+  return row
@@ -1,5 +1,7 @@
 from active_record.setup import *
-from active_record.result import Result
+from active_record.result import Result, Siblings
+from active_record.macros.has_many import counter_caches
+import active_record.loader as loader
 
 # Finder Methods
 #
@@ -11,8 +13,15 @@ from active_record.result import Result
 
 # Retrieve the record which has an id matching the given one. Limited to one
 # result.
+#
+# Inside a loader.batching() block, the record is fetched through the block's
+# loader, along with any lookups queued by .find_later() (see loader.py).
 @classmethod
 def find(cls, row_id):
+  batch = loader.scope()
+  if batch:
+    return batch.load(cls, row_id).get()
+
   arel_table = cls.arel_table.where(**{ 'id': row_id }).limit(1)
   found = DB_ADAPTER.find(arel_table)
 
@@ -20,6 +29,16 @@ def find(cls, row_id):
     inst = cls(found[0],exists=True)
     return inst
 
+# Queue a lookup of the record with the given id, returning a Deferred whose
+# .get() returns the record. Lookups are collected until one of them is needed,
+# and then fetched for the whole model with a single query.
+#
+#   authors = [Person.find_later(post.person_id) for post in posts]
+#   authors[0].get()  # fetches every queued Person at once
+@classmethod
+def find_later(cls, row_id):
+  return loader.current().load(cls, row_id)
+
 # Similar to find, but with any condition. Limited to one result. References for
 # syntax are located at arel/table.py#where
 @classmethod
@@ -43,14 +62,34 @@ def find_or_new(cls, **attrs):
   return cls.new(**attrs)
 
 # Similar to .find_or_new(), but calling .create() instead.
+#
+# When the given attributes are exactly the columns of a unique index, the
+# record is inserted first, as an upsert which leaves any existing record
+# alone, and only looked up if it already existed. This can't race with
+# another process creating the same record.
 @classmethod
 def find_or_create(cls, **attrs):
+  if _upsertable(cls, attrs) and cls.new(**attrs).validate():
+    # DO NOTHING leaves an existing row alone, so its UPDATE triggers (like
+    # those of change tracking) don't fire. The existing row is looked up.
+    return cls.upsert(attrs, unique_by=attrs.keys(), update=[])
+
   found = cls.find_by(**attrs)
 
   if found:
     return found
   return cls.create(**attrs)
 
+# Whether .find_or_create() can be done as a single upsert for these attributes.
+# Counter caches need to know whether a row was actually inserted, which an
+# upsert can't tell us, so those tables always take the two-step path.
+def _upsertable(cls, attrs):
+  if not (attrs and DB_ADAPTER.supports_upsert):
+    return False
+  if cls.table_name in counter_caches:
+    return False
+  return set(attrs) in [set(index) for index in DB_ADAPTER.unique_indexes(cls.table_name)]
+
 
 # The remaining methods are purposely not labeled as class methods as they
 # can only be called on Relation objects.
@@ -66,11 +105,11 @@ def find_or_create(cls, **attrs):
 #     Person.all #=> [<list of Person objects>]
 @property
 def all(self):
-  return [self.model(obj,True) for obj in DB_ADAPTER.find(self.arel_table)]
+  return _instances(self.model, DB_ADAPTER.find(self.arel_table))
 
 # Return only the first record (or n records) which match the current query.
 def first(self, n=1):
-  found = [self.model(f,True) for f in DB_ADAPTER.find(self.arel_table.limit(n))]
+  found = _instances(self.model, DB_ADAPTER.find(self.arel_table.limit(n)))
   if not found:
     return None
   if n == 1:
@@ -79,10 +118,19 @@ def first(self, n=1):
 
 # Return only the last record (or n records) which match the current query.
 def last(self, n=1):
-  found = [self.model(f,True) for f in DB_ADAPTER.find(self.arel_table.reverse().limit(n))]
+  found = _instances(self.model, DB_ADAPTER.find(self.arel_table.reverse().limit(n)))
 
   if not found:
     return None
   if n == 1:
     return found[0]
   return found
+
+# Create instances for records found by a single query, linked to each other
+# as siblings (see result.py).
+def _instances(model, records):
+  instances = Siblings(model(record, True) for record in records)
+  if len(instances) > 1:
+    for inst in instances:
+      inst.siblings = instances
+  return instances
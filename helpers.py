@@ -25,6 +25,7 @@ def make_class_name(name):
   return name.replace('_', ' ').title().replace(' ', '')
 
 
-# Return the names of the columns of the table with the given name.
+# Return the names of the columns of the table with the given name, in the
+# order they are defined.
 def get_column_names(table_name):
-  return map(lambda col: col[1], DB_ADAPTER.table_structure(table_name).values.values())
+  return DB_ADAPTER.column_types(table_name).keys()
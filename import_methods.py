@@ -0,0 +1,175 @@
+import csv
+import gzip
+import json
+import time
+import datetime
+
+from active_record.setup import *
+from active_record.result import Result
+from active_record.macros.has_many import update_counters
+
+# Import Methods
+#
+# These methods load records into a model's table in bulk, straight from a
+# file. The file is read as a stream, and rows are written in batches: each
+# batch is a single prepared INSERT executed for every row (executemany), in a
+# transaction of its own. This avoids the per-record INSERT and commit that
+# .create() performs, and is the fastest way to load large amounts of data.
+
+# Load every record in the file at `path` into this model's table.
+#
+# Options:
+#   - format:          'csv' or 'jsonl'. By default, this is taken from the file
+#                      extension. Files ending in .gz are decompressed.
+#   - batch_size:      The number of rows written per transaction.
+#   - validate:        Run the model's validations on each batch at once (see
+#                      Model.validate_all()), skipping the rows which fail
+#                      them. Turn this off for trusted data.
+#   - rebuild_indexes: Drop the table's non-unique indexes before loading, and
+#                      create them again afterwards. Much faster for loads that
+#                      are large compared to the existing table.
+#   - progress:        A callable which is passed the running totals (see below)
+#                      after each batch.
+#
+# CSV files must have a header row naming the columns. JSON Lines files must
+# have one object per line; the first object decides which columns are loaded.
+# Values are converted to the types of the table's columns, and empty values
+# in non-text columns are loaded as NULL.
+#
+# Returns a dictionary of totals:
+#   { rows: <loaded>, rejected: <failed validation>, seconds: <elapsed>,
+#     rows_per_second: <loaded per second> }
+#
+#   Person.import_file('people.csv.gz', batch_size=5000, validate=False)
+@classmethod
+def import_file(cls, path, format=None, batch_size=1000, validate=True, rebuild_indexes=False, progress=None):
+  if not format:
+    format = path[:-3] if path.endswith('.gz') else path
+    format = format.rsplit('.', 1)[-1]
+  if format not in _readers:
+    raise ValueError('Can not import files of format "%s"' % format)
+
+  opener = gzip.open if path.endswith('.gz') else open
+  types = DB_ADAPTER.column_types(cls.table_name)
+  totals = { 'rows': 0, 'rejected': 0, 'seconds': 0.0, 'rows_per_second': 0.0 }
+  started = time.time()
+
+  dropped = []
+  if rebuild_indexes:
+    names = [name for name, unique in DB_ADAPTER.indexes(cls.table_name).iteritems() if not unique]
+    dropped = DB_ADAPTER.drop_indexes(names)
+
+  try:
+    with opener(path, 'rb') as f:
+      columns, rows = _readers[format](f)
+      unknown = [col for col in columns if col not in types]
+      if unknown:
+        raise ValueError('"%s" has no columns named %s' % (cls.table_name, ', '.join(unknown)))
+
+      coercers = [_coercers.get(types[col]) for col in columns]
+      for batch in _batches(rows, batch_size):
+        batch = [_coerced(row, coercers) for row in batch]
+        loaded = _load(cls, columns, batch, validate)
+
+        totals['rows'] += loaded
+        totals['rejected'] += len(batch) - loaded
+        _time(totals, started)
+        if progress:
+          progress(totals)
+  finally:
+    DB_ADAPTER.restore_indexes(dropped)
+
+  _time(totals, started)
+  return totals
+
+
+
+# HELPERS
+# Readers return the list of column names in the file, and an iterator of rows
+# (lists of values aligned with those columns).
+def _read_csv(f):
+  reader = csv.reader(f)
+  columns = next(reader, None)
+  if columns is None:
+    return [], iter([])
+  return columns, reader
+
+def _read_jsonl(f):
+  lines = (line for line in f if line.strip())
+  first = next(lines, None)
+  if first is None:
+    return [], iter([])
+
+  first = json.loads(first)
+  columns = first.keys()
+
+  def rows():
+    yield [first[col] for col in columns]
+    for line in lines:
+      record = json.loads(line)
+      yield [record.get(col) for col in columns]
+
+  return columns, rows()
+
+_readers = { 'csv': _read_csv, 'jsonl': _read_jsonl, 'ndjson': _read_jsonl }
+
+# Coercion functions for each column type. Only strings are coerced (JSON
+# values usually arrive with the right type already), and empty strings become
+# NULL. Types which aren't listed are loaded as they are.
+def _coercer(convert):
+  def coerce(value):
+    if not isinstance(value, basestring):
+      return value
+    if value == '':
+      return None
+    return convert(value)
+  return coerce
+
+def _boolean(value):
+  return value.lower() in ('1', 't', 'true', 'y', 'yes')
+
+def _date(value):
+  return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+def _datetime(value):
+  return datetime.datetime.strptime(value[:19].replace('T', ' '), '%Y-%m-%d %H:%M:%S')
+
+_coercers = {
+  'boolean':   _coercer(_boolean),
+  'integer':   _coercer(int),
+  'decimal':   _coercer(float),
+  'date':      _coercer(_date),
+  'datetime':  _coercer(_datetime),
+  'timestamp': _coercer(_datetime)
+}
+
+def _coerced(row, coercers):
+  return tuple(coerce(value) if coerce else value for value, coerce in zip(row, coercers))
+
+def _batches(rows, size):
+  batch = []
+  for row in rows:
+    batch.append(row)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+# Write one batch of rows in a single transaction, returning how many were
+# written. Counter caches of any parents are adjusted in the same transaction.
+def _load(cls, columns, batch, validate):
+  if validate and getattr(cls, 'validations', None):
+    passed = cls.validate_all([cls(Result(columns, row)) for row in batch])
+    batch = [row for row, ok in zip(batch, passed) if ok]
+
+  with DB_ADAPTER.transaction():
+    DB_ADAPTER.insert_many(cls.table_name, columns, batch, commit=False)
+    update_counters(cls.table_name, [dict(zip(columns, row)) for row in batch], 1)
+
+  return len(batch)
+
+def _time(totals, started):
+  totals['seconds'] = time.time() - started
+  if totals['seconds']:
+    totals['rows_per_second'] = totals['rows'] / totals['seconds']
@@ -0,0 +1,159 @@
+import os
+import re
+import sys
+import warnings
+from contextlib import contextmanager
+
+# Instrumentation
+#
+# Database adapters announce every query they run here, before running it.
+# Anything can listen in by subscribing a function, which is called with the
+# SQL of each query:
+#
+#     with instrumentation.subscribed(lambda sql: log.debug(sql)):
+#       ...
+#
+# Two listeners are provided for development and testing:
+#
+#   - assert_max_queries(n) fails if a block runs more than n queries, listing
+#     each of them with the line of application code that caused it.
+#
+#   - detect_n_plus_one() watches for association getters running the same
+#     query (give or take its values) over and over for records that were
+#     found together (the "N+1 queries" problem), and raises or warns with the
+#     offending line. It can be turned on for a whole environment from
+#     database.yaml:
+#
+#         development:
+#           adapter: sqlite3
+#           name: db/development.db
+#           n_plus_one: raise     # or warn
+#
+# Nothing is recorded while there are no subscribers, so this costs nothing in
+# production.
+
+_subscribers = []
+
+# The directory of active record itself. Frames from files in here are skipped
+# when looking for the application code which ran a query.
+_root = os.path.dirname(os.path.abspath(__file__))
+
+# Raised when a block runs more queries than it was allowed.
+class QueryBudgetExceeded(AssertionError):
+  pass
+
+# Raised (or warned) when an association is loaded once per record in a loop.
+class NPlusOneQuery(RuntimeWarning):
+  pass
+
+
+def subscribe(fn):
+  _subscribers.append(fn)
+
+def unsubscribe(fn):
+  if fn in _subscribers:
+    _subscribers.remove(fn)
+
+@contextmanager
+def subscribed(fn):
+  subscribe(fn)
+  try:
+    yield fn
+  finally:
+    unsubscribe(fn)
+
+# Called by the adapters with the SQL of each query.
+def publish(sql):
+  for fn in _subscribers[:]:
+    fn(sql)
+
+# Return the (filename, line number, function name) of the application code
+# that is running, skipping any frames inside active record.
+def call_site(frame=None):
+  frame = _application_frame(frame or sys._getframe(1))
+  if frame:
+    return (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+# Reduce a query to its shape, by replacing literal values with placeholders.
+# Queries that only differ in their values have the same shape.
+def shape(sql):
+  sql = re.sub(r'\'(?:[^\']|\'\')*\'|"(?:[^"\\]|\\.)*"', '?', sql)
+  sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+  return re.sub(r'IN \([?,\s]*\)', 'IN (?)', sql)
+
+
+# Fail if the block runs more than `limit` queries. The recorded queries are
+# available as a list of (sql, call site) pairs:
+#
+#     with assert_max_queries(3) as queries:
+#       render_dashboard()
+@contextmanager
+def assert_max_queries(limit):
+  queries = []
+  with subscribed(lambda sql: queries.append((sql, call_site()))):
+    yield queries
+
+  if len(queries) > limit:
+    lines = ['%s\n      at %s:%d in %s' % ((sql,) + site) if site else sql for sql, site in queries]
+    raise QueryBudgetExceeded('Expected at most %d queries, but %d were run:\n    %s' % \
+        (limit, len(queries), '\n    '.join(lines)))
+
+
+# Counts the queries of each shape that association getters run for the
+# records of each query (their siblings, see result.py). Reaching the
+# threshold means an association is being loaded per record, usually while
+# looping over them.
+class NPlusOneDetector(object):
+  def __init__(self, threshold=3, action='raise'):
+    if action not in ('warn', 'raise'):
+      raise ValueError('N+1 queries can only be warned about or raised')
+    self.threshold = threshold
+    self.action    = action
+
+  def __call__(self, sql):
+    frame = _association_frame(sys._getframe(1))
+    if not frame:
+      return
+    siblings = getattr(frame.f_locals.get('inst'), 'siblings', None)
+    if not siblings:
+      return
+
+    # The counts are kept with the siblings, so they go away along with them.
+    counts = siblings.__dict__.setdefault('association_loads', {})
+    key = (self, shape(sql))
+    count = counts[key] = counts.get(key, 0) + 1
+
+    if count == self.threshold:
+      site = call_site(frame) or ('<unknown>', 0, '<unknown>')
+      message = 'An association ran the same query separately for %d records found together, ' \
+          'from %s:%d in %s. Load it for every record at once instead (see loader.py).\n    %s' % \
+          ((count,) + site + (sql,))
+      if self.action == 'raise':
+        raise NPlusOneQuery(message)
+      warnings.warn(message, NPlusOneQuery, stacklevel=2)
+
+# Watch for N+1 queries inside the block (see NPlusOneDetector).
+@contextmanager
+def detect_n_plus_one(threshold=3, action='raise'):
+  with subscribed(NPlusOneDetector(threshold, action)) as detector:
+    yield detector
+
+
+
+# HELPERS
+# The frame of the association getter running the query, if there is one.
+def _association_frame(frame):
+  while frame:
+    if frame.f_code.co_name == 'get_association':
+      return frame
+    frame = frame.f_back
+  return None
+
+# The first frame of application code, starting from the given frame.
+def _application_frame(frame):
+  while frame:
+    filename = os.path.abspath(frame.f_code.co_filename)
+    if not filename.startswith(_root + os.sep) and 'contextlib' not in filename:
+      return frame
+    frame = frame.f_back
+  return None
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from active_record.setup import *
+from active_record.result import Siblings
+
+# Loader
+#
+# Batches lookups of records by id. Instead of running a query for every call
+# to .find(), ids are collected until one of the records is actually needed,
+# and then every collected id for that model is fetched with a single
+# `WHERE id IN (...)` query.
+#
+# Lookups are queued with Model.find_later(), which returns a Deferred:
+#
+#     authors = [Person.find_later(post.person_id) for post in posts]
+#     names = [author.get().name for author in authors]   # one query
+#
+# Inside a batching() block, loaded records are also cached until the block
+# exits, and Model.find() goes through the same loader, so a record is only
+# ever fetched once per block, and any lookups queued for its model are
+# fetched along with it. This makes batching() a good fit for the scope of a
+# single request:
+#
+#     with loader.batching():
+#       handle(request)
+#
+# Cached records are shared between every caller that asks for them, and are
+# not refreshed if the database is changed by other means during the block.
+
+# The most ids fetched by a single query.
+BATCH_SIZE = 500
+
+# Each thread collects its own lookups.
+_local = threading.local()
+
+# A record which has been asked for, but not fetched yet.
+class Deferred(object):
+  def __init__(self, loader, model, row_id):
+    self.loader   = loader
+    self.model    = model
+    self.row_id   = row_id
+    self.resolved = False
+    self.value    = None
+
+  # Return the record (or None, if there is no record with this id), fetching
+  # it and every other pending lookup for its model if need be.
+  def get(self):
+    if not self.resolved:
+      self.loader.flush(self.model)
+    return self.value
+
+  def resolve(self, value):
+    self.value    = value
+    self.resolved = True
+
+
+class Loader(object):
+  # Unless `cache` is set, records are handed to the lookups that asked for
+  # them and then forgotten.
+  def __init__(self, cache=False):
+    self.cache   = cache
+    self.pending = {}  # model -> OrderedDict of id -> [Deferred]
+    self.loaded  = {}  # (model, id) -> instance, or None if not found
+    self.queries = 0
+
+  # Queue a lookup of the record with the given id, returning a Deferred.
+  def load(self, model, row_id):
+    row_id = _key(row_id)
+    deferred = Deferred(self, model, row_id)
+
+    if (model, row_id) in self.loaded:
+      deferred.resolve(self.loaded[(model, row_id)])
+    else:
+      self.pending.setdefault(model, OrderedDict()).setdefault(row_id, []).append(deferred)
+    return deferred
+
+  # Fetch every pending lookup for the given model.
+  def flush(self, model):
+    pending = self.pending.pop(model, None)
+    if not pending:
+      return
+
+    ids = pending.keys()
+    for start in xrange(0, len(ids), BATCH_SIZE):
+      chunk = ids[start:start + BATCH_SIZE]
+      found = {}
+      for record in DB_ADAPTER.find(model.arel_table.where(id=chunk)):
+        found[record.values['id']] = model(record, exists=True)
+      self.queries += 1
+
+      # Records fetched together are siblings (see result.py).
+      siblings = Siblings(found.values())
+      for inst in siblings:
+        inst.siblings = siblings
+
+      for row_id in chunk:
+        inst = found.get(row_id)
+        if self.cache:
+          self.loaded[(model, row_id)] = inst
+        for deferred in pending[row_id]:
+          deferred.resolve(inst)
+
+  # Drop any cached records for the given ids, so they are fetched again the
+  # next time they are asked for.
+  def forget(self, model, ids):
+    for row_id in ids:
+      self.loaded.pop((model, _key(row_id)), None)
+
+
+# Start a batching scope for the current thread (see above). Nested blocks
+# share the scope of the outermost one.
+@contextmanager
+def batching():
+  if getattr(_local, 'scope', None):
+    yield _local.scope
+    return
+
+  _local.scope = Loader(cache=True)
+  try:
+    yield _local.scope
+  finally:
+    _local.scope = None
+
+# The loader of the current batching scope, if there is one.
+def scope():
+  return getattr(_local, 'scope', None)
+
+# The loader lookups should be queued on: the current scope's, or else a
+# per-thread loader which doesn't cache anything.
+def current():
+  loader = scope()
+  if loader:
+    return loader
+
+  if not getattr(_local, 'loader', None):
+    _local.loader = Loader()
+  return _local.loader
+
+
+
+# HELPERS
+# Ids are compared with the ids the database returns, so numeric strings (as
+# often come from request parameters) are looked up as integers.
+def _key(row_id):
+  if isinstance(row_id, basestring) and row_id.isdigit():
+    return int(row_id)
+  return row_id
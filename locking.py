@@ -0,0 +1,49 @@
+import time
+
+# Locking
+#
+# Models whose table has a `lock_version` integer column are locked
+# optimistically. Nothing is locked while a record is read and changed.
+# Instead, saving it only succeeds if its version is still the one it was read
+# with, and moves the version on by one:
+#
+#     UPDATE people SET ..., lock_version = 4 WHERE id = 1 AND lock_version = 3
+#
+# If another writer saved the record in the meantime, nothing is updated and
+# .save() raises StaleObjectError, leaving the instance as it was. The usual
+# answer is to read the record again and redo the change, which retrying()
+# does:
+#
+#     def bump():
+#       counter = Counter.find(1)
+#       counter.value += 1
+#       counter.save()
+#
+#     locking.retrying(bump)
+#
+# Writers never wait on each other this way, which suits records which are
+# rarely changed by two writers at once. New records start at version 0. Set
+# `locking_column` on a model to use another column, or to None to turn
+# locking off.
+
+# Raised by .save() when the record was changed by someone else since it was
+# read.
+class StaleObjectError(Exception):
+  def __init__(self, record):
+    Exception.__init__(self, '%s %s was changed by someone else since it was read' % \
+        (record.__class__.__name__, record.record.values.get('id')))
+    self.record = record
+
+# Call fn, calling it again if it raises StaleObjectError, up to `attempts`
+# times in all, `pause` seconds apart. fn should read the records it changes
+# itself, so each attempt starts from their latest versions. Returns what fn
+# returns; the last StaleObjectError is raised if every attempt fails.
+def retrying(fn, attempts=3, pause=0):
+  for attempt in xrange(attempts):
+    try:
+      return fn()
+    except StaleObjectError:
+      if attempt == attempts - 1:
+        raise
+      if pause:
+        time.sleep(pause)
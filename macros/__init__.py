@@ -1,4 +1,7 @@
-from active_record.macros.validates  import validates
-from active_record.macros.belongs_to import belongs_to
-from active_record.macros.has_one    import has_one
-from active_record.macros.has_many   import has_many
+from active_record.macros.validates      import validates
+from active_record.macros.belongs_to     import belongs_to
+from active_record.macros.has_one        import has_one
+from active_record.macros.has_many       import has_many
+from active_record.macros.shards_by      import shards_by
+from active_record.macros.defers         import defers
+from active_record.macros.buffers_writes import buffers_writes
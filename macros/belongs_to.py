@@ -2,6 +2,8 @@ import sys
 import importlib
 
 import active_record.helpers as helpers
+from active_record.setup import DB_ADAPTER
+from active_record.macros.has_many import update_counters
 
 # Add a parent association to the referencing class.
 #
@@ -43,17 +45,18 @@ class BelongsToAssociation():
     else:
       self.column = parent+'_id'
 
-    # To improve efficiency, cache the value of this association after the first
-    # access of it. Then, when the value changes, refresh the cache.
-    self._cached = None
+    # To improve efficiency, the value of this association is cached on each
+    # instance after the first access of it (see _cache()), along with the id it
+    # was found by. When the id changes, the cache is refreshed.
 
 
   # Should return an instance of the parent model, representing the record which
   # this association references.
   def get_association(self, inst):
-    if self._cached:
-      print "cached"
-      return self._cached
+    parent_id = getattr(inst, self.column, None)
+    cache = _cache(inst)
+    if self in cache and cache[self][0] == parent_id:
+      return cache[self][1]
 
     module = importlib.import_module('models.'+self.parent)
     klass = getattr(module, self.parent_class, None)
@@ -61,19 +64,33 @@ class BelongsToAssociation():
     if not klass:
       raise NameError('Model "%s" has not been defined.' % self.parent_class)
 
-    parent_id = getattr(inst, self.column, None)
-
-    self._cached = klass.find(parent_id)
+    cache[self] = (parent_id, klass.find(parent_id))
 
-    return self._cached
+    return cache[self][1]
 
   # Should set the appropriate attribute of `inst` (as given by `self.column`)
   # to the id of the parent, then save this instance (with validations).
+  #
+  # Moving an existing record to a new parent also moves it between the two
+  # parents' counter caches, in the same transaction as the save.
   def set_association(self, inst, parent_inst):
-    inst.update_attributes({ self.column: parent_inst.id })
+    existed  = inst.exists
+    previous = inst.record.values.get(self.column)
+
+    with DB_ADAPTER.transaction():
+      saved = inst.update_attributes({ self.column: parent_inst.id })
+      # New records are counted by the insert itself.
+      if saved and existed and previous != parent_inst.id:
+        update_counters(inst.table_name, [{ self.column: previous }], -1, self.column)
+        update_counters(inst.table_name, [inst.record.values], 1, self.column)
 
-    print 'updating'
     # Update the cache by clearing it, then accessing the association.
-    self._cached = None
+    _cache(inst).pop(self, None)
     self.get_association(inst)
 
+
+# The associations cached on an instance, keyed by association. Kept in the
+# instance's __dict__ directly, as it isn't one of the model's attributes.
+def _cache(inst):
+  return inst.__dict__.setdefault('association_cache', {})
+
@@ -0,0 +1,39 @@
+import sys
+
+# Let the referencing class queue new records with Model.enqueue(), to be
+# written in batches by a background thread (see buffered_writer.py). Meant
+# for append-only tables, like events and audit logs, which take many small
+# inserts that nothing reads back straight away:
+#
+#     class Event(Base):
+#       buffers_writes(batch_size=1000, interval=0.5)
+#
+# Options:
+#   - max_size:   The most records held in memory at once. Once it is
+#                 reached, .enqueue() waits for room (see `timeout`).
+#   - batch_size: The most records written per transaction.
+#   - interval:   The longest a queued record waits before being written, in
+#                 seconds.
+#   - timeout:    How long .enqueue() waits for room before raising
+#                 BufferFull. None waits for as long as it takes, and 0
+#                 raises straight away.
+#   - retries:    How many more times a batch is tried after failing, before
+#                 it is given up on (and passed to `on_error`, if given).
+#   - on_error:   Called with the attributes of each batch that couldn't be
+#                 written, and the exception.
+def buffers_writes(max_size=10000, batch_size=500, interval=1.0, timeout=None, retries=2, on_error=None):
+  frame = sys._getframe(1)
+  locals = frame.f_locals
+
+  # Ensure we were called from a class def.
+  if locals is frame.f_globals or '__module__' not in locals:
+    raise TypeError("buffers_writes() can be used only from a class definition.")
+
+  locals['write_buffer'] = {
+    'max_size':   max_size,
+    'batch_size': batch_size,
+    'interval':   interval,
+    'timeout':    timeout,
+    'retries':    retries,
+    'on_error':   on_error
+  }
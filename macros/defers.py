@@ -0,0 +1,23 @@
+import sys
+
+# Leave the named columns out of the records this model loads by default.
+# They are fetched the first time one of them is read from an instance, and
+# for every record that was loaded along with it at the same time:
+#
+#     class Article(Base):
+#       defers('body')
+#
+#     for article in Article.relation.all:   # SELECT without body
+#       print article.title
+#       print article.body                   # one query, for every article
+#
+# Use .undefer() on a relation to load the columns up front instead.
+def defers(*columns):
+  frame = sys._getframe(1)
+  locals = frame.f_locals
+
+  # Ensure we were called from a class def.
+  if locals is frame.f_globals or '__module__' not in locals:
+    raise TypeError("defers() can be used only from a class definition.")
+
+  locals['deferred_columns'] = list(locals.get('deferred_columns', [])) + list(columns)
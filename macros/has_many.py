@@ -1,8 +1,14 @@
 import sys
 import importlib
+from collections import Counter
 
 import active_record.helpers as helpers
-from active_record.setup import INFLECTOR
+from active_record.setup import INFLECTOR, DB_ADAPTER
+
+# Every has_many association declared with a counter cache, keyed by the name
+# of the child table. Children consult this when they are created, destroyed,
+# or moved to another parent, so that the parent's counter stays in step.
+counter_caches = {}
 
 # Add a multiple child association to the referencing class.
 #
@@ -12,7 +18,15 @@ from active_record.setup import INFLECTOR
 # has_many associations indicate that a model is a parent of many instances of
 # another model. Databases can not reflect this in the parent table, and rely
 # on the child tables specifying a foreign key to define the relationship.
-def has_many(children, name=None, column_name=None):
+#
+# Setting counter_cache keeps a count of the children in a column on the parent
+# table, named "<name>_count" (a string can be given to use a different
+# column). The column must be defined in the schema:
+#     t.integer('comments_count', default=0)
+# The count is adjusted in the same transaction whenever a child is created,
+# destroyed, or moved to another parent through its belongs_to association,
+# and can be recalculated from scratch with Model.reset_counters().
+def has_many(children, name=None, column_name=None, counter_cache=False):
   frame = sys._getframe(1)
   locals = frame.f_locals
 
@@ -27,13 +41,24 @@ def has_many(children, name=None, column_name=None):
 
   if 'associations' not in locals:
     locals['associations'] = {}
-  locals['associations'][name] = HasManyAssociation(self, children, column_name)
+  association = HasManyAssociation(self, children, column_name)
+  locals['associations'][name] = association
+
+  if counter_cache:
+    if counter_cache is True:
+      counter_cache = name+'_count'
+    association.counter_column = counter_cache
+    counter_caches.setdefault(children, []).append(association)
 
 
 # A wrapping class to interact with all children of this association as one
 # attribute of the model.
 class HasManyAssociation():
   def __init__(self, parent, child, column_name):
+    # The tables on both sides of the association.
+    self.parent_table = INFLECTOR.plural(parent)
+    self.child_table  = child
+
     # The name of the module (parameterized form of the class name) in which the
     # child class should be located.
     self.child = INFLECTOR.singular_noun(child)
@@ -47,6 +72,9 @@ class HasManyAssociation():
     else:
       self.column = parent+'_id'
 
+    # The parent column counting the children, if a counter cache is kept.
+    self.counter_column = None
+
   # Should return an instance of the child model, representing the record which
   # this association references.
   def get_association(self, inst):
@@ -68,3 +96,23 @@ class HasManyAssociation():
     for child_inst in children:
       child_inst.update_attributes({ self.column: inst.id })
       child_inst.save()
+
+
+# Adjust the counter caches of every parent referenced by the given child rows
+# (dictionaries of column values) by `by`: 1 for creations, -1 for removals.
+# Rows sharing a parent are collapsed into a single UPDATE. If `column` is
+# given, only the association using that foreign key is adjusted.
+#
+# Nothing is committed here; callers are expected to wrap this and the write
+# that caused it in a single transaction.
+def update_counters(table_name, rows, by, column=None):
+  for association in counter_caches.get(table_name, []):
+    if column and association.column != column:
+      continue
+
+    parents = Counter(row.get(association.column) for row in rows)
+    for parent_id, count in parents.iteritems():
+      if parent_id is None:
+        continue
+      DB_ADAPTER.update_counters(association.parent_table, parent_id,
+          { association.counter_column: by * count }, commit=False)
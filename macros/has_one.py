@@ -2,6 +2,7 @@ import sys
 import importlib
 
 import active_record.helpers as helpers
+from active_record.macros.belongs_to import _cache
 
 # Add a singular child association to the referencing class.
 #
@@ -44,16 +45,18 @@ class HasOneAssociation():
     else:
       self.column = child+'_id'
 
-    # To improve efficiency, cache the value of this association after the first
-    # access of it. Then, when the value changes, refresh the cache.
-    self._cached = None
+    # To improve efficiency, the value of this association is cached on each
+    # instance after the first access of it (see _cache()), along with the id it
+    # was found by. When the id changes, the cache is refreshed.
 
 
   # Should return an instance of the child model, representing the record which
   # this association references.
   def get_association(self, inst):
-    if self._cached:
-      return self._cached
+    child_id = getattr(inst, self.column, None)
+    cache = _cache(inst)
+    if self in cache and cache[self][0] == child_id:
+      return cache[self][1]
 
     module = importlib.import_module('models.'+self.child)
     klass = getattr(module, self.child_class, None)
@@ -61,11 +64,9 @@ class HasOneAssociation():
     if not klass:
       raise NameError('Model "%s" has not been defined.' % self.child_class)
 
-    child_id = getattr(inst, self.column, None)
-
-    self._cached = klass.find(child_id)
+    cache[self] = (child_id, klass.find(child_id))
 
-    return self._cached
+    return cache[self][1]
 
   # Should set the appropriate attribute of `inst` (as given by `self.column`)
   # to the id of the child, then save this instance (with validations).
@@ -73,5 +74,5 @@ class HasOneAssociation():
     inst.update_attributes({ self.column: child_inst.id })
 
     # Update the cache by clearing it, then accessing the association.
-    self._cached = None
+    _cache(inst).pop(self, None)
     self.get_association(inst)
@@ -0,0 +1,21 @@
+import sys
+
+from active_record.connection_adapters.sharded_adapter import ShardKey
+
+# Spread the records of the referencing class over the configured shards (see
+# connection_adapters/sharded_adapter.py), according to the value of `column`.
+#
+# Values are hashed onto the shards by default. To assign ranges of values to
+# particular shards instead, give a list of (upper_bound, shard_name) pairs:
+#     shards_by('tenant_id', ranges=[(1000, 'tenants_1'), (None, 'tenants_2')])
+#
+# When no shards are configured, this has no effect.
+def shards_by(column, ranges=None):
+  frame = sys._getframe(1)
+  locals = frame.f_locals
+
+  # Ensure we were called from a class def.
+  if locals is frame.f_globals or '__module__' not in locals:
+    raise TypeError("shards_by() can be used only from a class definition.")
+
+  locals['shard_key'] = ShardKey(column, ranges)
@@ -1,11 +1,30 @@
+import re
 import sys
 
+from active_record.setup import DB_ADAPTER
+
 # Add a validation to the referencing class.
 #
 # Validations are called automatically when a record is being saved to the
 # database. They can also be called manually (using .validate()), or turned off
 # by setting the `validate` flag in .save() to False.
-def validates(function):
+#
+# A validation is either a function which takes a model instance and returns
+# whether it is valid:
+#     validates(lambda person: person.age >= 0)
+#
+# or a list of column names followed by any of the built-in rules, which apply
+# to each of the named columns:
+#     validates('name', 'email', presence=True)
+#     validates('name', length=(1, 30))         # (minimum, maximum)
+#     validates('age', range=(0, None))         # None leaves a side open
+#     validates('email', format=r'[^@]+@[^@]+')
+#     validates('email', uniqueness=True)
+#
+# Built-in rules know how to check a whole list of records at once (see
+# Model.validate_all()). Uniqueness, in particular, is checked for an entire
+# batch with a single query.
+def validates(*args, **rules):
   frame = sys._getframe(1)
   locals = frame.f_locals
 
@@ -15,7 +34,18 @@ def validates(function):
 
   if 'validations' not in locals:
     locals['validations'] = []
-  locals['validations'].append(Validation(function))
+
+  if len(args) == 1 and callable(args[0]):
+    locals['validations'].append(Validation(args[0]))
+    return
+
+  if not args or not rules:
+    raise TypeError("validates() needs either a function, or column names and rules.")
+  for rule, option in rules.iteritems():
+    if rule not in rule_validations:
+      raise TypeError('"%s" is not a known validation rule.' % rule)
+    if option is not False and option is not None:
+      locals['validations'].append(rule_validations[rule](args, option))
 
 
 # A wrapping class to store a validation function.
@@ -27,3 +57,107 @@ class Validation():
   # Could be different if the provided validation is not defined correctly.
   def validate(self, inst):
     return self.func(inst)
+
+  # Should return a list of booleans, aligned with `instances`, saying whether
+  # each instance passes this validation. Validations which can check many
+  # records more cheaply than one at a time should override this.
+  def validate_all(self, instances):
+    return [self.validate(inst) for inst in instances]
+
+
+# The built-in rules. Each checks the value of every one of its columns, read
+# straight from the record, so no attribute lookups are involved.
+class ColumnValidation(Validation):
+  def __init__(self, columns, option):
+    self.columns = columns
+    self.option  = option
+
+  def validate(self, inst):
+    values = inst.record.values
+    for column in self.columns:
+      if not self.valid(values.get(column)):
+        return False
+    return True
+
+# The value must not be None or blank.
+class PresenceValidation(ColumnValidation):
+  def valid(self, value):
+    if isinstance(value, basestring):
+      return bool(value.strip())
+    return value is not None
+
+# The length of the value must be within (minimum, maximum). A single number is
+# taken as the maximum. None values are left to the presence rule.
+class LengthValidation(ColumnValidation):
+  def __init__(self, columns, option):
+    if not isinstance(option, (tuple, list)):
+      option = (None, option)
+    ColumnValidation.__init__(self, columns, option)
+
+  def valid(self, value):
+    if value is None:
+      return True
+    minimum, maximum = self.option
+    return (minimum is None or len(value) >= minimum) and \
+           (maximum is None or len(value) <= maximum)
+
+# The value must be within (minimum, maximum), inclusive.
+class RangeValidation(ColumnValidation):
+  def valid(self, value):
+    if value is None:
+      return True
+    minimum, maximum = self.option
+    return (minimum is None or value >= minimum) and \
+           (maximum is None or value <= maximum)
+
+# The value must match the given regular expression, in full.
+class FormatValidation(ColumnValidation):
+  def __init__(self, columns, option):
+    ColumnValidation.__init__(self, columns, re.compile(r'(?:%s)\Z' % option))
+
+  def valid(self, value):
+    if value is None:
+      return True
+    return bool(self.option.match(str(value)))
+
+# No other record may have the same value. Within a batch, the first record
+# with a value is allowed to keep it, and any later ones fail.
+class UniquenessValidation(ColumnValidation):
+  def validate(self, inst):
+    return self.validate_all([inst])[0]
+
+  def validate_all(self, instances):
+    if not instances:
+      return []
+
+    results = [True] * len(instances)
+    for column in self.columns:
+      values = [inst.record.values.get(column) for inst in instances]
+
+      # One query for the whole batch, finding which of its values are taken,
+      # and by which records.
+      wanted = list(set(value for value in values if value is not None))
+      taken = {}
+      if wanted:
+        arel_table = instances[0].arel_table.columns('id', column).where(**{ column: wanted })
+        for record in DB_ADAPTER.find(arel_table):
+          taken.setdefault(record.values[column], set()).add(record.values['id'])
+
+      seen = set()
+      for i, (inst, value) in enumerate(zip(instances, values)):
+        if value is None:
+          continue
+        own_id = inst.record.values.get('id') if inst.exists else None
+        if taken.get(value, set()) - set([own_id]) or value in seen:
+          results[i] = False
+        seen.add(value)
+
+    return results
+
+rule_validations = {
+  'presence':   PresenceValidation,
+  'length':     LengthValidation,
+  'range':      RangeValidation,
+  'format':     FormatValidation,
+  'uniqueness': UniquenessValidation
+}
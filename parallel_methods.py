@@ -0,0 +1,110 @@
+import multiprocessing
+
+from active_record.setup import *
+
+# Parallel Methods
+#
+# These methods run a read-only scan of a relation across a pool of worker
+# processes. The relation is split into ranges of primary keys, and each worker
+# opens its own read-only connection to the database, runs the relation's query
+# for one range at a time, and processes the records it finds. This lets
+# CPU-bound work on the records make use of every core, rather than being
+# limited to a single Python thread.
+#
+# Because the work happens in other processes, the functions which are passed
+# in (and the values they return) must be picklable: define them at the top
+# level of a module, not as lambdas or nested functions.
+#
+# Records are processed one primary key range at a time, with the ranges
+# combined in ascending order. An .order() on the relation is therefore only
+# respected within each range. Relations with a .limit() or .offset() can't be
+# split, and are refused.
+
+# Apply fn to every record matched by this relation, returning the list of
+# results.
+#
+#   totals = Order.relation.where(status='paid').parallel_map(order_total, workers=8)
+def parallel_map(self, fn, workers=None):
+  results = []
+  for chunk in _run(self, _map_range, fn, workers):
+    results.extend(chunk)
+  return results
+
+# Reduce every record matched by this relation to a single value. Each range
+# is reduced with fn(accumulator, record), starting from `initial`, and the
+# per-range values are then merged with combine(accumulator, value).
+#
+# As every range starts from `initial`, it must be an identity value for
+# combine (0 for a sum, [] for a list, ...), or it would be counted once per
+# range. A value that combine doesn't leave unchanged is refused.
+#
+#   def add_total(total, order): return total + order.total
+#   def add(a, b): return a + b
+#   revenue = Order.relation.parallel_reduce(add_total, add, 0)
+def parallel_reduce(self, fn, combine, initial, workers=None):
+  if combine(initial, initial) != initial:
+    raise ValueError('The initial value must be an identity value for combine, as every range starts from it')
+
+  partials = _run(self, _reduce_range, (fn, initial), workers)
+  if not partials:
+    return initial
+  return reduce(combine, partials)
+
+
+
+# HELPERS
+# The read-only adapter used by the current worker process.
+_worker_adapter = None
+
+def _start_worker(adapter):
+  global _worker_adapter
+  _worker_adapter = adapter.reopen(read_only=True)
+
+def _map_range(task):
+  model, ast, fn = task
+  return [fn(model(record, True)) for record in _worker_adapter.find(ast)]
+
+def _reduce_range(task):
+  model, ast, (fn, initial) = task
+  return reduce(fn, (model(record, True) for record in _worker_adapter.find(ast)), initial)
+
+# Split the relation into ranges and hand them out to a pool of workers. A few
+# more ranges than workers are made, so that a worker which finishes early
+# can pick up more of the work.
+def _run(relation, job, arg, workers):
+  ast = relation.arel_table
+  if ast.limits or ast.offsets:
+    raise ValueError('Relations with a limit or offset can not be scanned in parallel')
+
+  workers = workers or multiprocessing.cpu_count()
+  tasks = [(relation.model, range_ast, arg) for range_ast in _partition(ast, workers * 4)]
+  if not tasks:
+    return []
+
+  pool = multiprocessing.Pool(min(workers, len(tasks)), _start_worker, (DB_ADAPTER,))
+  try:
+    return pool.map(job, tasks)
+  finally:
+    pool.close()
+    pool.join()
+
+# Return a copy of the query for each of (at most) `parts` contiguous ranges of
+# primary keys which together cover every record the query can match.
+def _partition(ast, parts):
+  bounds = ast.columns().aggregate(
+    'MIN(%s.id) AS low' % ast.table_name,
+    'MAX(%s.id) AS high' % ast.table_name
+  )
+  bounds.orders = []
+  # Sharded models get a row of bounds from each shard.
+  found = [record.values for record in DB_ADAPTER.find(bounds) if record.values['low'] is not None]
+  if not found:
+    return []
+  low = min(values['low'] for values in found)
+  high = max(values['high'] for values in found)
+
+  size = max(1, (high - low + parts) // parts)
+  ranges = []
+  for start in xrange(low, high + 1, size):
+    ranges.append(ast.where('%s.id BETWEEN %d AND %d' % (ast.table_name, start, start + size - 1)))
+  return ranges
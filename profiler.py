@@ -0,0 +1,262 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import active_record.arel as arel
+import active_record.attributes as attributes
+from active_record.base import Base
+from active_record.result import Result
+from active_record.instrumentation import shape
+from active_record.connection_adapters.sql_adapter import SQLAdapter
+
+# Profiler
+#
+# Breaks the time spent inside active record down into the phases of its work,
+# to show where the overhead of the ORM lies compared to the database itself:
+#
+#   - arel:        Building queries (copying arel tables).
+#   - compile:     Turning arel tables into SQL (the adapter's _build_* methods).
+#   - adapter:     The adapter's own work around a query (committing, etc.).
+#   - execute:     Running the SQL and fetching its rows, in the database.
+#   - convert:     Converting column values to Python types.
+#   - materialise: Creating Result objects for the rows.
+#   - instantiate: Creating model instances.
+#   - attributes:  Reading and writing attributes of model instances.
+#
+# Time is exclusive: a phase's time doesn't include the phases it runs (an
+# association read under `attributes` doesn't include the query it runs). Each
+# phase's time is also broken down per model (table) and per query shape (see
+# instrumentation.shape()).
+#
+#     with profiler.profile() as report:
+#       render_dashboard()
+#     print report.to_json()
+#     open('orm.folded', 'w').write(report.folded())   # for flamegraph.pl
+#
+# Python 2 has no way of measuring memory allocations per call, so the number
+# of rows fetched and instances created are counted instead.
+#
+# The profiled methods are replaced while the block runs, for every thread, so
+# work done by other threads at the same time is profiled as well. Each phase
+# adds a small fixed cost to every call, which matters most for attribute
+# access; compare phases with each other rather than with unprofiled timings.
+# Streamed queries (.stream(), exports) are not profiled.
+
+# Methods to profile, as (phase, owner, name) triples.
+_targets = [
+  ('arel',        arel.Table,                   'copy'),
+  ('adapter',     SQLAdapter,                   'find'),
+  ('adapter',     SQLAdapter,                   'insert'),
+  ('adapter',     SQLAdapter,                   'update'),
+  ('adapter',     SQLAdapter,                   'delete'),
+  ('adapter',     SQLAdapter,                   'insert_many'),
+  ('adapter',     SQLAdapter,                   'update_counters'),
+  ('adapter',     SQLAdapter,                   'reset_counters'),
+  ('compile',     SQLAdapter,                   '_build_find_sql'),
+  ('compile',     SQLAdapter,                   '_build_insert_sql'),
+  ('compile',     SQLAdapter,                   '_build_update_sql'),
+  ('compile',     SQLAdapter,                   '_build_delete_sql'),
+  ('execute',     SQLAdapter,                   'query'),
+  ('materialise', Result,                       'parse_all'),
+  ('instantiate', Base,                         '__init__'),
+  ('attributes',  Base,                         '__getattr__'),
+  ('attributes',  attributes.ColumnAttribute,   '__get__'),
+  ('attributes',  attributes.ColumnAttribute,   '__set__'),
+  ('attributes',  attributes.AssociationAttribute, '__get__')
+]
+
+# Profile everything active record does inside the block, yielding the Report.
+@contextmanager
+def profile():
+  profiler = Profiler()
+  profiler.start()
+  try:
+    yield profiler.report
+  finally:
+    profiler.stop()
+
+
+# The time spent in each phase, overall, per model and per query shape.
+class Report(object):
+  def __init__(self):
+    self.seconds   = 0.0
+    self.phases    = OrderedDict((phase, _totals()) for phase, _, _ in _targets)
+    self.phases['convert'] = _totals()
+    self.models    = {}
+    self.queries   = {}
+    self.stacks    = {}
+    self.rows      = 0
+    self.instances = 0
+
+  def add(self, stack, seconds):
+    frame = stack[-1]
+    _add(self.phases[frame.phase], seconds)
+    if frame.table:
+      _add(self.models.setdefault(frame.table, {}).setdefault(frame.phase, _totals()), seconds)
+    if frame.shape:
+      query = self.queries.setdefault(frame.shape, { 'table': frame.table, 'phases': {} })
+      _add(query['phases'].setdefault(frame.phase, _totals()), seconds)
+
+    # Fetching rows runs under the query's own execution, which reads as one.
+    phases = [f.phase for i, f in enumerate(stack) if not i or f.phase != stack[i - 1].phase]
+    path = ';'.join([frame.table or '-', frame.shape or '-'] + phases)
+    self.stacks[path] = self.stacks.get(path, 0.0) + seconds
+
+  # A dictionary of everything measured, with times in seconds.
+  def as_dict(self):
+    return {
+      'seconds':   self.seconds,
+      'rows':      self.rows,
+      'instances': self.instances,
+      'phases':    self.phases,
+      'models':    self.models,
+      'queries':   self.queries
+    }
+
+  def to_json(self, **options):
+    return json.dumps(self.as_dict(), **options)
+
+  # The time of each stack of phases, in microseconds, in the "folded" format
+  # read by flamegraph.pl and speedscope:
+  #     <table>;<query shape>;<phase>;<phase>... <microseconds>
+  def folded(self):
+    lines = []
+    for path, seconds in sorted(self.stacks.iteritems()):
+      lines.append('%s %d' % (path.replace('\n', ' '), round(seconds * 1000000)))
+    return '\n'.join(lines) + '\n'
+
+
+class Profiler(object):
+  def __init__(self):
+    self.report   = Report()
+    self.local    = threading.local()
+    self.replaced = []
+    self.started  = None
+
+  def start(self):
+    for phase, owner, name in _targets:
+      for cls in [owner] + _subclasses(owner):
+        if name in cls.__dict__:
+          self._replace(cls, name, phase)
+    self.started = time.time()
+
+  def stop(self):
+    self.report.seconds += time.time() - self.started
+    for cls, name, original in reversed(self.replaced):
+      setattr(cls, name, original)
+    self.replaced = []
+
+  # Run fn as the given phase, recording its exclusive time.
+  def timed(self, phase, table, fn, *args, **kwargs):
+    stack = self._stack()
+    parent = stack[-1] if stack else None
+    frame = _Frame(phase, table or (parent and parent.table), parent and parent.shape)
+    stack.append(frame)
+    started = time.time()
+    try:
+      result = fn(*args, **kwargs)
+      if phase == 'compile':
+        frame.shape = shape(result)
+        if parent:
+          parent.shape = frame.shape
+      return result
+    finally:
+      elapsed = time.time() - started
+      self.report.add(stack, elapsed - frame.children)
+      stack.pop()
+      if parent:
+        parent.children += elapsed
+
+
+
+  # HELPERS
+  def _stack(self):
+    if not hasattr(self.local, 'stack'):
+      self.local.stack = []
+    return self.local.stack
+
+  def _replace(self, cls, name, phase):
+    original = cls.__dict__[name]
+    if isinstance(original, classmethod):
+      wrapped = classmethod(self._wrapper(phase, name, original.__get__(None, cls).im_func))
+    else:
+      wrapped = self._wrapper(phase, name, original)
+    self.replaced.append((cls, name, original))
+    setattr(cls, name, wrapped)
+
+  def _wrapper(self, phase, name, fn):
+    profiler = self
+
+    if name == 'parse_all':
+      # Rows are fetched while being materialised, so the fetch is counted as
+      # execution, and the pipeline as conversion.
+      def wrapper(cls, records, convert=None):
+        if records.description:
+          records = _Fetched(records.description, profiler.timed('execute', None, records.fetchall))
+          profiler.report.rows += len(records.rows)
+          if convert:
+            convert = _timed_convert(profiler, convert)
+        return profiler.timed('materialise', None, fn, cls, records, convert)
+    elif name == '__init__':
+      def wrapper(self, *args, **kwargs):
+        profiler.report.instances += 1
+        return profiler.timed(phase, self.table_name, fn, self, *args, **kwargs)
+    else:
+      def wrapper(self, *args, **kwargs):
+        return profiler.timed(phase, _table_of(self, args), fn, self, *args, **kwargs)
+
+    wrapper.__name__ = fn.__name__
+    return wrapper
+
+
+class _Frame(object):
+  def __init__(self, phase, table, shape):
+    self.phase    = phase
+    self.table    = table
+    self.shape    = shape
+    self.children = 0.0
+
+# Rows which have already been fetched, standing in for the cursor.
+class _Fetched(object):
+  def __init__(self, description, rows):
+    self.description = description
+    self.rows        = rows
+
+  def fetchall(self):
+    return self.rows
+
+  def __iter__(self):
+    return iter(self.rows)
+
+def _timed_convert(profiler, convert):
+  def timed_convert(rows):
+    return profiler.timed('convert', None, convert, rows)
+  return timed_convert
+
+def _totals():
+  return { 'seconds': 0.0, 'calls': 0 }
+
+def _add(totals, seconds):
+  totals['seconds'] += seconds
+  totals['calls'] += 1
+
+# The table a profiled call is working on, where it can be told: the model
+# instance, arel table or table name it was called on or with.
+def _table_of(self, args):
+  for candidate in (self,) + args[:1]:
+    table_name = getattr(candidate, 'table_name', None)
+    if isinstance(table_name, basestring):
+      return table_name
+  if args and isinstance(args[0], basestring) and ' ' not in args[0]:
+    return args[0]
+  return None
+
+# Every subclass of the class (old style classes can't list them).
+def _subclasses(cls):
+  found = []
+  for sub in getattr(cls, '__subclasses__', list)():
+    found.append(sub)
+    found.extend(_subclasses(sub))
+  return found
@@ -22,12 +22,36 @@ def includes(self, *tables):
   self.arel_table = self.arel_table.includes(*tables)
   return self
 
-def where(self, **conditions):
-  self.arel_table = self.arel_table.where(**conditions)
+def where(self, *statements, **conditions):
+  self.arel_table = self.arel_table.where(*statements, **conditions)
   return self
 
-def order(self, defaults, **conditionals):
-  self.arel_table = self.arel_table.order(defaults, **conditionals)
+def where_exists(self, query, on={}):
+  self.arel_table = self.arel_table.where_exists(query, on)
+  return self
+
+def where_not_exists(self, query, on={}):
+  self.arel_table = self.arel_table.where_not_exists(query, on)
+  return self
+
+def order(self, *defaults, **conditionals):
+  self.arel_table = self.arel_table.order(*defaults, **conditionals)
+  return self
+
+def aggregate(self, *aggregates):
+  self.arel_table = self.arel_table.aggregate(*aggregates)
+  return self
+
+def window(self, name, function, partition=None, order=None, frame=None):
+  self.arel_table = self.arel_table.window(name, function, partition, order, frame)
+  return self
+
+def with_cte(self, name, query, recursive=False):
+  self.arel_table = self.arel_table.with_cte(name, query, recursive)
+  return self
+
+def top_per_group(self, n, partition, order, name='position'):
+  self.arel_table = self.arel_table.top_per_group(n, partition, order, name)
   return self
 
 def group(self, *columns):
@@ -50,6 +74,22 @@ def offset(self, value):
   self.arel_table = self.arel_table.offset(value)
   return self
 
+def using(self, name):
+  self.arel_table = self.arel_table.using(name)
+  return self
+
+def search(self, query, snippet=None, highlight=('[', ']')):
+  self.arel_table = self.arel_table.search(query, snippet, highlight)
+  return self
+
+def defer(self, *columns):
+  self.arel_table = self.arel_table.defer(*columns)
+  return self
+
+def undefer(self, *columns):
+  self.arel_table = self.arel_table.undefer(*columns)
+  return self
+
 def reverse(self):
   self.arel_table = self.arel_table.reverse()
   return self
@@ -10,9 +10,13 @@ import active_record.arel as arel
 # to attributes or other related methods.
 
 class Relation(object):
-  from relation_methods import new, create, update, destroy, update_attribute, update_attributes, validate, save, reload
-  from finder_methods import find, find_by, find_or_new, find_or_create, all, first, last
-  from query_methods import select, includes, where, order, group, having, join, limit, offset, reverse
+  from relation_methods import new, create, enqueue, upsert, upsert_all, update, destroy, reset_counters, rebuild_search_index, update_attribute, update_attributes, validate, validate_all, save, save_all, reload
+  from finder_methods import find, find_later, find_by, find_or_new, find_or_create, all, first, last
+  from query_methods import select, includes, where, where_exists, where_not_exists, order, aggregate, window, with_cte, top_per_group, group, having, join, limit, offset, using, search, defer, undefer, reverse
+  from parallel_methods import parallel_map, parallel_reduce
+  from export_methods import export_csv, export_jsonl
+  from row_methods import as_tuples, as_dicts, as_namedtuples
+  from import_methods import import_file
 
   # Create a new Relation instance which copies the given arel table into this
   # instance. This avoids having to reset the query chain with each use.
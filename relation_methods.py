@@ -1,5 +1,9 @@
 from active_record.setup import *
 from active_record.result import Result
+from active_record.macros.has_many import update_counters
+import active_record.loader as loader
+import active_record.buffered_writer as buffered_writer
+from active_record.locking import StaleObjectError
 
 # Relation Methods
 #
@@ -20,6 +24,71 @@ def new(cls, **attrs):
 def create(cls, **attrs):
   return cls.new(**attrs).save()
 
+# Queue a new record with the provided attributes, to be inserted later by the
+# model's buffered writer (see buffered_writer.py). Only available to models
+# which call buffers_writes(). Returns False without queueing anything if the
+# record fails the model's validations.
+#
+#   Event.enqueue(kind='login', user_id=jon.id)
+@classmethod
+def enqueue(cls, **attrs):
+  if hasattr(cls, 'validations') and not cls.new(**attrs).validate():
+    return False
+
+  buffered_writer.writer(cls).put(attrs)
+  return True
+
+# Insert a record with the provided attributes, or update the existing record
+# which has the same values for the unique_by columns, in a single statement.
+# The unique_by columns must be covered by a unique index (or be the primary
+# key). The columns listed in `update` are overwritten on the existing record;
+# by default that is every provided attribute outside of unique_by, and an
+# empty list leaves the existing record untouched.
+#
+#   Person.upsert({ 'email': 'jon@example.com', 'name': 'Jon' }, unique_by=['email'])
+#
+# Returns the inserted, updated or untouched record. Validations are not run,
+# and counter caches are not adjusted for records created this way.
+@classmethod
+def upsert(cls, attrs, unique_by=['id'], update=None):
+  return cls.upsert_all([attrs], unique_by, update)[0]
+
+# Similar to .upsert(), but for many rows at once. Every row must provide the
+# same attributes. Returns the record of each row, in the same order.
+#
+# Databases which can't resolve conflicting inserts themselves get a lookup
+# and an insert or update for each row instead, in a single transaction.
+# Records the database can't return from the insert itself are looked up
+# afterwards.
+@classmethod
+def upsert_all(cls, rows, unique_by=['id'], update=None):
+  if not rows:
+    return []
+
+  columns = rows[0].keys()
+  if update is None:
+    update = [col for col in columns if col not in unique_by]
+  for row in rows:
+    if sorted(row.keys()) != sorted(columns):
+      raise ValueError('Every row given to upsert_all() must have the same attributes')
+  missing = [col for col in unique_by if col not in columns]
+  if missing:
+    raise ValueError('The rows given to upsert_all() must provide %s' % ', '.join(missing))
+
+  if not DB_ADAPTER.supports_upsert:
+    _upsert_each(cls, rows, columns, unique_by, update)
+    return _upserted(cls, rows, unique_by, [])
+
+  arel_table = cls.arel_table.columns(*columns)
+  for row in rows:
+    arel_table = arel_table.values(*[row[col] for col in columns])
+  arel_table = arel_table.on_conflict(*unique_by, update=update).returning('*')
+
+  found = DB_ADAPTER.insert(arel_table)
+  if not DB_ADAPTER.supports_returning:
+    found = []
+  return _upserted(cls, rows, unique_by, found)
+
 # Finds the record with the given id, updates it with the provided attributes,
 # saves the record, and returns a new instance from that record.
 @classmethod
@@ -32,13 +101,49 @@ def update(cls, row_id, **attrs):
 def destroy(cls, ids):
   arel_table = cls.arel_table.where(id=ids)
   records = DB_ADAPTER.find(arel_table)
-  DB_ADAPTER.delete(arel_table)
+
+  with DB_ADAPTER.transaction():
+    update_counters(cls.table_name, [record.values for record in records], -1)
+    DB_ADAPTER.delete(arel_table)
+
+  # Don't hand the destroyed records out of a batching scope's cache.
+  if loader.scope():
+    loader.scope().forget(cls, [record.values['id'] for record in records])
 
   if len(records) == 1:
     return cls(records[0])
   return [cls(record) for record in records]
 
 
+# Recalculate the counter caches of the named has_many associations (or all of
+# this model's counter caches if none are named) from the child tables. Useful
+# to repair counts after children have been changed outside of active record.
+#
+#   Post.reset_counters('comments')
+@classmethod
+def reset_counters(cls, *names):
+  associations = getattr(cls, 'associations', {})
+  if not names:
+    names = [name for name, association in associations.iteritems()
+             if getattr(association, 'counter_column', None)]
+
+  with DB_ADAPTER.transaction():
+    for name in names:
+      association = associations[name]
+      if not getattr(association, 'counter_column', None):
+        raise ValueError('"%s" does not keep a counter cache' % name)
+
+      DB_ADAPTER.reset_counters(cls.table_name, association.counter_column,
+          association.child_table, association.column, commit=False)
+
+# Rebuild this model's full-text search index from the table. The index is kept
+# up to date as records change, so this is only needed after loading data with
+# the index out of the way, or to repair it.
+@classmethod
+def rebuild_search_index(cls):
+  DB_ADAPTER.rebuild_search_index(cls.table_name)
+
+
 # Set the attributes dictionary of this instance (it's record) equal to the
 # dictionary of attributes that are passed in, then save this instance through
 # the normal procedure.
@@ -86,6 +191,46 @@ def validate(self, validations=None):
   return True
 
 
+# Validate a list of instances of this model in one pass, returning a list of
+# booleans aligned with `instances`. Each validation checks the whole list at
+# once, so built-in rules like uniqueness cost one query per batch rather than
+# one per record.
+@classmethod
+def validate_all(cls, instances, validations=None):
+  if validations is None:
+    validations = getattr(cls, 'validations', [])
+
+  results = [True] * len(instances)
+  for validation in validations:
+    pending = [i for i, passed in enumerate(results) if passed]
+    if not pending:
+      break
+    passed = validation.validate_all([instances[i] for i in pending])
+    for i, ok in zip(pending, passed):
+      results[i] = ok
+
+  return results
+
+# Save many instances of this model in a single transaction, validating them
+# together first (see .validate_all()). Returns a list aligned with
+# `instances`, holding each saved instance, or False for those which failed
+# validation. With fail_hard, nothing is saved if any instance is invalid.
+@classmethod
+def save_all(cls, instances, validate=True, fail_hard=False):
+  results = [True] * len(instances)
+  if validate:
+    results = cls.validate_all(instances)
+    if fail_hard and not all(results):
+      raise Exception('One or more validations did not pass')
+
+  with DB_ADAPTER.transaction():
+    for i, inst in enumerate(instances):
+      if results[i]:
+        results[i] = inst.save(False)
+
+  return results
+
+
 # Save this instance to the database.
 #
 # If validate is set to True, this instance will only be saved if it passes
@@ -98,6 +243,10 @@ def validate(self, validations=None):
 #
 # Save errors are to be dealt with by the database adapter and are therefore
 # not referenced here.
+#
+# If the model is locked (see locking.py), this method raises
+# StaleObjectError when the record was changed by someone else since it was
+# read, leaving this instance unchanged.
 def save(self, validate=True, fail_hard=False):
   if validate and not self.validate():
     if fail_hard:
@@ -105,17 +254,26 @@ def save(self, validate=True, fail_hard=False):
     else:
       return False
 
-  attrs = self.record.values
+  attrs  = self.record.values
+  column = _locking_column(self)
 
-  if self.exists:
-    arel_table = self.arel_table.set(**attrs).where(**{ 'id': self.id })
-    DB_ADAPTER.update(arel_table)
+  if self.exists and column:
+    _update_locked(self, attrs, column)
+  elif self.exists:
+    DB_ADAPTER.update(_stored(self).set(**attrs))
   else:
+    if column and attrs.get(column) is None:
+      attrs[column] = 0
     arel_table = self.arel_table.columns(*attrs.keys()).values(*attrs.values())
-    DB_ADAPTER.insert(arel_table)
-    self.id = DB_ADAPTER.last_inserted()
+    # The insert and any counter caches it affects are committed together.
+    with DB_ADAPTER.transaction():
+      DB_ADAPTER.insert(arel_table)
+      self.id = DB_ADAPTER.last_inserted()
+      update_counters(self.table_name, [attrs], 1)
 
   self.exists = True
+  if getattr(self.model, 'shard_key', None):
+    self.stored_shard_value = attrs.get(self.model.shard_key.column)
   return self
 
 # Reload this instance with the latest information from the database.
@@ -126,3 +284,65 @@ def reload(self):
   self = self.save().find(self.id)
 
   return self
+
+
+
+# HELPERS
+
+# The query matching this instance's record as it is stored. The records of
+# sharded models are matched by their stored shard key as well, which routes
+# the query to the shard holding them rather than to every shard.
+def _stored(self):
+  arel_table = self.arel_table.where(**{ 'id': self.id })
+  if self.stored_shard_value is not None:
+    arel_table = arel_table.where(**{ self.model.shard_key.column: self.stored_shard_value })
+  return arel_table
+
+# The locking column of this instance's model, if its table has one.
+def _locking_column(self):
+  column = self.locking_column
+  if column and column in DB_ADAPTER.column_types(self.table_name):
+    return column
+
+# Update the record only if its version is still the one this instance was
+# read with, moving the version on by one.
+def _update_locked(self, attrs, column):
+  version = attrs.get(column)
+  attrs[column] = (version or 0) + 1
+  try:
+    arel_table = _stored(self).set(**attrs)
+    if version is None:
+      arel_table = arel_table.where('%s IS NULL' % column)
+    else:
+      arel_table = arel_table.where(**{ column: version })
+    DB_ADAPTER.update(arel_table)
+    if DB_ADAPTER.rows_affected() == 0:
+      raise StaleObjectError(self)
+  except:
+    attrs[column] = version
+    raise
+
+# Insert each row, or update the existing record with the same unique_by
+# values, for databases without upserts.
+def _upsert_each(cls, rows, columns, unique_by, update):
+  with DB_ADAPTER.transaction():
+    for row in rows:
+      key = dict((col, row[col]) for col in unique_by)
+      if not DB_ADAPTER.find(cls.arel_table.where(**key).limit(1)):
+        DB_ADAPTER.insert(cls.arel_table.columns(*columns).values(*[row[col] for col in columns]))
+      elif update:
+        DB_ADAPTER.update(cls.arel_table.where(**key).set(**dict((col, row[col]) for col in update)))
+
+# The record of each upserted row, from the records the insert returned where
+# possible. Rows left untouched (or any, if the database can't return them)
+# are looked up.
+def _upserted(cls, rows, unique_by, found):
+  returned = {}
+  for record in found:
+    returned[tuple(record.values.get(col) for col in unique_by)] = cls(record, True)
+
+  records = []
+  for row in rows:
+    key = tuple(row[col] for col in unique_by)
+    records.append(returned.get(key) or cls.find_by(**dict(zip(unique_by, key))))
+  return records
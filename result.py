@@ -1,17 +1,28 @@
 from datetime import date, datetime
 from time import time
 
+# The model instances created from the records of a single query. Each of them
+# keeps a reference to the whole list (as .siblings), so that work can be done
+# for all of them at once, like fetching deferred columns, or noticing when an
+# association is being loaded for each of them in turn (see instrumentation.py).
+class Siblings(list):
+  pass
+
+
 # An object representation of a record retrieved by a database adapter. It is
 # on the database adapter to instantiate these objects when returning results.
 class Result(object):
   # Parse the data provided into a list of Result objects. Records is the cursor
   # object returned from query execution, containing the data to be placed into
-  # each Result object.
+  # each Result object. If given, convert is applied to the whole list of rows
+  # before they are parsed (see SQLAdapter._pipeline).
   @classmethod
-  def parse_all(self, records):
+  def parse_all(self, records, convert=None):
     if not records.description:
       return []
     columns = [col[0] for col in records.description]
+    if convert:
+      records = convert(records.fetchall())
     return [Result(columns, record) for record in records]
 
   # Return a new Result object from the provided attribute dictionary. This
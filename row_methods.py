@@ -0,0 +1,56 @@
+from collections import namedtuple
+from itertools import izip
+
+from active_record.setup import *
+
+# Row Methods
+#
+# These methods return the records matched by a relation as plain rows instead
+# of model instances, for code which only reads them (serialising an API
+# response, say). No model instances or Result objects are created, and values
+# are converted to Python types a batch at a time, so this is about as fast as
+# using the database driver directly.
+#
+# Rows are read lazily: each method returns an iterator, which fetches them
+# from the database a batch at a time as it is consumed, so a relation of any
+# size can be read in flat memory. Use list() to read them all at once:
+#
+#     json.dumps(list(Person.relation.where(age=(18, None)).as_dicts()))
+#
+# Deferred columns are left out unless undeferred, and the rows of sharded
+# models are not merged into any .order() across shards (see .stream() on the
+# database adapter).
+
+# Iterate over the matched records as tuples, in the order of the selected
+# columns.
+def as_tuples(self, batch_size=1000):
+  for columns, rows in DB_ADAPTER.stream(self.arel_table, batch_size):
+    for row in rows:
+      yield row
+
+# Iterate over the matched records as dictionaries, keyed by column name.
+def as_dicts(self, batch_size=1000):
+  for columns, rows in DB_ADAPTER.stream(self.arel_table, batch_size):
+    for row in rows:
+      yield dict(izip(columns, row))
+
+# Iterate over the matched records as named tuples, whose fields are the
+# columns. The class is created once for each model and set of columns.
+def as_namedtuples(self, batch_size=1000):
+  for columns, rows in DB_ADAPTER.stream(self.arel_table, batch_size):
+    make = _row_class(self.model, columns)._make
+    for row in rows:
+      yield make(row)
+
+
+
+# HELPERS
+_row_classes = {}
+
+# Columns which aren't valid field names (like aggregates without an alias)
+# are renamed to their position, as _0, _1, etc.
+def _row_class(model, columns):
+  key = (model, tuple(columns))
+  if key not in _row_classes:
+    _row_classes[key] = namedtuple('%sRow' % model.__name__, columns, rename=True)
+  return _row_classes[key]
@@ -0,0 +1,341 @@
+import time
+from collections import OrderedDict
+
+# Migrator
+#
+# Brings an existing table in line with its definition in the schema (a
+# schema.table.Table), without losing the data it holds.
+#
+# The table in the database is compared with its definition first (see
+# .diff()). Changes that SQLite can make in place (new columns which are
+# nullable or have a default, new or removed indexes) are made directly, which
+# is instant regardless of the size of the table.
+#
+# Anything else (removed columns, changes to a column's type or constraints,
+# new foreign keys, ...) requires the table to be rebuilt. This is done
+# "online", so the table stays usable while it happens:
+#
+#   1. A shadow table is created with the new definition.
+#   2. Triggers on the old table copy every insert, update and delete into the
+#      shadow table from then on.
+#   3. The existing rows are copied into the shadow table in batches, ordered
+#      by id, each batch in a short transaction of its own. Rows which the
+#      triggers have already copied are left as they are, as they are newer.
+#   4. The old table is dropped and the shadow table renamed into its place,
+#      along with its indexes, in a single transaction.
+#
+# Only the last step holds a lock on the table for more than one batch, and it
+# does no copying. Columns are copied by name, so values of columns whose type
+# changed are converted by the database.
+#
+# Options:
+#   - batch_size:  The number of rows copied per transaction.
+#   - pause:       Seconds to sleep between batches, to leave room for other
+#                  writers (throttling).
+#   - progress:    A callable which is passed the table name, the number of rows
+#                  copied so far and the total, after each batch.
+class Migrator(object):
+  def __init__(self, adapter, batch_size=1000, pause=0, progress=None):
+    self.adapter    = adapter
+    self.batch_size = batch_size
+    self.pause      = pause
+    self.progress   = progress
+
+  # Return a TableDiff describing how the table in the database differs from
+  # the given definition.
+  def diff(self, table_def):
+    diff = TableDiff(table_def.name)
+    existing = self._columns(table_def.name)
+    if not existing:
+      diff.exists = False
+      return diff
+
+    for name, options in table_def.columns.iteritems():
+      if name not in existing:
+        diff.added.append(name)
+      elif self._column(options) != existing[name]:
+        diff.changed.append(name)
+    diff.removed = [name for name in existing if name not in table_def.columns]
+
+    indexes = self.adapter.indexes(table_def.name)
+    for name, index in table_def.indexes.iteritems():
+      if name not in indexes or self._index_columns(name) != index['columns'] or \
+         indexes[name] != bool(index['unique']):
+        diff.added_indexes[name] = index
+    diff.dropped_indexes = [name for name in indexes
+                            if name not in table_def.indexes or name in diff.added_indexes]
+
+    diff.addable = all(self._addable(table_def.columns[name]) for name in diff.added)
+    return diff
+
+  # Apply the definition to the database, returning the TableDiff that was
+  # applied. Tables which don't exist yet are simply created.
+  def migrate(self, table_def):
+    diff = self.diff(table_def)
+    if not diff.exists:
+      self.adapter.create_table(table_def)
+    elif diff.rebuild:
+      self._rebuild(table_def, diff)
+    elif not diff.empty:
+      self._alter(table_def, diff)
+
+    if diff.exists and table_def.search_index:
+      self._sync_search_index(table_def, diff)
+    return diff
+
+
+
+  # HELPERS
+  # Changes which don't need a rebuild.
+  def _alter(self, table_def, diff):
+    adapter = self.adapter
+    statements = ["""DROP INDEX %s""" % name for name in diff.dropped_indexes]
+    for name in diff.added:
+      statements.append("""ALTER TABLE %s ADD COLUMN %s""" % \
+          (table_def.name, adapter._column_sql(name, table_def.columns[name])))
+    for name, index in diff.added_indexes.iteritems():
+      statements.append(adapter._index_sql(table_def.name, name, index))
+
+    self._atomically(statements)
+
+  def _rebuild(self, table_def, diff):
+    for column in diff.added:
+      options = table_def.columns[column]
+      if options['not_null'] and not options['default']:
+        raise ValueError('Can not add "%s" to "%s": existing rows need a default for NOT NULL columns' % \
+            (column, table_def.name))
+
+    adapter = self.adapter
+    name = table_def.name
+    shadow = _shadow_name(name)
+    copied = [col for col in table_def.columns if col not in diff.added]
+
+    # 1, 2. The shadow table, and the triggers which keep it up to date.
+    self._atomically(_cleanup_sql(shadow) +
+                     ["""CREATE TABLE %s""" % adapter._table_sql(_renamed(table_def, shadow))] +
+                     _trigger_sql(name, shadow, copied))
+
+    # 3. The existing rows, a batch at a time. If any of them don't fit the
+    # new definition, the table is left as it was.
+    try:
+      total = adapter.conn.execute("""SELECT COUNT(*) FROM %s""" % name).fetchone()[0]
+      done, last_id = 0, None
+      while True:
+        with adapter.transaction():
+          last_id, count = self._copy_batch(name, shadow, copied, last_id)
+        done += count
+        if self.progress:
+          self.progress(name, done, total)
+        if count < self.batch_size:
+          break
+        if self.pause:
+          time.sleep(self.pause)
+    except Exception:
+      self._atomically(_cleanup_sql(shadow))
+      raise
+
+    # 4. The swap. Foreign key enforcement can't be changed inside a
+    # transaction, and would otherwise act on the rows of the dropped table.
+    # Dropping the table drops its triggers, so change tracking (see
+    # change_feed.py) is set up again in the same transaction.
+    tracking = []
+    if self._tracks_changes(name):
+      tracking = adapter._change_trigger_sql(name)
+
+    foreign_keys = adapter.conn.execute("""PRAGMA foreign_keys""").fetchone()[0]
+    self._autocommit("""PRAGMA foreign_keys = 0""")
+    try:
+      self._atomically(["""DROP TABLE %s""" % name,
+                        """ALTER TABLE %s RENAME TO %s""" % (shadow, name)] +
+                       [adapter._index_sql(name, index_name, index)
+                        for index_name, index in table_def.indexes.iteritems()] +
+                       tracking)
+    finally:
+      self._autocommit("""PRAGMA foreign_keys = %d""" % foreign_keys)
+
+  # Create the table's full-text index if it's new, or its columns changed, and
+  # re-index the table if the index was (re)created or the table was rebuilt.
+  # A rebuild drops the triggers which keep the index up to date, so they are
+  # always recreated.
+  def _sync_search_index(self, table_def, diff):
+    adapter = self.adapter
+    search = adapter._search_table(table_def.name)
+    search_index = table_def.search_index
+
+    indexed = list(adapter.column_types(search))
+    if indexed and indexed != search_index['columns']:
+      self._atomically(["""DROP TRIGGER IF EXISTS %s_%s""" % (search, event)
+                        for event in ('insert', 'update', 'delete')] +
+                       ["""DROP TABLE %s""" % search])
+      indexed = []
+
+    adapter.create_search_index(table_def.name, search_index['columns'], search_index['tokenize'])
+    if not indexed or diff.rebuild:
+      adapter.rebuild_search_index(table_def.name)
+
+  def _tracks_changes(self, table_name):
+    trigger = self.adapter._change_trigger(table_name, 'insert')
+    return bool(self.adapter.conn.execute("""SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = '%s'""" \
+        % trigger).fetchall())
+
+  # Copy the next batch of rows after last_id, returning the last id copied and
+  # the number of rows in the batch. Rows the triggers have copied already are
+  # skipped.
+  def _copy_batch(self, name, shadow, columns, last_id):
+    after = ''
+    if last_id is not None:
+      after = 'WHERE id > %d' % last_id
+    ids = [row[0] for row in self.adapter.cursor.execute("""SELECT id FROM %s %s ORDER BY id LIMIT %d""" % \
+        (name, after, self.batch_size)).fetchall()]
+    if not ids:
+      return last_id, 0
+
+    columns = ', '.join(columns)
+    self.adapter.cursor.execute("""INSERT INTO %s (%s) SELECT %s FROM %s WHERE id BETWEEN %d AND %d
+        AND id NOT IN (SELECT id FROM %s WHERE id BETWEEN %d AND %d)""" % \
+        (shadow, columns, columns, name, ids[0], ids[-1], shadow, ids[0], ids[-1]))
+    return ids[-1], len(ids)
+
+  # Run the statements in a single transaction. Schema changes are
+  # transactional in SQLite, so either all of them are made or none are.
+  def _atomically(self, statements):
+    def run(conn):
+      conn.execute("""BEGIN IMMEDIATE""")
+      try:
+        for sql in statements:
+          conn.execute(sql)
+      except Exception:
+        conn.execute("""ROLLBACK""")
+        raise
+      conn.execute("""COMMIT""")
+
+    self._autocommit(run)
+
+  # Run a statement (or a function of the connection) outside of any
+  # transaction. The adapter's connection leaves transactions to us (see
+  # SQLite3Adapter._connect()), so each statement is committed as it runs.
+  def _autocommit(self, sql):
+    conn = self.adapter.conn
+    try:
+      if callable(sql):
+        sql(conn)
+      else:
+        conn.execute(sql)
+    finally:
+      self.adapter._clear_caches()
+
+  # The existing columns of the table, keyed by name, in the same form as
+  # ._column() gives for a definition. The SELECT forms of the PRAGMAs are used
+  # so that an open transaction isn't ended.
+  def _columns(self, table_name):
+    conn = self.adapter.conn
+    unique = set()
+    for index in conn.execute("""SELECT * FROM pragma_index_list('%s')""" % table_name).fetchall():
+      if index[3] == 'u':
+        info = conn.execute("""SELECT * FROM pragma_index_info('%s')""" % index[1]).fetchall()
+        if len(info) == 1:
+          unique.add(info[0][2])
+
+    foreign_keys = {}
+    for key in conn.execute("""SELECT * FROM pragma_foreign_key_list('%s')""" % table_name).fetchall():
+      foreign_keys[key[3]] = (key[2], key[4])
+
+    columns = OrderedDict()
+    for _, name, sql_type, not_null, default, pk in conn.execute( \
+        """SELECT * FROM pragma_table_info('%s')""" % table_name).fetchall():
+      columns[name] = (sql_type.upper(), bool(not_null), default, bool(pk), name in unique,
+                       foreign_keys.get(name))
+    return columns
+
+  def _column(self, options):
+    default = None
+    if options['default']:
+      default = str(self.adapter._type_casted(options['type_def'][0], options['default']))
+    foreign_key = options.get('foreign_key')
+    if foreign_key:
+      foreign_key = (foreign_key['table'], foreign_key['column'])
+
+    return (self.adapter._type_to_db(options['type_def']).upper(), bool(options['not_null']),
+            default, bool(options['primary_key']), bool(options['unique']), foreign_key)
+
+  def _index_columns(self, name):
+    info = self.adapter.conn.execute("""SELECT * FROM pragma_index_info('%s')""" % name).fetchall()
+    return [col[2] for col in info]
+
+  # SQLite can only add columns which it can fill in for the existing rows,
+  # and which don't need a constraint of their own.
+  def _addable(self, options):
+    if options['primary_key'] or options['unique'] or 'foreign_key' in options:
+      return False
+    if options['default'] is True:
+      return False
+    return not options['not_null'] or bool(options['default'])
+
+
+# The differences between a table's definition and the table in the database.
+class TableDiff(object):
+  def __init__(self, table_name):
+    self.table_name      = table_name
+    self.exists          = True
+    self.added           = []
+    self.removed         = []
+    self.changed         = []
+    self.added_indexes   = OrderedDict()
+    self.dropped_indexes = []
+    self.addable         = True
+
+  # Whether the table already matches its definition.
+  @property
+  def empty(self):
+    return self.exists and not (self.added or self.removed or self.changed or
+                                self.added_indexes or self.dropped_indexes)
+
+  # Whether the table has to be rebuilt to match its definition.
+  @property
+  def rebuild(self):
+    return self.exists and bool(self.removed or self.changed or not self.addable)
+
+  def __str__(self):
+    if not self.exists:
+      return '%s: create' % self.table_name
+    changes = []
+    for label, names in (('add', self.added), ('remove', self.removed), ('change', self.changed),
+                         ('add index', self.added_indexes.keys()), ('drop index', self.dropped_indexes)):
+      if names:
+        changes.append('%s %s' % (label, ', '.join(names)))
+    return '%s: %s' % (self.table_name, '; '.join(changes) or 'no changes')
+
+
+def _shadow_name(table_name):
+  return '_%s_migration' % table_name
+
+# A copy of the table definition under another name.
+def _renamed(table_def, name):
+  renamed = type(table_def).__new__(type(table_def))
+  renamed.__dict__.update(table_def.__dict__)
+  renamed.name = name
+  return renamed
+
+# Remove a shadow table, and the triggers which feed it, left by an earlier
+# migration.
+def _cleanup_sql(shadow):
+  prefix = '%s_sync' % shadow
+  return ["""DROP TRIGGER IF EXISTS %s_%s""" % (prefix, event) for event in ('insert', 'update', 'delete')] + \
+         ["""DROP TABLE IF EXISTS %s""" % shadow]
+
+# Triggers which mirror every change to the table into the shadow table, for
+# the columns they have in common.
+def _trigger_sql(table_name, shadow, columns):
+  names = ', '.join(columns)
+  new_values = ', '.join('NEW.%s' % col for col in columns)
+  prefix = '%s_sync' % shadow
+
+  return [
+    """CREATE TRIGGER %s_insert AFTER INSERT ON %s BEGIN
+         INSERT OR REPLACE INTO %s (%s) VALUES (%s); END""" % (prefix, table_name, shadow, names, new_values),
+    """CREATE TRIGGER %s_update AFTER UPDATE ON %s BEGIN
+         DELETE FROM %s WHERE id = OLD.id;
+         INSERT OR REPLACE INTO %s (%s) VALUES (%s); END""" % (prefix, table_name, shadow, shadow, names, new_values),
+    """CREATE TRIGGER %s_delete AFTER DELETE ON %s BEGIN
+         DELETE FROM %s WHERE id = OLD.id; END""" % (prefix, table_name, shadow)
+  ]
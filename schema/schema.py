@@ -11,11 +11,30 @@ class Schema(object):
     self.tables[table_name] = Table(table_name)
     return self.tables[table_name]
 
-  def load(self, force=False):
+  # Create the tables in the database. With `force`, existing tables are
+  # dropped and created again, losing their data.
+  #
+  # With `migrate`, existing tables are altered to match their definitions
+  # instead, keeping their data (see schema/migrator.py). Any other options
+  # (batch_size, pause, progress) are passed on to the migrator. Returns the
+  # list of changes made to each table.
+  #
+  # With `track_changes`, every change to the tables (or to those named, if a
+  # list of names is given) is logged, to be followed with a ChangeFeed (see
+  # change_feed.py).
+  def load(self, force=False, migrate=False, track_changes=False, **options):
+    diffs = []
     for name, table in self.tables.iteritems():
-      if force:
-        DB_ADAPTER.drop_table(name)
-      DB_ADAPTER.create_table(table)
+      if migrate:
+        diffs.append(DB_ADAPTER.migrate_table(table, **options))
+      else:
+        if force:
+          DB_ADAPTER.drop_table(name)
+        DB_ADAPTER.create_table(table)
+
+      if track_changes is True or (track_changes and name in track_changes):
+        DB_ADAPTER.track_changes(name)
+    return diffs
 
 
   ### TESTING ###
@@ -43,6 +43,15 @@ class Table(object):
     #     - timestamp
     self.columns = { }
 
+    # Indexes are keyed by name, each defined as:
+    #   { columns: [<column>, ...], unique: False | True }
+    self.indexes = { }
+
+    # Columns which can be searched with .search() on a relation, backed by a
+    # full-text index. Defined as:
+    #   { columns: [<column>, ...], tokenize: None | <tokenizer> }
+    self.search_index = None
+
     # ID is included by default as the primary key for the table. To remove it
     # from a table, include .remove_column('id') in your schema definition. To
     # modify it, use .change_column('id', int, [options]) instead.
@@ -129,6 +138,26 @@ class Table(object):
     options['type_def'] = ('timestamp',)
     self.add_column(name, **options)
 
+  # Add an index over the given columns. Unique indexes also let the database
+  # resolve conflicting inserts itself (see Model.upsert()). The name defaults
+  # to "index_<table>_on_<columns>".
+  def index(self, *columns, **options):
+    name = options.get('name') or 'index_%s_on_%s' % (self.name, '_and_'.join(columns))
+    self.indexes[name] = {
+      'columns': list(columns),
+      'unique': options.get('unique', False)
+    }
+
+  # Index the given (text) columns for full-text search, which models of this
+  # table can then do with .search(). `tokenize` picks how text is split into
+  # words, using the database's own tokenizer names (for SQLite, for example,
+  # 'porter unicode61' to match words by their stem).
+  def full_text(self, *columns, **options):
+    self.search_index = {
+      'columns': list(columns),
+      'tokenize': options.get('tokenize')
+    }
+
   # Adds a foreign key to this table. The type of association is irrelevant, and
   # will be determined later by the model definition. Note that the options
   # dictionary here is only for the foreign_key options, and should not contain
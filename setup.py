@@ -9,6 +9,9 @@
 #     INFLECTOR  -> An instance of inflect.engine(), done once for performance.
 #     DATABASE   -> The name of the database that active record is connected to.
 #     DB_ADAPTER -> The connection adapter instance that active record is using.
+#                   When read replicas or shards are configured, this is a
+#                   ReplicatedAdapter or ShardedAdapter which routes each
+#                   query to the right connection.
 
 import sys
 import yaml
@@ -33,6 +36,29 @@ __connection_adapters = __import__('connection_adapters', locals(), globals())
 # getattr() works as an "import" for submodules. It's complicated, but simple.
 db_module = getattr(__connection_adapters, db_config['adapter']+'_adapter')
 
+# Open an adapter for a single configuration entry. Entries inherit any
+# settings they don't define from the environment's own entry, so additional
+# connections (like replicas) only need to list what makes them different.
+def connect(config):
+  config = dict(db_config, **config)
+  config.pop('replicas', None)
+  config.pop('shards', None)
+  module = getattr(__connection_adapters, config['adapter']+'_adapter')
+  return module.new(config)
+
 # Connect to the database.
 DATABASE = db_config['name']
 DB_ADAPTER = db_module.new(db_config)
+
+# Spread reads across the read replicas, if there are any.
+if db_config.get('replicas'):
+  DB_ADAPTER = replicated_adapter.new(DB_ADAPTER, db_config, connect)
+
+# Spread the rows of sharded models across the shards, if there are any.
+if db_config.get('shards'):
+  DB_ADAPTER = sharded_adapter.new(DB_ADAPTER, db_config, connect)
+
+# Watch for N+1 queries in this environment, if asked to.
+if db_config.get('n_plus_one'):
+  import active_record.instrumentation as instrumentation
+  instrumentation.subscribe(instrumentation.NPlusOneDetector(action=db_config['n_plus_one']))
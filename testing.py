@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+
+from active_record.setup import *
+
+# Testing
+#
+# Sets up the database for tests once, rather than for every test. The schema
+# and fixtures are loaded a single time and snapshotted, and every test then
+# starts from a copy of that snapshot:
+#
+#     def seed():
+#       schema.load(force=True)
+#       Person.create(name='Jon')
+#
+#     fixtures = testing.snapshot(seed)
+#
+#     class PersonTest(unittest.TestCase):
+#       def setUp(self):
+#         fixtures.restore()
+#
+# Restoring copies the snapshot back over the database file, which takes about
+# as long as reading the file, whatever is in it. An in-memory database
+# (`name: ':memory:'` in database.yaml) is dumped as SQL and replayed instead.
+#
+# Cheaper still, a test can run inside a transaction which is rolled back
+# afterwards, leaving the database as the test found it:
+#
+#     def test_rename(self):
+#       with fixtures.isolated():
+#         Person.find(1).update_attribute('name', 'Jim')
+#
+# Transactions started by the code under test join the test's transaction. If
+# that transaction ends before the test does (the code committed or rolled it
+# back itself, say), the snapshot is restored instead. This is noticed with a
+# savepoint taken at the start of the test, which only survives as long as the
+# transaction does.
+#
+# The database is replaced underneath every other connection to it, so no
+# other connections should be open (buffered writers, worker processes, etc.).
+
+class Snapshot(object):
+  def __init__(self, adapter=None):
+    self.adapter = adapter or DB_ADAPTER
+    self.data    = self.adapter.snapshot()
+
+  # Put the database back as it was when the snapshot was taken.
+  def restore(self):
+    self.adapter.restore(self.data)
+
+  # Undo every change made inside the block (see above).
+  @contextmanager
+  def isolated(self):
+    kept = False
+    try:
+      with self.adapter.transaction():
+        self.adapter.query("""SAVEPOINT isolated""")
+        try:
+          yield self
+        finally:
+          kept = self._rolled_back()
+        raise _Undo()
+    except _Undo:
+      pass
+    finally:
+      if not kept:
+        self.restore()
+
+  # Roll back to the savepoint taken by .isolated(), returning False if it was
+  # lost along with the transaction.
+  def _rolled_back(self):
+    try:
+      self.adapter.query("""ROLLBACK TO isolated""")
+    except Exception:
+      return False
+    return True
+
+
+# Raised to make .transaction() roll back at the end of an isolated block.
+class _Undo(Exception):
+  pass
+
+
+# Run setup (if given), then take a snapshot of the database.
+def snapshot(setup=None, adapter=None):
+  if setup:
+    setup()
+  return Snapshot(adapter)
@@ -0,0 +1,61 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record.base import Base
+import active_record.attributes as attributes
+
+class Contact(Base):
+  pass
+
+class Stranger(Base):
+  pass
+
+class AttributesTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    table = schema.create_table('contacts')
+    table.string('first')
+    table.string('last')
+    table.string('city')
+    schema.load(force=True)
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('contacts')
+
+  # `first` and `last` are also relation methods, so they get no descriptor.
+  def test_writes_to_columns_named_after_methods_are_saved(self):
+    contact = Contact.create(first='Ned', last='Snow', city='Winterfell')
+    contact = Contact.find(contact.id)
+    contact.last = 'Stark'
+    contact.city = 'Kings Landing'
+    contact.save()
+
+    values = DB_ADAPTER.query("""SELECT last, city FROM contacts""")[0].values
+    self.assertEqual(values, { 'last': 'Stark', 'city': 'Kings Landing' })
+
+  # The metadata is only consulted again once the schema has changed.
+  def test_columns_are_defined_once_per_schema(self):
+    lookups = []
+    column_types = DB_ADAPTER.column_types
+    DB_ADAPTER.column_types = lambda table_name: lookups.append(table_name) or column_types(table_name)
+    try:
+      Contact(); Contact()
+      Stranger(); Stranger()
+      self.assertEqual(sorted(set(lookups)), ['contacts', 'strangers'])
+      self.assertEqual(len(lookups), 2)
+
+      schema = Schema()
+      schema.create_table('strangers').string('name')
+      schema.load()
+      Stranger(); Stranger()
+      self.assertEqual(lookups[2:], ['strangers'])
+      self.assertTrue(isinstance(Stranger.__dict__.get('name'), attributes.ColumnAttribute))
+    finally:
+      del DB_ADAPTER.column_types
+      DB_ADAPTER.drop_table('strangers')
+
+  # Tables that don't exist are only looked for once.
+  def test_missing_tables_are_remembered(self):
+    self.assertEqual(DB_ADAPTER.column_types('strangers'), {})
+    self.assertIn('strangers', DB_ADAPTER._column_types)
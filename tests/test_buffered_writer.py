@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from active_record.base import Base
+from active_record.macros import buffers_writes
+from active_record.connection_adapters.sqlite3_adapter import SQLite3Adapter
+from active_record.schema.table import Table
+import active_record.buffered_writer as buffered_writer
+import active_record.arel as arel
+
+class Ping(Base):
+  buffers_writes(batch_size=2, interval=0.01)
+
+# The writer's thread opens a connection of its own, so these tests write to a
+# database in a file of their own rather than to DB_ADAPTER.
+class BufferedWriterTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.adapter = SQLite3Adapter(os.path.join(self.dir, 'writer.db'))
+    table_def = Table('pings')
+    table_def.string('host')
+    table_def.integer('ms')
+    self.adapter.create_table(table_def)
+
+    self.db_adapter = buffered_writer.DB_ADAPTER
+    buffered_writer.DB_ADAPTER = self.adapter
+
+  def tearDown(self):
+    buffered_writer.close_all()
+    buffered_writer.DB_ADAPTER = self.db_adapter
+    shutil.rmtree(self.dir)
+
+  def writer(self, **options):
+    options = dict(Ping.write_buffer, **options)
+    writer = buffered_writer.BufferedWriter(Ping, **options)
+    self.addCleanup(writer.close)
+    return writer
+
+  def rows(self):
+    return sorted(record.values['ms'] for record in self.adapter.find(arel.Table.new('pings')))
+
+  def test_enqueued_records_are_written_in_batches(self):
+    writer = self.writer()
+    for ms in xrange(5):
+      writer.put({ 'host': 'a', 'ms': ms })
+    writer.flush()
+
+    self.assertEqual(self.rows(), range(5))
+    stats = writer.stats()
+    self.assertEqual((stats['enqueued'], stats['written'], stats['failed'], stats['depth']), (5, 5, 0, 0))
+    self.assertTrue(stats['batches'] >= 3)
+
+  def test_model_enqueue_and_close(self):
+    Ping.enqueue(host='b', ms=7)
+    Ping.enqueue(host='b', ms=8)
+    buffered_writer.close_all()
+    self.assertEqual(self.rows(), [7, 8])
+
+  def test_failed_batches_are_handed_to_on_error(self):
+    failed = []
+    writer = self.writer(retries=1, on_error=lambda rows, error: failed.extend(rows))
+    writer.put({ 'host': 'a', 'missing': 1 })
+    writer.flush()
+
+    self.assertEqual(failed, [{ 'host': 'a', 'missing': 1 }])
+    self.assertEqual(writer.stats()['failed'], 1)
+    self.assertTrue(writer.stats()['running'])
+
+  # The writer can't open its connection once the database's directory is gone.
+  def test_stopped_writers_raise(self):
+    gone = os.path.join(self.dir, 'gone')
+    os.mkdir(gone)
+    buffered_writer.DB_ADAPTER = SQLite3Adapter(os.path.join(gone, 'writer.db'))
+    shutil.rmtree(gone)
+    writer = self.writer()
+    writer.thread.join()
+
+    self.assertRaises(buffered_writer.WriterStopped, writer.put, { 'host': 'a', 'ms': 1 })
+    self.assertRaises(buffered_writer.WriterStopped, writer.flush)
+    self.assertTrue(writer.last_error)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record.base import Base
+from active_record.change_feed import ChangeFeed, prune
+import active_record.arel as arel
+
+class Ticket(Base):
+  pass
+
+class ChangeFeedTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    schema.create_table('tickets').string('subject')
+    schema.create_table('untracked_tickets').string('subject')
+    schema.load(force=True, track_changes=['tickets'])
+    self.table = arel.Table.new('tickets')
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('tickets')
+    DB_ADAPTER.drop_table('untracked_tickets')
+    DB_ADAPTER.drop_table(DB_ADAPTER.changelog_table)
+
+  def test_changes_are_read_in_order(self):
+    feed = ChangeFeed()
+    seen = []
+    feed.subscribe(seen.append)
+
+    ticket = Ticket.create(subject='Broken')
+    ticket.subject = 'Fixed'
+    ticket.save()
+    Ticket.destroy([ticket.id])
+
+    changes = feed.poll()
+    self.assertEqual([(change.table_name, change.row_id, change.op) for change in changes],
+                     [('tickets', ticket.id, 'insert'), ('tickets', ticket.id, 'update'),
+                      ('tickets', ticket.id, 'delete')])
+    self.assertEqual(seen, changes)
+    self.assertEqual(feed.poll(), [])
+
+  # A new feed starts after the latest change, unless told where to start.
+  def test_feeds_start_from_the_latest_change(self):
+    Ticket.create(subject='Old')
+    since = ChangeFeed().latest()
+    Ticket.create(subject='New')
+
+    self.assertEqual(len(ChangeFeed().poll()), 0)
+    self.assertEqual(len(ChangeFeed(since=since).poll()), 1)
+    self.assertEqual(len(ChangeFeed(since=0).poll()), 2)
+
+  def test_only_tracked_tables_are_logged(self):
+    feed = ChangeFeed(tables=['tickets'])
+    DB_ADAPTER.insert(arel.Table.new('untracked_tickets').columns('subject').values('Quiet'))
+    ticket = Ticket.create(subject='Loud')
+    self.assertEqual(feed.changed(), { 'tickets': set([ticket.id]) })
+
+  def test_polls_read_in_batches(self):
+    DB_ADAPTER.insert_many('tickets', ['subject'], [('t%d' % i,) for i in xrange(5)])
+    feed = ChangeFeed(since=0)
+    self.assertEqual([change.row_id for change in feed.poll(batch_size=2)], [1, 2, 3, 4, 5])
+    self.assertEqual(feed.position, feed.latest())
+
+  def test_prune_drops_old_changes(self):
+    Ticket.create(subject='Old')
+    DB_ADAPTER.query("""UPDATE %s SET changed_at = datetime('now', '-2 hours')""" % DB_ADAPTER.changelog_table)
+    new = Ticket.create(subject='New')
+
+    prune(3600)
+    self.assertEqual([change.row_id for change in ChangeFeed(since=0).poll()], [new.id])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import json
+from StringIO import StringIO
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record.base import Base
+from active_record.macros import defers
+
+class Letter(Base):
+  defers('body')
+
+class ExportsTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    table = schema.create_table('letters')
+    table.string('title')
+    table.text('body')
+    schema.load(force=True)
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('letters')
+
+  def test_deferred_columns_are_exported(self):
+    Letter.create(title='Hello', body='Dear reader')
+    out = StringIO()
+    Letter.relation.export_jsonl(out)
+    self.assertEqual(json.loads(out.getvalue())['body'], 'Dear reader')
+
+  def test_csv_of_an_empty_relation_has_a_header(self):
+    out = StringIO()
+    self.assertEqual(Letter.relation.export_csv(out), 0)
+    self.assertEqual(sorted(out.getvalue().strip().split(',')), ['body', 'id', 'title'])
+
+  def test_csv_has_a_row_per_record(self):
+    Letter.create(title='One', body='1')
+    Letter.create(title='Two', body='2')
+    out = StringIO()
+    self.assertEqual(Letter.relation.order(id='asc').export_csv(out, header=False), 2)
+    rows = [sorted(line.split(',')) for line in out.getvalue().splitlines()]
+    self.assertEqual(rows, [sorted(['1', 'One', '1']), sorted(['2', 'Two', '2'])])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record.base import Base
+import active_record.arel as arel
+
+class Visitor(Base):
+  pass
+
+class ImportsTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    table = schema.create_table('visitors')
+    table.string('name')
+    table.integer('visits')
+    schema.load(force=True)
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('visitors')
+    shutil.rmtree(self.dir)
+
+  def write(self, name, content):
+    path = os.path.join(self.dir, name)
+    with open(path, 'wb') as f:
+      f.write(content)
+    return path
+
+  def count(self):
+    return len(DB_ADAPTER.find(arel.Table.new('visitors')))
+
+  def test_csv_rows_are_loaded(self):
+    path = self.write('visitors.csv', 'name,visits\nAnn,3\nBob,\n')
+    self.assertEqual(Visitor.import_file(path)['rows'], 2)
+    self.assertEqual(Visitor.relation.where(name='Ann').all[0].visits, 3)
+    self.assertEqual(Visitor.relation.where(name='Bob').all[0].visits, None)
+
+  def test_empty_csv_loads_nothing(self):
+    path = self.write('visitors.csv', '')
+    self.assertEqual(Visitor.import_file(path)['rows'], 0)
+    self.assertEqual(self.count(), 0)
+
+  def test_insert_many_without_commit_joins_the_open_transaction(self):
+    DB_ADAPTER.begin_transaction()
+    DB_ADAPTER.insert_many('visitors', ['name'], [('Ann',), ('Bob',)], commit=False)
+    self.assertTrue(DB_ADAPTER.in_transaction)
+    DB_ADAPTER.rollback_transaction()
+    self.assertEqual(self.count(), 0)
+
+  def test_insert_many_commits_its_rows(self):
+    DB_ADAPTER.insert_many('visitors', ['name'], [('Ann',), ('Bob',)])
+    self.assertFalse(DB_ADAPTER.in_transaction)
+    self.assertEqual(self.count(), 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record.base import Base
+from active_record import instrumentation
+
+class Author(Base):
+  pass
+
+# Lists longer than the adapter's large_in_list are matched with a single bound
+# JSON array where the database supports it, and in chunks where it doesn't.
+class InListsTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    schema.create_table('authors').string('name')
+    schema.load(force=True)
+
+    self.size = DB_ADAPTER.large_in_list
+    DB_ADAPTER.insert_many('authors', ['name'], [('author %d' % i,) for i in xrange(self.size * 3)])
+    self.queries = []
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('authors')
+    if 'supports_json' in vars(DB_ADAPTER):
+      del DB_ADAPTER.supports_json
+
+  def found(self, ids):
+    with instrumentation.subscribed(self.queries.append):
+      return Author.relation.where(id=ids).all
+
+  def test_short_lists_are_written_out(self):
+    self.assertEqual(len(self.found(range(1, self.size + 1))), self.size)
+    self.assertNotIn('json_each', self.queries[0])
+
+  def test_long_lists_are_bound(self):
+    if not DB_ADAPTER.supports_json:
+      return
+    self.assertEqual(len(self.found(range(1, self.size + 2))), self.size + 1)
+    self.assertEqual(len(self.found(range(1, self.size * 2))), self.size * 2 - 1)
+    # Neither the values nor the length of the list show up in the SQL.
+    self.assertIn('json_each(:bound_0)', self.queries[0])
+    self.assertEqual(self.queries[0], self.queries[1])
+
+  def test_long_lists_are_chunked_without_json(self):
+    DB_ADAPTER.supports_json = False
+    self.assertEqual(len(self.found(range(1, self.size * 2 + 2))), self.size * 2 + 1)
+    self.assertEqual(self.queries[0].count(' IN ('), 3)
+
+  def test_destroy_many_ids(self):
+    ids = range(1, self.size * 2 + 1)
+    self.assertEqual(len(Author.destroy(ids)), len(ids))
+    self.assertEqual(len(Author.relation.all), self.size)
+
+  # Lookups queued with .find_later() are fetched by a single IN (...) query.
+  def test_preloading_many_records(self):
+    ids = range(1, self.size * 3 + 1)
+    deferred = [Author.find_later(row_id) for row_id in ids]
+    with instrumentation.subscribed(self.queries.append):
+      self.assertEqual([record.get().id for record in deferred], ids)
+    self.assertEqual(len(self.queries), 1)
+    self.assertEqual('json_each' in self.queries[0], DB_ADAPTER.supports_json)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema.table import Table
+import active_record.arel as arel
+
+class MigrationsTest(unittest.TestCase):
+  def setUp(self):
+    DB_ADAPTER.create_table(self.definition(), force=True)
+    DB_ADAPTER.insert_many('migration_tests', ['name', 'age', 'note'],
+                           [('p%d' % i, i, 'n%d' % i) for i in xrange(5)])
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('migration_tests')
+
+  def definition(self):
+    table_def = Table('migration_tests')
+    table_def.string('name')
+    table_def.integer('age')
+    table_def.string('note')
+    table_def.index('name')
+    return table_def
+
+  def rows(self):
+    return [record.values for record in DB_ADAPTER.find(arel.Table.new('migration_tests').order(id='asc'))]
+
+  def test_nullable_columns_are_added_in_place(self):
+    table_def = self.definition()
+    table_def.string('city')
+    diff = DB_ADAPTER.migrate_table(table_def)
+    self.assertEqual(diff.added, ['city'])
+    self.assertFalse(diff.rebuild)
+    self.assertEqual([row['city'] for row in self.rows()], [None] * 5)
+
+  def test_removing_a_column_rebuilds_the_table_in_batches(self):
+    table_def = self.definition()
+    table_def.remove_column('note')
+    progress = []
+    diff = DB_ADAPTER.migrate_table(table_def, batch_size=2, progress=lambda *args: progress.append(args))
+
+    self.assertTrue(diff.rebuild)
+    self.assertEqual(progress, [('migration_tests', 2, 5), ('migration_tests', 4, 5), ('migration_tests', 5, 5)])
+    self.assertEqual(self.rows(), [{ 'id': i + 1, 'name': 'p%d' % i, 'age': i } for i in xrange(5)])
+    self.assertEqual(DB_ADAPTER.indexes('migration_tests'), { 'index_migration_tests_on_name': False })
+    self.assertTrue(DB_ADAPTER.migrate_table(table_def).empty)
+
+  # Writes made while the rows are being copied reach the new table as well.
+  def test_writes_during_a_rebuild_are_kept(self):
+    table_def = self.definition()
+    table_def.remove_column('note')
+    table = arel.Table.new('migration_tests')
+
+    def write(name, done, total):
+      if done == 2:
+        DB_ADAPTER.insert(table.columns('name', 'age').values('late', 9))
+        DB_ADAPTER.update(table.where(id=5).set(name='changed'))
+
+    DB_ADAPTER.migrate_table(table_def, batch_size=2, progress=write)
+    names = [row['name'] for row in self.rows()]
+    self.assertEqual(names, ['p0', 'p1', 'p2', 'p3', 'changed', 'late'])
+
+  def test_changing_a_column_type_converts_its_values(self):
+    table_def = self.definition()
+    table_def.string('age')
+    DB_ADAPTER.migrate_table(table_def)
+    self.assertEqual([row['age'] for row in self.rows()], ['0', '1', '2', '3', '4'])
+
+  # Existing rows can't be given a value for a new NOT NULL column without a
+  # default, so the table is left as it was.
+  def test_impossible_rebuilds_leave_the_table_alone(self):
+    table_def = self.definition()
+    table_def.integer('rank', not_null=True)
+    self.assertRaises(ValueError, DB_ADAPTER.migrate_table, table_def)
+    self.assertEqual(len(self.rows()), 5)
+    self.assertNotIn('rank', DB_ADAPTER.column_types('migration_tests'))
+
+if __name__ == '__main__':
+  unittest.main()
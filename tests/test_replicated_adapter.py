@@ -0,0 +1,54 @@
+import unittest
+
+from active_record.connection_adapters.sqlite3_adapter import SQLite3Adapter
+from active_record.connection_adapters.replicated_adapter import ReplicatedAdapter
+from active_record.schema.table import Table
+import active_record.arel as arel
+
+# Every connection gets its own in-memory database holding a single row named
+# after it, so each read tells which connection answered it.
+class ReplicatedAdapterTest(unittest.TestCase):
+  def setUp(self):
+    self.table = arel.Table.new('replica_tests')
+
+  def adapter(self, balance):
+    primary  = self.connection('primary')
+    replicas = [(name, self.connection(name)) for name in ('r1', 'r2', 'r3')]
+    return ReplicatedAdapter(primary, replicas, balance)
+
+  def connection(self, name):
+    adapter = SQLite3Adapter(':memory:')
+    table_def = Table('replica_tests')
+    table_def.string('source')
+    adapter.create_table(table_def)
+    adapter.insert(self.table.columns('source').values(name))
+    return adapter
+
+  def sources(self, adapter, reads):
+    return [adapter.find(self.table)[0].values['source'] for _ in xrange(reads)]
+
+  def test_round_robin_takes_turns(self):
+    self.assertEqual(self.sources(self.adapter('round_robin'), 6), ['r1', 'r2', 'r3'] * 2)
+
+  def test_least_busy_spreads_reads_across_replicas(self):
+    self.assertEqual(sorted(set(self.sources(self.adapter('least_busy'), 6))), ['r1', 'r2', 'r3'])
+
+  def test_least_busy_avoids_busy_replicas(self):
+    adapter = self.adapter('least_busy')
+    adapter._busy['r1'] = adapter._busy['r2'] = 1
+    self.assertEqual(self.sources(adapter, 3), ['r3'] * 3)
+
+  def test_writes_and_transactions_use_the_primary(self):
+    adapter = self.adapter('round_robin')
+    adapter.insert(self.table.columns('source').values('written'))
+    self.assertEqual(len(adapter.primary.find(self.table)), 2)
+    with adapter.transaction():
+      self.assertEqual(self.sources(adapter, 2), ['primary'] * 2)
+
+  def test_using_picks_a_connection(self):
+    adapter = self.adapter('round_robin')
+    self.assertEqual(adapter.find(self.table.using('r2'))[0].values['source'], 'r2')
+    self.assertEqual(adapter.find(self.table.using('primary'))[0].values['source'], 'primary')
+
+if __name__ == '__main__':
+  unittest.main()
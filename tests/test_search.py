@@ -0,0 +1,55 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record.base import Base
+
+class Article(Base):
+  pass
+
+class SearchTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    table = schema.create_table('articles')
+    table.string('title', max_length=100)
+    table.text('body')
+    table.full_text('title', 'body')
+    schema.load(force=True)
+
+    Article.create(title='Tuning SQLite', body='Indexes make sqlite queries fast')
+    Article.create(title='Gardening', body='Tomatoes need sun')
+    Article.create(title='SQLite and sqlite', body='More about sqlite and its sqlite indexes')
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('articles')
+
+  def titles(self, relation):
+    return [article.title for article in relation.all]
+
+  def test_search_matches_best_first(self):
+    self.assertEqual(self.titles(Article.relation.search('sqlite')), ['SQLite and sqlite', 'Tuning SQLite'])
+    self.assertEqual(self.titles(Article.relation.search('sqlite NOT tuning')), ['SQLite and sqlite'])
+    self.assertEqual(self.titles(Article.relation.search('tomatoes').where(title='Tuning SQLite')), [])
+
+  def test_search_snippets(self):
+    found = Article.relation.search('tomatoes', snippet='body').all
+    self.assertEqual(found[0].snippet, '[Tomatoes] need sun')
+
+  def test_index_follows_changes(self):
+    article = Article.relation.search('gardening').all[0]
+    article.title = 'Growing tomatoes'
+    article.save()
+    self.assertEqual(self.titles(Article.relation.search('gardening')), [])
+    self.assertEqual(self.titles(Article.relation.search('growing')), ['Growing tomatoes'])
+
+    Article.destroy([article.id])
+    self.assertEqual(self.titles(Article.relation.search('tomatoes')), [])
+
+  def test_rebuilt_index_matches_the_table(self):
+    DB_ADAPTER.query("""DELETE FROM %s""" % DB_ADAPTER._search_table('articles'))
+    self.assertEqual(self.titles(Article.relation.search('sqlite')), [])
+    Article.rebuild_search_index()
+    self.assertEqual(len(self.titles(Article.relation.search('sqlite'))), 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from active_record.connection_adapters.sqlite3_adapter import SQLite3Adapter
+from active_record.connection_adapters.sharded_adapter import ShardedAdapter, ShardKey, shard_keys
+from active_record.schema.table import Table
+import active_record.arel as arel
+
+# Tenants below 100 live on shard `a`, the rest on shard `b`. Each test gets
+# fresh in-memory databases, and an adapter of its own.
+class ShardedAdapterTest(unittest.TestCase):
+  def setUp(self):
+    shard_keys['shard_tests'] = ShardKey('tenant_id', ranges=[(100, 'a'), (None, 'b')])
+    self.shards = [(name, SQLite3Adapter(':memory:', check_same_thread=False)) for name in ('a', 'b')]
+    self.adapter = ShardedAdapter(SQLite3Adapter(':memory:'), self.shards)
+
+    table_def = Table('shard_tests')
+    table_def.integer('tenant_id')
+    table_def.string('title')
+    self.adapter.create_table(table_def)
+    self.table = arel.Table.new('shard_tests')
+
+  def tearDown(self):
+    del shard_keys['shard_tests']
+
+  def insert(self, tenant_id, title):
+    self.adapter.insert(self.table.columns('tenant_id', 'title').values(tenant_id, title))
+    return self.adapter.last_inserted()
+
+  def titles(self, name):
+    return sorted(record.values['title'] for record in dict(self.shards)[name].find(self.table))
+
+  def test_inserts_are_routed_by_shard_key(self):
+    self.insert(1, 'low')
+    self.insert(200, 'high')
+    self.assertEqual(self.titles('a'), ['low'])
+    self.assertEqual(self.titles('b'), ['high'])
+
+  def test_reads_with_a_shard_key_only_ask_its_shard(self):
+    self.insert(1, 'low')
+    self.insert(200, 'high')
+    found = self.adapter.find(self.table.where(tenant_id=200))
+    self.assertEqual([record.values['title'] for record in found], ['high'])
+
+  def test_reads_without_a_shard_key_are_merged_in_order(self):
+    for tenant_id, title in ((1, 'c'), (200, 'a'), (2, 'b')):
+      self.insert(tenant_id, title)
+    found = self.adapter.find(self.table.order('title').limit(2))
+    self.assertEqual([record.values['title'] for record in found], ['a', 'b'])
+
+  def test_ids_are_unique_across_shards(self):
+    low = self.insert(1, 'low')
+    high = self.insert(200, 'high')
+    self.assertNotEqual(low, high)
+
+    found = self.adapter.find(self.table.where(id=low))
+    self.assertEqual([record.values['title'] for record in found], ['low'])
+
+  def test_delete_by_id_leaves_other_shards_alone(self):
+    low = self.insert(1, 'low')
+    self.insert(200, 'high')
+    self.adapter.delete(self.table.where(id=[low]))
+    self.assertEqual(self.titles('a'), [])
+    self.assertEqual(self.titles('b'), ['high'])
+
+  def test_insert_many_allocates_unique_ids(self):
+    self.adapter.insert_many('shard_tests', ['tenant_id', 'title'], [(1, 'low'), (200, 'high')])
+    ids = [record.values['id'] for record in self.adapter.find(self.table)]
+    self.assertEqual(len(set(ids)), 2)
+
+  def test_updates_can_not_move_rows_between_shards(self):
+    low = self.insert(1, 'low')
+    update = self.table.where(id=low, tenant_id=1).set(tenant_id=200)
+    self.assertRaises(ValueError, self.adapter.update, update)
@@ -0,0 +1,26 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+import active_record.arel as arel
+
+class SQLAdapterTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    schema.create_table('union_tests').integer('age')
+    schema.load(force=True)
+    DB_ADAPTER.insert_many('union_tests', ['age'], [(1,), (3,), (3,)])
+    self.table = arel.Table.new('union_tests')
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('union_tests')
+
+  # The limit of a unioned query applies to that query alone.
+  def test_union_keeps_the_limit_of_its_queries(self):
+    query = self.table.where(age=1).union(self.table.where(age=3).order(id='desc').limit(1))
+    ids = sorted(record.values['id'] for record in DB_ADAPTER.find(query))
+    self.assertEqual(ids, [1, 3])
+
+  def test_order_of_a_union_applies_to_every_row(self):
+    query = self.table.where(age=3).union(self.table.where(age=1)).order(id='asc')
+    self.assertEqual([record.values['id'] for record in DB_ADAPTER.find(query)], [1, 2, 3])
@@ -0,0 +1,47 @@
+import datetime
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+import active_record.arel as arel
+
+class SQLite3AdapterTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    schema.create_table('shifts').date('day')
+    rotas = schema.create_table('rotas')
+    rotas.integer('shift_id')
+    rotas.string('day')
+    schema.load(force=True)
+    DB_ADAPTER.insert(arel.Table.new('shifts').columns('day').values(datetime.date(2020, 1, 2)))
+    DB_ADAPTER.insert(arel.Table.new('rotas').columns('shift_id', 'day').values(1, 'Thursday'))
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('shifts')
+    DB_ADAPTER.drop_table('rotas')
+
+  def test_find_converts_dates(self):
+    found = DB_ADAPTER.find(arel.Table.new('shifts'))
+    self.assertEqual(found[0].values['day'], datetime.date(2020, 1, 2))
+
+  # Conversion is left to the adapter, rather than done by sqlite3 a value at
+  # a time.
+  def test_connection_returns_dates_as_stored(self):
+    self.assertEqual(DB_ADAPTER.conn.execute("""SELECT day FROM shifts""").fetchone()[0], '2020-01-02')
+
+  # Raw queries have no table to convert by, so their columns are looked up in
+  # the tables they read from.
+  def test_raw_query_converts_dates(self):
+    found = DB_ADAPTER.query("""SELECT * FROM shifts""")
+    self.assertEqual(found[0].values['day'], datetime.date(2020, 1, 2))
+
+  def test_raw_query_leaves_ambiguous_columns(self):
+    found = DB_ADAPTER.query("""SELECT rotas.day FROM shifts INNER JOIN rotas ON rotas.shift_id = shifts.id""")
+    self.assertEqual(found[0].values['day'], 'Thursday')
+
+  # Joined columns are converted by the type of their own table, even when the
+  # queried table has a column of the same name.
+  def test_joined_columns_are_converted_by_their_own_table(self):
+    query = arel.Table.new('shifts').join('rotas', on={ 'this': 'id', 'that': 'shift_id' }, cols=['day'])
+    self.assertEqual(DB_ADAPTER.find(query)[0].values['day'], 'Thursday')
+    self.assertEqual(list(DB_ADAPTER.stream(query))[0][1][0][-1], 'Thursday')
@@ -0,0 +1,41 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record import testing
+import active_record.arel as arel
+
+class SnapshotTest(unittest.TestCase):
+  def setUp(self):
+    def seed():
+      schema = Schema()
+      schema.create_table('snapshot_tests').string('name')
+      schema.load(force=True)
+      self.insert('seed')
+
+    self.table = arel.Table.new('snapshot_tests')
+    self.fixtures = testing.snapshot(seed)
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('snapshot_tests')
+
+  def insert(self, name):
+    DB_ADAPTER.insert(arel.Table.new('snapshot_tests').columns('name').values(name))
+
+  def names(self):
+    return [record.values['name'] for record in DB_ADAPTER.find(self.table)]
+
+  def test_isolated_rolls_back(self):
+    with self.fixtures.isolated():
+      self.insert('a')
+      DB_ADAPTER.find(self.table.with_cte('named', 'SELECT 1 AS n'))
+    self.assertEqual(self.names(), ['seed'])
+
+  # The code under test ended the transaction, so the snapshot is restored.
+  def test_isolated_restores_when_the_transaction_ends_early(self):
+    with self.fixtures.isolated():
+      self.insert('a')
+      DB_ADAPTER.end_transaction()
+      self.insert('b')
+    self.assertEqual(self.names(), ['seed'])
+    self.assertFalse(DB_ADAPTER.in_transaction)
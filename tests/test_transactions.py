@@ -0,0 +1,51 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+import active_record.arel as arel
+
+# These tests run against the database of the current environment, like the
+# rest of active record. Run them from a directory with a database.yaml,
+# preferably pointing at a scratch (or ':memory:') database:
+#
+#     python -m unittest discover -s active_record/tests -t .
+
+class TransactionTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    schema.create_table('transaction_tests').string('name')
+    schema.load(force=True)
+    self.table = arel.Table.new('transaction_tests')
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('transaction_tests')
+
+  def count(self):
+    return len(DB_ADAPTER.find(self.table))
+
+  def insert(self, name):
+    DB_ADAPTER.insert(self.table.columns('name').values(name))
+
+  def test_rollback(self):
+    with self.assertRaises(ValueError):
+      with DB_ADAPTER.transaction():
+        self.insert('a')
+        raise ValueError
+    self.assertEqual(self.count(), 0)
+
+  # Queries starting with WITH used to make the driver commit the open
+  # transaction before running them.
+  def test_rollback_around_cte_query(self):
+    with self.assertRaises(ValueError):
+      with DB_ADAPTER.transaction():
+        self.insert('a')
+        found = DB_ADAPTER.find(self.table.with_cte('named', 'SELECT 1 AS n').columns('name'))
+        self.assertEqual(len(found), 1)
+        raise ValueError
+    self.assertEqual(self.count(), 0)
+
+  def test_statements_outside_transactions_are_committed(self):
+    self.insert('a')
+    DB_ADAPTER.insert_many('transaction_tests', ['name'], [('b',), ('c',)])
+    self.assertFalse(DB_ADAPTER.in_transaction)
+    self.assertEqual(self.count(), 3)
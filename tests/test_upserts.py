@@ -0,0 +1,38 @@
+import unittest
+
+from active_record.setup import DB_ADAPTER
+from active_record.schema import Schema
+from active_record.base import Base
+from active_record.change_feed import ChangeFeed
+
+class Account(Base):
+  pass
+
+class UpsertTest(unittest.TestCase):
+  def setUp(self):
+    schema = Schema()
+    table = schema.create_table('accounts')
+    table.string('email')
+    table.string('name')
+    table.index('email', unique=True)
+    schema.load(force=True, track_changes=['accounts'])
+
+  def tearDown(self):
+    DB_ADAPTER.drop_table('accounts')
+
+  # The existing record is left alone, so no update is logged for it.
+  def test_find_or_create_does_not_touch_existing_records(self):
+    feed = ChangeFeed(tables=['accounts'])
+    created = Account.find_or_create(email='jon@example.com')
+    found = Account.find_or_create(email='jon@example.com')
+
+    self.assertEqual(found.id, created.id)
+    self.assertEqual([change.op for change in feed.poll()], ['insert'])
+
+  def test_upsert_all_returns_every_record_in_order(self):
+    Account.create(email='jon@example.com', name='Jon')
+    rows = [{ 'email': 'jon@example.com', 'name': 'John' }, { 'email': 'jane@example.com', 'name': 'Jane' }]
+
+    records = Account.upsert_all(rows, unique_by=['email'], update=[])
+    self.assertEqual([(record.email, record.name) for record in records],
+                     [('jon@example.com', 'Jon'), ('jane@example.com', 'Jane')])